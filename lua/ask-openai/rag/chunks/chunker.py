@@ -297,9 +297,8 @@ def build_ts_chunks_from_source_bytes(path: Path, file_hash: str, source_bytes:
         logger.debug_no_markup(str(node.text).replace("\\n", "\n"))
 
     def identify_chunks(node: Node, collected_parent: bool = False, level: int = 0) -> Iterator[IdentifiedChunk]:
-        # TODO make this async and take it all the way up to the indexer level (which is already async, and is already batched)... so I could actually batch process end to end and do some sort of localized grouping on chunk size still over in the indexer (embedder)... interesting!
-        #  would also allow me to get the embedding server going sooner (probably boost meaningful responsiveness when I have small batches of updates (i.e. after git commit) where starting the embedding server sooner would cut material % of time off overall for Time to First Embedding Batch
-        #  could even use multi worker arch to prepare next batch while server is embedding first batch(es) - producer/consumer?
+        # FYI producer/consumer across files is in indexer.EmbeddingPipeline (chunking overlaps encoding, per file)
+        #  PRN stream chunks out of a single (huge) file too? only matters if one file dominates an update
 
         # FYI use the following to search across parsers for who uses what node types, many grammars in this org:
         # two prominent orgs:
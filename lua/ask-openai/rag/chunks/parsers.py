@@ -5,6 +5,9 @@ from logs import get_logger
 
 logger = get_logger(__name__)
 
+# FYI parsers are cached PER PROCESS (i.e. each chunker pool worker has its own)
+#   tree-sitter parsers hold native state, they cannot be pickled nor shared across processes
+#   pool workers are spawned (not forked) => each starts w/ an empty cache, nothing is inherited
 parsers_by_language = {}
 
 def _get_cached_parser(language):
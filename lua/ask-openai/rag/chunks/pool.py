@@ -0,0 +1,56 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from chunks.chunker import RAGChunkerOptions, build_chunks_from_file, get_file_stat
+from index.storage import Chunk, FileStat
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+# below this, pool startup (spawn + imports per worker) costs more than it saves
+#   i.e. typical git hook run touches a handful of files => stay serial
+MIN_FILES_FOR_POOL = 32
+
+
+def stat_and_chunk_file(path: Path | str, options: RAGChunkerOptions) -> tuple[FileStat, list[Chunk]]:
+    """ all CPU bound work for one changed file: hash, tree-sitter parse, uncovered intervals, line ranges """
+    stat = get_file_stat(path)
+    chunks = build_chunks_from_file(path, stat.hash, options)
+    return stat, chunks
+
+
+class ChunkerPool:
+    """ chunk changed files across processes, results are identical to (and ordered like) the serial path """
+
+    def __init__(self, max_workers: int | None = None, min_files_for_pool: int = MIN_FILES_FOR_POOL):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.min_files_for_pool = min_files_for_pool
+        self._executor: ProcessPoolExecutor | None = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            logger.info(f"starting chunker pool with {self.max_workers} workers")
+            # spawn (not fork) => event loop threads, faiss/OpenMP threads, etc are not inherited half-initialized
+            #   also it's the default on macOS, so behavior is the same everywhere
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    def should_use_pool(self, num_files: int) -> bool:
+        return self.max_workers > 1 and num_files >= self.min_files_for_pool
+
+    async def stat_and_chunk(self, path: Path | str, options: RAGChunkerOptions) -> tuple[FileStat, list[Chunk]]:
+        """ on a pool worker, see should_use_pool (EmbeddingPipeline keeps submission order) """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), stat_and_chunk_file, path, options)
+
+    def shutdown(self):
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._executor = None
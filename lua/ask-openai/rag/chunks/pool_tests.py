@@ -0,0 +1,46 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from chunks.chunker import RAGChunkerOptions
+from chunks.pool import ChunkerPool, stat_and_chunk_file
+
+test_cases = Path(__file__).parent / "test_cases"
+
+
+def copy_test_cases(tmp_path: Path) -> list[Path]:
+    paths = []
+    for name in ["numbers.30.txt", "numbers.50.txt", "car.lua.txt", "duck.lua.txt", "unchanged.lua.txt"]:
+        path = tmp_path / name.removesuffix(".txt")
+        path.write_text((test_cases / name).read_text())
+        paths.append(path)
+    return paths
+
+
+@pytest.mark.asyncio
+async def test_pool_matches_serial_path(tmp_path):
+    paths = copy_test_cases(tmp_path)
+    options = RAGChunkerOptions.OnlyLineRangeChunks()
+
+    pool = ChunkerPool(max_workers=2, min_files_for_pool=0)
+    try:
+        assert pool.should_use_pool(len(paths))
+        # concurrent => spread across (spawned) workers, like EmbeddingPipeline
+        pooled = await asyncio.gather(*(pool.stat_and_chunk(path, options) for path in paths))
+    finally:
+        pool.shutdown()
+
+    serial = [stat_and_chunk_file(path, options) for path in paths]
+
+    for (pooled_stat, pooled_chunks), (serial_stat, serial_chunks) in zip(pooled, serial):
+        assert pooled_stat == serial_stat
+        assert pooled_chunks == serial_chunks
+
+
+def test_few_files_stay_serial(tmp_path):
+    paths = copy_test_cases(tmp_path)
+
+    assert not ChunkerPool(max_workers=4).should_use_pool(len(paths))
+    assert not ChunkerPool(max_workers=1, min_files_for_pool=0).should_use_pool(len(paths))
+    assert ChunkerPool(max_workers=4, min_files_for_pool=len(paths)).should_use_pool(len(paths))
@@ -10,10 +10,29 @@ from config.domains import (
     BASENAME_TO_SEMANTIC_DOMAIN,
     resolve_semantic_domain,
 )
+from config.adaptive_rerank import AdaptiveRerankConfig, parse_adaptive_rerank_config
+from config.vector_index import VectorIndexConfig, parse_vector_index_config
 
 DEFAULT_IGNORES: set[str] = set()
 DEFAULT_GLOBAL_DOMAINS: set[str] = set()  # no defaults b/c if you don't set it, you get all indexed file types (includes)
 DEFAULT_RAG_ENABLED: bool = True
+# LS loads domains lazily, this loads the domain of each opened buffer in the background (before its first search)
+DEFAULT_PREFETCH_OPEN_DOMAINS: bool = True
+# LS/MCP check for a new index generation (indexer run) this often, 0 => never (restart to pick up changes)
+DEFAULT_RELOAD_INTERVAL_SEC: float = 5.0
+# GLOBAL/EVERYTHING search w/ one combined index (vs per domain searches), costs a second copy of every domain's vectors
+DEFAULT_GLOBAL_INDEX: bool = False
+# LS/MCP cache query vectors (LRU, entries), 0 => every query is encoded
+DEFAULT_QUERY_CACHE_SIZE: int = 256
+# also keep query vectors in $XDG_STATE_HOME/ask-openai (survive restarts, shared by LS and MCP)
+DEFAULT_PERSIST_QUERY_CACHE: bool = False
+# LS/MCP cache rerank scores by (instruct, query, chunk id), memory bound in MiB, 0 => always rerank every candidate
+DEFAULT_RERANK_CACHE_MB: float = 16
+# which query's scores to drop first when over rerank_cache_mb: lru or fifo
+EVICT_LRU = "lru"  # evict the query least recently reranked/looked up
+EVICT_FIFO = "fifo"  # evict the query first reranked (lookups don't refresh it)
+EVICTION_POLICIES = [EVICT_LRU, EVICT_FIFO]
+DEFAULT_RERANK_CACHE_EVICTION: str = EVICT_LRU
 
 from logs import get_logger
 
@@ -60,6 +79,16 @@ class RagConfig:
     allowed_semantic_domains: set[str] = field(default_factory=set)
     global_query_domains: set[str] = field(default_factory=set)
     enabled: bool = field(default=DEFAULT_RAG_ENABLED)
+    prefetch_open_domains: bool = field(default=DEFAULT_PREFETCH_OPEN_DOMAINS)
+    reload_interval_sec: float = field(default=DEFAULT_RELOAD_INTERVAL_SEC)
+    global_index: bool = field(default=DEFAULT_GLOBAL_INDEX)
+    query_cache_size: int = field(default=DEFAULT_QUERY_CACHE_SIZE)
+    persist_query_cache: bool = field(default=DEFAULT_PERSIST_QUERY_CACHE)
+    rerank_cache_mb: float = field(default=DEFAULT_RERANK_CACHE_MB)
+    rerank_cache_eviction: str = field(default=DEFAULT_RERANK_CACHE_EVICTION)
+    adaptive_rerank: AdaptiveRerankConfig = field(default_factory=AdaptiveRerankConfig)
+    vector_index: VectorIndexConfig = field(default_factory=VectorIndexConfig)
+    vector_index_by_domain: dict[str, VectorIndexConfig] = field(default_factory=dict)
 
     @staticmethod
     def default() -> "RagConfig":
@@ -76,6 +105,9 @@ class RagConfig:
             return False
         return domain in self.allowed_semantic_domains
 
+    def vector_index_for(self, domain: str) -> VectorIndexConfig:
+        return self.vector_index_by_domain.get(domain, self.vector_index)
+
 def load_config(yaml_text: str) -> RagConfig:
     raw = yaml.safe_load(yaml_text)
 
@@ -93,9 +125,36 @@ def load_config(yaml_text: str) -> RagConfig:
         raise ValueError("global_languages/global_filetypes is deprecated; use global_domains instead")
 
     global_domains = raw.get("global_domains") or DEFAULT_GLOBAL_DOMAINS
+    prefetch_open_domains = raw.get("prefetch_open_domains") if raw.get("prefetch_open_domains") is not None else DEFAULT_PREFETCH_OPEN_DOMAINS
+    reload_interval_sec = raw.get("reload_interval_sec") if raw.get("reload_interval_sec") is not None else DEFAULT_RELOAD_INTERVAL_SEC
+    if reload_interval_sec < 0:
+        raise ValueError(f"reload_interval_sec must be >= 0, got {reload_interval_sec}")
+    global_index = raw.get("global_index") if raw.get("global_index") is not None else DEFAULT_GLOBAL_INDEX
+    query_cache_size = raw.get("query_cache_size") if raw.get("query_cache_size") is not None else DEFAULT_QUERY_CACHE_SIZE
+    if query_cache_size < 0:
+        raise ValueError(f"query_cache_size must be >= 0, got {query_cache_size}")
+    persist_query_cache = raw.get("persist_query_cache") if raw.get("persist_query_cache") is not None else DEFAULT_PERSIST_QUERY_CACHE
+    rerank_cache_mb = raw.get("rerank_cache_mb") if raw.get("rerank_cache_mb") is not None else DEFAULT_RERANK_CACHE_MB
+    if rerank_cache_mb < 0:
+        raise ValueError(f"rerank_cache_mb must be >= 0, got {rerank_cache_mb}")
+    rerank_cache_eviction = raw.get("rerank_cache_eviction") or DEFAULT_RERANK_CACHE_EVICTION
+    if rerank_cache_eviction not in EVICTION_POLICIES:
+        raise ValueError(f"rerank_cache_eviction must be one of {EVICTION_POLICIES}, got {rerank_cache_eviction}")
+    adaptive_rerank = parse_adaptive_rerank_config(raw.get("adaptive_rerank"))
+    vector_index, vector_index_by_domain = parse_vector_index_config(raw.get("vector_index"))
     return RagConfig(
         ignores=raw.get("ignores") or DEFAULT_IGNORES,
         allowed_semantic_domains=allowed,
         global_query_domains=global_domains,
         enabled=enabled,
+        prefetch_open_domains=prefetch_open_domains,
+        reload_interval_sec=reload_interval_sec,
+        global_index=global_index,
+        query_cache_size=query_cache_size,
+        persist_query_cache=persist_query_cache,
+        rerank_cache_mb=rerank_cache_mb,
+        rerank_cache_eviction=rerank_cache_eviction,
+        adaptive_rerank=adaptive_rerank,
+        vector_index=vector_index,
+        vector_index_by_domain=vector_index_by_domain,
     )
@@ -0,0 +1,43 @@
+from dataclasses import dataclass, fields, replace
+
+
+@dataclass(frozen=True)
+class AdaptiveRerankConfig:
+    """ .rag.yaml:
+
+    adaptive_rerank:
+      enabled: true  # requests can override w/ adaptiveRerank
+      embed_gap: 0.1
+      budget_ms: 150
+
+    rerank candidates in embed score order, a wave at a time, stop when the rest are unlikely to make the rerank top k:
+    - best remaining embed score is more than embed_gap below the weakest embed score in the current rerank top k
+    - OR best remaining embed score is below embed_ratio * that weakest embed score
+    - OR budget_ms is spent (checked between waves)
+    skipped candidates keep their embed order after the reranked ones (rerank_score -1)
+    """
+    enabled: bool = False
+    # None => criteria not used
+    embed_gap: float | None = 0.1
+    embed_ratio: float | None = None
+    budget_ms: float | None = None
+    # candidates per wave (first wave included)
+    wave_size: int = 16
+
+
+def parse_adaptive_rerank_config(raw: dict | None) -> AdaptiveRerankConfig:
+    raw = raw or {}
+    known = {f.name for f in fields(AdaptiveRerankConfig)}
+    unknown = set(raw) - known
+    if unknown:
+        raise ValueError(f"unknown adaptive_rerank settings: {sorted(unknown)}, expected: {sorted(known)}")
+    config = replace(AdaptiveRerankConfig(), **raw)
+    if config.wave_size < 1:
+        raise ValueError(f"adaptive_rerank wave_size must be >= 1, got {config.wave_size}")
+    if config.embed_ratio is not None and not 0 < config.embed_ratio <= 1:
+        raise ValueError(f"adaptive_rerank embed_ratio must be in (0, 1], got {config.embed_ratio}")
+    if config.embed_gap is not None and config.embed_gap < 0:
+        raise ValueError(f"adaptive_rerank embed_gap must be >= 0, got {config.embed_gap}")
+    if config.budget_ms is not None and config.budget_ms <= 0:
+        raise ValueError(f"adaptive_rerank budget_ms must be > 0, got {config.budget_ms}")
+    return config
@@ -0,0 +1,97 @@
+from dataclasses import dataclass, fields, replace
+
+from config.domains import EXTENSION_TO_SEMANTIC_DOMAIN
+
+# * vector index kinds
+KIND_AUTO = "auto"
+KIND_FLAT = "flat"  # exact, brute force scan of every vector
+KIND_HNSW = "hnsw"  # graph, no removals => indexer rebuilds on changes, LS leaves tombstones
+KIND_IVF = "ivf"  # inverted lists (k-means clusters), incremental add/remove, retrained as domain grows
+KINDS = {KIND_AUTO, KIND_FLAT, KIND_HNSW, KIND_IVF}
+
+# * vector encodings (how each vector is stored in the index)
+#   1024 dims * float32 = 4KB per vector
+#   anything but flat => exact vectors are kept on disk (memmapped) to rescore top candidates
+ENCODING_FLAT = "flat"  # float32, 4 bytes/dim
+ENCODING_FP16 = "fp16"  # 2 bytes/dim
+ENCODING_SQ8 = "sq8"  # 1 byte/dim (scalar quantized)
+ENCODING_PQ = "pq"  # pq_m bytes/vector (product quantized)
+ENCODINGS = {ENCODING_FLAT, ENCODING_FP16, ENCODING_SQ8, ENCODING_PQ}
+
+# PQ trains 256 centroids per sub quantizer, w/ too few vectors it won't train (well) => stay flat until then
+PQ_MIN_TRAINING_VECTORS = 256 * 39
+
+
+@dataclass(frozen=True)
+class VectorIndexConfig:
+    """ .rag.yaml:
+
+    vector_index:
+      kind: auto
+      flat_max_vectors: 50000
+      encoding: sq8
+      domains: # overrides per domain (or file extension, like include_domains)
+        lua:
+          kind: hnsw
+    """
+    kind: str = KIND_AUTO
+    # * auto => flat up to flat_max_vectors, then auto_kind
+    flat_max_vectors: int = 50_000
+    auto_kind: str = KIND_IVF  # IVF b/c it supports incremental updates (HNSW rebuilds on every change)
+    # * hnsw
+    hnsw_m: int = 32
+    hnsw_ef_construction: int = 80
+    hnsw_ef_search: int = 128
+    # * ivf
+    ivf_nlist: int | None = None  # None => ~4 * sqrt(num_vectors)
+    ivf_nprobe: int = 32
+    # * encoding
+    encoding: str = ENCODING_FLAT
+    pq_m: int = 64  # bytes per vector, must divide dimensions
+    # search fetches top_k * rescore_factor candidates, rescores w/ exact vectors, keeps top_k
+    rescore_factor: int = 4
+
+    def resolve_kind(self, num_vectors: int) -> str:
+        if self.kind != KIND_AUTO:
+            return self.kind
+        if num_vectors <= self.flat_max_vectors:
+            return KIND_FLAT
+        return self.auto_kind
+
+    def resolve_encoding(self, num_vectors: int) -> str:
+        if self.encoding == ENCODING_PQ and num_vectors < PQ_MIN_TRAINING_VECTORS:
+            return ENCODING_FLAT
+        return self.encoding
+
+    def is_lossy(self, num_vectors: int) -> bool:
+        return self.resolve_encoding(num_vectors) != ENCODING_FLAT
+
+
+def _parse_one(raw: dict, base: VectorIndexConfig, where: str) -> VectorIndexConfig:
+    known = {f.name for f in fields(VectorIndexConfig)}
+    unknown = set(raw) - known
+    if unknown:
+        raise ValueError(f"unknown {where} settings: {sorted(unknown)}, expected: {sorted(known)}")
+    config = replace(base, **raw)
+    if config.kind not in KINDS or config.auto_kind not in KINDS - {KIND_AUTO}:
+        raise ValueError(f"invalid {where} kind={config.kind!r} auto_kind={config.auto_kind!r}, expected one of {sorted(KINDS)}")
+    if config.encoding not in ENCODINGS:
+        raise ValueError(f"invalid {where} encoding={config.encoding!r}, expected one of {sorted(ENCODINGS)}")
+    can_be_hnsw = config.kind == KIND_HNSW or (config.kind == KIND_AUTO and config.auto_kind == KIND_HNSW)
+    if config.encoding == ENCODING_PQ and can_be_hnsw:
+        # faiss IndexHNSWPQ is L2 only
+        raise ValueError(f"{where} encoding=pq is not supported with hnsw, use sq8 or fp16")
+    return config
+
+
+def parse_vector_index_config(raw: dict | None) -> tuple[VectorIndexConfig, dict[str, VectorIndexConfig]]:
+    """ returns (default, overrides by domain), domain overrides inherit unset values from the default """
+    raw = dict(raw or {})
+    raw_domains = raw.pop("domains", None) or {}
+
+    default = _parse_one(raw, VectorIndexConfig(), "vector_index")
+    by_domain = {}
+    for domain_or_extension, raw_domain in raw_domains.items():
+        domain = EXTENSION_TO_SEMANTIC_DOMAIN.get(domain_or_extension, domain_or_extension)
+        by_domain[domain] = _parse_one(raw_domain or {}, default, f"vector_index.domains.{domain_or_extension}")
+    return default, by_domain
@@ -0,0 +1,64 @@
+import pytest
+
+from config import RagConfig, load_config
+from config.vector_index import ENCODING_FLAT, ENCODING_PQ, ENCODING_SQ8, KIND_FLAT, KIND_HNSW, KIND_IVF, PQ_MIN_TRAINING_VECTORS, VectorIndexConfig
+
+
+def test_defaults_when_not_configured():
+    config = load_config("enabled: true")
+
+    assert config.vector_index == VectorIndexConfig()
+    assert config.vector_index_for("lua") == VectorIndexConfig()
+    assert RagConfig.default().vector_index_for("lua") == VectorIndexConfig()
+
+
+def test_auto_picks_flat_then_auto_kind_by_size():
+    config = VectorIndexConfig(flat_max_vectors=100)
+
+    assert config.resolve_kind(100) == KIND_FLAT
+    assert config.resolve_kind(101) == KIND_IVF
+    assert VectorIndexConfig(kind=KIND_HNSW).resolve_kind(1) == KIND_HNSW
+
+
+def test_domain_overrides_inherit_from_default():
+    config = load_config("""
+vector_index:
+  flat_max_vectors: 1000
+  ivf_nprobe: 8
+  domains:
+    lua:
+      kind: hnsw
+    md: # extensions map to their domain, like include_domains
+      ivf_nprobe: 64
+""")
+
+    assert config.vector_index.flat_max_vectors == 1000
+    assert config.vector_index_for("lua").kind == KIND_HNSW
+    assert config.vector_index_for("lua").flat_max_vectors == 1000
+    assert config.vector_index_for("markdown").ivf_nprobe == 64
+    assert config.vector_index_for("py").ivf_nprobe == 8
+
+
+def test_invalid_settings_are_rejected():
+    with pytest.raises(ValueError, match="unknown"):
+        load_config("vector_index:\n  kind: flat\n  nprobe: 3")
+    with pytest.raises(ValueError, match="kind"):
+        load_config("vector_index:\n  kind: annoy")
+
+
+def test_encoding_settings():
+    config = load_config("vector_index:\n  encoding: sq8\n  domains:\n    lua:\n      encoding: flat")
+
+    assert config.vector_index_for("py").resolve_encoding(10) == ENCODING_SQ8
+    assert config.vector_index_for("py").is_lossy(10)
+    assert not config.vector_index_for("lua").is_lossy(10)
+
+    # * too few vectors to train PQ codebooks => flat
+    pq = VectorIndexConfig(encoding=ENCODING_PQ)
+    assert pq.resolve_encoding(PQ_MIN_TRAINING_VECTORS - 1) == ENCODING_FLAT
+    assert pq.resolve_encoding(PQ_MIN_TRAINING_VECTORS) == ENCODING_PQ
+
+    with pytest.raises(ValueError, match="encoding"):
+        load_config("vector_index:\n  encoding: int4")
+    with pytest.raises(ValueError, match="hnsw"):
+        load_config("vector_index:\n  kind: hnsw\n  encoding: pq")
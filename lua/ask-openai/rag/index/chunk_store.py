@@ -0,0 +1,285 @@
+import argparse
+import gc
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+from pydantic import PrivateAttr
+
+from logs import get_logger
+from index.storage import Chunk, ChunkType, FileStat, get_domain_dirs
+
+logger = get_logger(__name__)
+
+# * columnar chunk store, replaces chunks.json + files.json
+#   chunk_store.rows.npy   - one row per chunk (ids, positions, offsets into text blob), mmapped
+#   chunk_store.files.npy  - one row per file stat
+#   chunk_store.text.bin   - utf-8 text + signature of each chunk, back to back, mmapped
+#   chunk_store.json       - version, counts, paths/hashes (strings referenced by index), written LAST
+CHUNK_STORE_FILE = "chunk_store.json"
+ROWS_FILE = "chunk_store.rows.npy"
+FILES_FILE = "chunk_store.files.npy"
+TEXT_FILE = "chunk_store.text.bin"
+CHUNK_STORE_VERSION = 1
+
+# legacy, still read when there's no chunk store (see migrate_domain)
+LEGACY_CHUNKS_FILE = "chunks.json"
+LEGACY_FILES_FILE = "files.json"
+
+CHUNK_TYPES = list(ChunkType)
+NO_COLUMN = -1  # None => line based chunk
+
+ROW_DTYPE = np.dtype([
+    ("id", "<u8"),  # chunk.id (16 hex chars)
+    ("file", "<i4"),  # => paths
+    ("file_hash", "<i4"),  # => hashes
+    ("start_line0", "<i4"),
+    ("start_column0", "<i4"),
+    ("end_line0", "<i4"),
+    ("end_column0", "<i4"),
+    ("type", "u1"),  # => CHUNK_TYPES
+    ("text_offset", "<i8"),  # signature follows text
+    ("text_bytes", "<i4"),
+    ("signature_bytes", "<i4"),
+])
+
+FILE_DTYPE = np.dtype([
+    ("key", "<i4"),  # => paths
+    ("path", "<i4"),  # => paths
+    ("hash", "<i4"),  # => hashes
+    ("mtime", "<f8"),
+    ("size", "<i8"),
+])
+
+_CHUNK_FIELDS_SET = set(Chunk.model_fields)
+
+
+class StoredChunk(Chunk):
+    """ Chunk read from the chunk store, text/signature are decoded on first access (most chunks never make it into results) """
+    _text_blob: np.ndarray = PrivateAttr()
+    _text_offset: int = PrivateAttr()
+    _text_bytes: int = PrivateAttr()
+    _signature_bytes: int = PrivateAttr()
+
+    def encoded_text(self) -> bytes:
+        start = self._text_offset
+        return self._text_blob[start:start + self._text_bytes].tobytes()
+
+    def encoded_signature(self) -> bytes:
+        start = self._text_offset + self._text_bytes
+        return self._text_blob[start:start + self._signature_bytes].tobytes()
+
+    def __getattr__(self, name):
+        # FYI only called when name isn't in __dict__ yet
+        if name == "text":
+            value = self.encoded_text().decode("utf-8")
+        elif name == "signature":
+            value = self.encoded_signature().decode("utf-8")
+        else:
+            return super().__getattr__(name)
+        self.__dict__[name] = value
+        return value
+
+    def _decode_lazy_fields(self):
+        self.text, self.signature
+
+    def __eq__(self, other):
+        if not isinstance(other, Chunk):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in _CHUNK_FIELDS_SET)
+
+
+def _new_stored_chunk(fields: dict, text_blob: np.ndarray, text_offset: int, text_bytes: int, signature_bytes: int) -> StoredChunk:
+    # FYI skips pydantic validation, rows were validated when written
+    #   sets the same attributes as model_construct, which is ~6x slower (fills defaults per field) => dominated load time
+    #   chunk_store_tests checks these attributes match model_construct's => a pydantic upgrade that changes them fails there
+    chunk = StoredChunk.__new__(StoredChunk)
+    object.__setattr__(chunk, "__dict__", fields)
+    object.__setattr__(chunk, "__pydantic_fields_set__", _CHUNK_FIELDS_SET)
+    object.__setattr__(chunk, "__pydantic_extra__", None)
+    object.__setattr__(chunk, "__pydantic_private__", {
+        "_text_blob": text_blob,
+        "_text_offset": text_offset,
+        "_text_bytes": text_bytes,
+        "_signature_bytes": signature_bytes,
+    })
+    return chunk
+
+
+def _save_npy_atomic(path: Path, array: np.ndarray):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def has_chunk_store(domain_dir: Path) -> bool:
+    return (domain_dir / CHUNK_STORE_FILE).exists()
+
+
+def write_chunk_store(domain_dir: Path, chunks_by_file: dict[str, list[Chunk]], stat_by_path: dict[str, FileStat]):
+    paths: dict[str, int] = {}
+    hashes: dict[str, int] = {}
+    # i.e. empty files have [] chunks (vs no entry), keep that distinction
+    chunk_files: list[int] = []
+
+    def path_index(path: str) -> int:
+        return paths.setdefault(path, len(paths))
+
+    def hash_index(hash: str) -> int:
+        return hashes.setdefault(hash, len(hashes))
+
+    num_chunks = sum(len(chunks) for chunks in chunks_by_file.values())
+    rows = np.zeros(num_chunks, dtype=ROW_DTYPE)
+    text_tmp_path = domain_dir / (TEXT_FILE + ".tmp")
+    offset = 0
+    row = 0
+    with open(text_tmp_path, "wb") as text_file:
+        for file, chunks in sorted(chunks_by_file.items()):
+            file_index = path_index(file)
+            chunk_files.append(file_index)
+            for chunk in chunks:
+                if isinstance(chunk, StoredChunk):
+                    # unchanged file => copy bytes, no decode/encode
+                    text, signature = chunk.encoded_text(), chunk.encoded_signature()
+                else:
+                    text, signature = chunk.text.encode("utf-8"), chunk.signature.encode("utf-8")
+                if len(chunk.id) != 16:
+                    raise ValueError(f"chunk id must be 16 hex chars: {chunk.id!r}")
+                rows[row] = (
+                    int(chunk.id, 16),
+                    file_index,
+                    hash_index(chunk.file_hash),
+                    chunk.start_line0,
+                    NO_COLUMN if chunk.start_column0 is None else chunk.start_column0,
+                    chunk.end_line0,
+                    NO_COLUMN if chunk.end_column0 is None else chunk.end_column0,
+                    CHUNK_TYPES.index(chunk.type),
+                    offset,
+                    len(text),
+                    len(signature),
+                )
+                text_file.write(text)
+                text_file.write(signature)
+                offset += len(text) + len(signature)
+                row += 1
+
+    files = np.zeros(len(stat_by_path), dtype=FILE_DTYPE)
+    for i, (key, stat) in enumerate(sorted(stat_by_path.items())):
+        files[i] = (path_index(key), path_index(stat.path), hash_index(stat.hash), stat.mtime, stat.size)
+
+    os.replace(text_tmp_path, domain_dir / TEXT_FILE)
+    _save_npy_atomic(domain_dir / ROWS_FILE, rows)
+    _save_npy_atomic(domain_dir / FILES_FILE, files)
+
+    manifest = {
+        "version": CHUNK_STORE_VERSION,
+        "num_chunks": num_chunks,
+        "num_files": len(files),
+        "text_bytes": offset,
+        "paths": list(paths),
+        "hashes": list(hashes),
+        "chunk_files": chunk_files,
+    }
+    manifest_tmp_path = domain_dir / (CHUNK_STORE_FILE + ".tmp")
+    with open(manifest_tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(manifest_tmp_path, domain_dir / CHUNK_STORE_FILE)
+
+    # * chunk store supersedes legacy json
+    for name in [LEGACY_CHUNKS_FILE, LEGACY_FILES_FILE]:
+        (domain_dir / name).unlink(missing_ok=True)
+
+
+def load_chunk_store(domain_dir: Path) -> tuple[dict[str, list[Chunk]], dict[str, FileStat]]:
+    """ returns (chunks_by_file, stat_by_path) """
+    with open(domain_dir / CHUNK_STORE_FILE) as f:
+        manifest = json.load(f)
+    if manifest["version"] != CHUNK_STORE_VERSION:
+        raise ValueError(f"unsupported chunk store version {manifest['version']} in {domain_dir}, rebuild w/ rag_indexer")
+
+    rows = np.load(domain_dir / ROWS_FILE, mmap_mode="r")
+    files = np.load(domain_dir / FILES_FILE)
+    if len(rows) != manifest["num_chunks"] or len(files) != manifest["num_files"]:
+        # i.e. interrupted write
+        raise ValueError(f"chunk store in {domain_dir} doesn't match its manifest, rebuild w/ rag_indexer")
+
+    if manifest["text_bytes"] > 0:
+        text_blob = np.memmap(domain_dir / TEXT_FILE, dtype=np.uint8, mode="r")
+    else:
+        text_blob = np.empty(0, dtype=np.uint8)  # can't mmap an empty file
+
+    paths: list[str] = manifest["paths"]
+    hashes: list[str] = manifest["hashes"]
+
+    stat_by_path = {
+        paths[key]: FileStat(mtime=mtime, size=size, hash=hashes[hash_index], path=paths[path])
+        for key, path, hash_index, mtime, size in files.tolist()
+    }
+
+    # FYI cyclic GC passes triggered by allocating all the chunks ~double load time, nothing here is cyclic garbage
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        chunks_by_file = _chunks_from_rows(rows, text_blob, paths, hashes, manifest["chunk_files"])
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return chunks_by_file, stat_by_path
+
+
+def _chunks_from_rows(rows: np.ndarray, text_blob: np.ndarray, paths: list[str], hashes: list[str], chunk_files: list[int]) -> dict[str, list[Chunk]]:
+    # * columns => python lists in bulk (vs per element numpy access)
+    chunks_by_file: dict[str, list[Chunk]] = {paths[file]: [] for file in chunk_files}
+    mask = 0x7FFFFFFFFFFFFFFF  # see chunk_id_to_faiss_id
+    for id, file, file_hash, start_line0, start_column0, end_line0, end_column0, type, text_offset, text_bytes, signature_bytes in rows.tolist():
+        fields = {
+            "id": f"{id:016x}",
+            "id_int": str(id & mask),
+            "file": paths[file],
+            "start_line0": start_line0,
+            "start_column0": None if start_column0 == NO_COLUMN else start_column0,
+            "end_line0": end_line0,
+            "end_column0": None if end_column0 == NO_COLUMN else end_column0,
+            "type": CHUNK_TYPES[type],
+            "file_hash": hashes[file_hash],
+        }
+        chunk = _new_stored_chunk(fields, text_blob, text_offset, text_bytes, signature_bytes)
+        chunks_by_file[fields["file"]].append(chunk)
+    return chunks_by_file
+
+
+def migrate_domain(domain_dir: Path) -> bool:
+    """ legacy chunks.json/files.json => chunk store, returns True if migrated """
+    from index.storage import load_chunks_by_file, load_file_stats_by_file
+
+    chunks_json_path = domain_dir / LEGACY_CHUNKS_FILE
+    if has_chunk_store(domain_dir) or not chunks_json_path.exists():
+        return False
+
+    files_json_path = domain_dir / LEGACY_FILES_FILE
+    with logger.timer(f"Migrate {domain_dir.name} to chunk store"):
+        chunks_by_file = load_chunks_by_file(chunks_json_path)
+        stat_by_path = load_file_stats_by_file(files_json_path) if files_json_path.exists() else {}
+        write_chunk_store(domain_dir, chunks_by_file, stat_by_path)
+    return True
+
+
+def main():
+    # usage:
+    #   python3 -m index.chunk_store $(_repo_root)/.rag
+    from logs import logging_fwk_to_console
+
+    parser = argparse.ArgumentParser(description="migrate chunks.json/files.json to the chunk store (w/o reindexing)")
+    parser.add_argument("dot_rag_path", help="Path to the .rag directory")
+    args = parser.parse_args()
+    logging_fwk_to_console("INFO")
+
+    for domain_dir in sorted(get_domain_dirs(Path(args.dot_rag_path))):
+        if not migrate_domain(domain_dir):
+            logger.info(f"{domain_dir.name} nothing to migrate")
+
+
+if __name__ == "__main__":
+    main()
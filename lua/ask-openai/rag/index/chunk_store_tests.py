@@ -0,0 +1,132 @@
+import hashlib
+
+from index.chunk_store import (
+    CHUNK_STORE_FILE,
+    LEGACY_CHUNKS_FILE,
+    LEGACY_FILES_FILE,
+    StoredChunk,
+    load_chunk_store,
+    migrate_domain,
+    write_chunk_store,
+)
+from index.pydants import write_json
+from index.storage import Chunk, ChunkType, FileStat, chunk_id_to_faiss_id, load_domain
+
+
+def chunk_for(text: str, file: str, start_line0: int = 0, signature: str = "") -> Chunk:
+    chunk_id = hashlib.sha256(f"{file}:{text}".encode()).hexdigest()[:16]
+    return Chunk(
+        id=chunk_id,
+        id_int=str(chunk_id_to_faiss_id(chunk_id)),
+        text=text,
+        file=file,
+        start_line0=start_line0,
+        start_column0=None,
+        end_line0=start_line0 + 3,
+        end_column0=None,
+        type=ChunkType.LINES,
+        file_hash=f"hash of {file}",
+        signature=signature,
+    )
+
+
+def sample_domain() -> tuple[dict[str, list[Chunk]], dict[str, FileStat]]:
+    ts_chunk = chunk_for("function foo() end", "/repo/b.lua", signature="function foo()")
+    ts_chunk = ts_chunk.model_copy(update={"type": ChunkType.TREESITTER, "start_column0": 2, "end_column0": 5})
+    chunks_by_file = {
+        "/repo/a.lua": [chunk_for("local a = 1", "/repo/a.lua"), chunk_for("-- ünïcödé ✓", "/repo/a.lua", start_line0=4)],
+        "/repo/b.lua": [ts_chunk],
+        "/repo/empty.lua": [],
+    }
+    stat_by_path = {
+        path: FileStat(mtime=1700000000.5, size=42, hash=f"hash of {path}", path=path)
+        for path in ["/repo/a.lua", "/repo/b.lua", "/repo/empty.lua", "/repo/no_chunks.lua"]
+    }
+    return chunks_by_file, stat_by_path
+
+
+def test_round_trip(tmp_path):
+    chunks_by_file, stat_by_path = sample_domain()
+
+    write_chunk_store(tmp_path, chunks_by_file, stat_by_path)
+    loaded_chunks, loaded_stats = load_chunk_store(tmp_path)
+
+    assert loaded_stats == stat_by_path
+    assert loaded_chunks == chunks_by_file
+    assert loaded_chunks["/repo/b.lua"][0].faiss_id == chunks_by_file["/repo/b.lua"][0].faiss_id
+
+
+def test_text_is_decoded_on_first_access(tmp_path):
+    chunks_by_file, stat_by_path = sample_domain()
+    write_chunk_store(tmp_path, chunks_by_file, stat_by_path)
+
+    loaded, _ = load_chunk_store(tmp_path)
+    chunk = loaded["/repo/a.lua"][1]
+
+    assert isinstance(chunk, StoredChunk)
+    assert "text" not in chunk.__dict__
+    assert chunk.text == "-- ünïcödé ✓"
+    assert "text" in chunk.__dict__
+    assert chunk.model_dump()["signature"] == ""
+
+
+def test_nested_stored_chunks_serialize_lazy_fields(tmp_path):
+    import numpy as np
+    from index.update_journal import JournalEntry
+
+    chunks_by_file, stat_by_path = sample_domain()
+    write_chunk_store(tmp_path, chunks_by_file, stat_by_path)
+    loaded, _ = load_chunk_store(tmp_path)
+    chunks = loaded["/repo/b.lua"]
+    assert "text" not in chunks[0].__dict__
+
+    entry = JournalEntry.create("/repo/b.lua", stat_by_path["/repo/b.lua"], chunks, np.array([], dtype=np.int64), np.zeros((0, 4)), dimensions=4)
+    round_tripped = JournalEntry.model_validate_json(entry.model_dump_json())
+
+    assert round_tripped.chunks == chunks_by_file["/repo/b.lua"]
+
+
+def test_stored_chunk_has_same_pydantic_state_as_model_construct(tmp_path):
+    chunks_by_file, stat_by_path = sample_domain()
+    write_chunk_store(tmp_path, chunks_by_file, stat_by_path)
+    loaded, _ = load_chunk_store(tmp_path)
+    chunk = loaded["/repo/a.lua"][0]
+
+    fields = {name: getattr(chunk, name) for name in Chunk.model_fields}
+    constructed = StoredChunk.model_construct(**fields)
+
+    assert chunk.__pydantic_fields_set__ == constructed.__pydantic_fields_set__
+    assert chunk.__pydantic_extra__ == constructed.__pydantic_extra__
+    assert set(chunk.__pydantic_private__ or {}) == set(StoredChunk.__private_attributes__)
+
+
+def test_rewrite_copies_stored_chunks(tmp_path):
+    chunks_by_file, stat_by_path = sample_domain()
+    write_chunk_store(tmp_path, chunks_by_file, stat_by_path)
+    loaded, stats = load_chunk_store(tmp_path)
+
+    # * i.e. indexer run, unchanged files are StoredChunks from the prior store
+    loaded["/repo/c.lua"] = [chunk_for("new", "/repo/c.lua")]
+    write_chunk_store(tmp_path, loaded, stats)
+    reloaded, _ = load_chunk_store(tmp_path)
+
+    assert reloaded["/repo/a.lua"] == chunks_by_file["/repo/a.lua"]
+    assert reloaded["/repo/c.lua"][0].text == "new"
+
+
+def test_migrate_legacy_json(tmp_path):
+    chunks_by_file, stat_by_path = sample_domain()
+    domain_dir = tmp_path / "lua"
+    domain_dir.mkdir()
+    write_json(chunks_by_file, domain_dir / LEGACY_CHUNKS_FILE)
+    write_json(stat_by_path, domain_dir / LEGACY_FILES_FILE)
+    legacy = load_domain(tmp_path, "lua")
+
+    assert migrate_domain(domain_dir)
+    assert not migrate_domain(domain_dir)
+
+    assert (domain_dir / CHUNK_STORE_FILE).exists()
+    assert not (domain_dir / LEGACY_CHUNKS_FILE).exists()
+    migrated = load_domain(tmp_path, "lua")
+    assert migrated.chunks_by_file == legacy.chunks_by_file
+    assert migrated.stat_by_path == legacy.stat_by_path
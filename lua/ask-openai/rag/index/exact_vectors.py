@@ -0,0 +1,106 @@
+import os
+from pathlib import Path
+
+import numpy as np
+
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+# FYI only written for domains w/ a lossy vectors.index encoding (sq8/fp16/pq)
+EXACT_VECTORS_FILE = "exact_vectors.npy"
+EXACT_IDS_FILE = "exact_ids.npy"
+
+
+def _save_atomic(path: Path, array: np.ndarray):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+class ExactVectors:
+    """ float32 vectors by faiss id, to rescore candidates from a quantized index
+
+    memmapped => only pages touched by rescoring become resident (vs the full 4KB per vector)
+    """
+
+    def __init__(self, ids: np.ndarray, vectors: np.ndarray):
+        # ids sorted => searchsorted lookup, vectors aligned w/ ids
+        self.ids = ids
+        self.vectors = vectors
+        # LS updates (file saves) since load, these win over the memmapped vectors
+        self._updated: dict[int, np.ndarray] = {}
+
+    @staticmethod
+    def load(domain_dir: Path) -> "ExactVectors | None":
+        ids_path = domain_dir / EXACT_IDS_FILE
+        vectors_path = domain_dir / EXACT_VECTORS_FILE
+        if not ids_path.exists() or not vectors_path.exists():
+            return None
+        try:
+            return ExactVectors(np.load(ids_path), np.load(vectors_path, mmap_mode="r"))
+        except Exception:
+            logger.exception(f"Could not load exact vectors from {domain_dir}, rescoring disabled")
+            return None
+
+    @staticmethod
+    def write(domain_dir: Path, ids: np.ndarray, vectors: np.ndarray):
+        order = np.argsort(ids, kind="stable")
+        _save_atomic(domain_dir / EXACT_VECTORS_FILE, np.ascontiguousarray(vectors[order], dtype=np.float32))
+        _save_atomic(domain_dir / EXACT_IDS_FILE, ids[order].astype(np.int64))
+
+    @staticmethod
+    def remove(domain_dir: Path):
+        for name in [EXACT_VECTORS_FILE, EXACT_IDS_FILE]:
+            (domain_dir / name).unlink(missing_ok=True)
+
+    @property
+    def nbytes(self) -> int:
+        return self.vectors.nbytes + self.ids.nbytes
+
+    def snapshot(self) -> "ExactVectors":
+        """ later put_many calls don't show up in the snapshot, shares the (read only) memmapped vectors """
+        snapshot = ExactVectors(self.ids, self.vectors)
+        snapshot._updated = dict(self._updated)
+        return snapshot
+
+    def put_many(self, ids: np.ndarray, vectors: np.ndarray):
+        for faiss_id, vector in zip(ids.tolist(), vectors):
+            self._updated[faiss_id] = np.array(vector, dtype=np.float32)
+
+    def get_many(self, ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """ returns (vectors, found) - rows for missing ids are zeros """
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.zeros((len(ids), self.vectors.shape[1]), dtype=np.float32)
+        found = np.zeros(len(ids), dtype=bool)
+        if len(self.ids) > 0:
+            positions = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+            found = self.ids[positions] == ids
+            if found.any():
+                vectors[found] = self.vectors[positions[found]]
+        for i, faiss_id in enumerate(ids.tolist()):
+            updated = self._updated.get(faiss_id)
+            if updated is not None:
+                vectors[i] = updated
+                found[i] = True
+        return vectors, found
+
+    def rescore(self, query_vectors: np.ndarray, scores: np.ndarray, ids: np.ndarray, top_k: int) -> tuple[np.ndarray, np.ndarray]:
+        """ exact inner product for candidates (from index.search), keep top_k - same shapes as index.search """
+        num_queries = len(query_vectors)
+        out_scores = np.full((num_queries, top_k), -np.inf, dtype=np.float32)
+        out_ids = np.full((num_queries, top_k), -1, dtype=np.int64)
+        for q in range(num_queries):
+            valid = ids[q] >= 0  # faiss pads w/ -1 when fewer results
+            candidate_ids = ids[q][valid]
+            candidate_scores = scores[q][valid].astype(np.float32)
+
+            vectors, found = self.get_many(candidate_ids)
+            # missing exact vector => keep approximate score
+            candidate_scores[found] = vectors[found] @ query_vectors[q]
+
+            order = np.argsort(-candidate_scores, kind="stable")[:top_k]
+            out_scores[q, :len(order)] = candidate_scores[order]
+            out_ids[q, :len(order)] = candidate_ids[order]
+        return out_scores, out_ids
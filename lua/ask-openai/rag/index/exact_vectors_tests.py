@@ -0,0 +1,66 @@
+import faiss
+import numpy as np
+
+from config.vector_index import ENCODING_SQ8, VectorIndexConfig
+from index.exact_vectors import ExactVectors
+from index.storage import RAGDataset
+from index.testing import random_vectors
+from index.vector_index import build_index
+
+
+def test_write_load_round_trip(tmp_path):
+    vecs, ids = random_vectors(100)
+    shuffle = np.random.default_rng(1).permutation(100)
+
+    ExactVectors.write(tmp_path, ids[shuffle], vecs[shuffle])
+    exact = ExactVectors.load(tmp_path)
+
+    assert exact is not None
+    assert isinstance(exact.vectors, np.memmap)
+    found_vecs, found = exact.get_many(np.array([ids[5], 999_999, ids[0]]))
+    assert found.tolist() == [True, False, True]
+    np.testing.assert_array_equal(found_vecs[[0, 2]], vecs[[5, 0]])
+
+    ExactVectors.remove(tmp_path)
+    assert ExactVectors.load(tmp_path) is None
+
+
+def test_put_many_overrides_and_adds():
+    vecs, ids = random_vectors(10)
+    exact = ExactVectors(ids, vecs)
+    new_vecs, _ = random_vectors(2, seed=2)
+
+    exact.put_many(np.array([ids[0], 12345]), new_vecs)
+
+    found_vecs, found = exact.get_many(np.array([ids[0], 12345, ids[1]]))
+    assert found.all()
+    np.testing.assert_array_equal(found_vecs, [new_vecs[0], new_vecs[1], vecs[1]])
+
+
+def test_rescore_uses_exact_scores():
+    vecs, ids = random_vectors(4)
+    exact = ExactVectors(ids, vecs)
+    query = vecs[2:3]
+    # approximate order is wrong, last candidate is missing from the exact store (keeps its score)
+    approx_scores = np.array([[0.9, 0.8, 0.7, 0.5, 0.4]], dtype=np.float32)
+    approx_ids = np.array([[ids[0], ids[1], ids[2], 777, -1]])
+
+    scores, found_ids = exact.rescore(query, approx_scores, approx_ids, top_k=5)
+
+    assert found_ids[0, 0] == ids[2]
+    assert np.isclose(scores[0, 0], 1.0)
+    assert found_ids[0, -1] == -1  # padded like faiss
+    assert 777 in found_ids[0]
+
+
+def test_dataset_search_rescores_lossy_index():
+    vecs, ids = random_vectors(3000, seed=3)
+    index = build_index(vecs, ids, VectorIndexConfig(encoding=ENCODING_SQ8))
+    dataset = RAGDataset("lua", {}, {}, index, ExactVectors(ids, vecs))
+
+    queries = vecs[:20]
+    scores, found_ids = dataset.search(queries, 10, rescore_factor=4)
+
+    exact_scores, exact_positions = faiss.knn(queries, vecs, 10, metric=faiss.METRIC_INNER_PRODUCT)
+    np.testing.assert_array_equal(found_ids, ids[exact_positions])
+    np.testing.assert_allclose(scores, exact_scores, rtol=1e-5)
@@ -0,0 +1,105 @@
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Optional
+
+from pydantic import BaseModel
+
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+# * each indexer run writes a new generation dir, then switches manifest.json to it (atomic rename)
+#   .rag/<domain>/manifest.json   => {"generation": 3, "dir": "gen-000003"}
+#   .rag/<domain>/gen-000003/     => vectors.index, chunk store, exact vectors
+#   .rag/<domain>/journal.jsonl   => LS updates, across generations (see update_journal)
+# readers only ever see a complete generation, LS/MCP poll manifest.json to hot reload (see Datasets.watch_generations)
+# legacy layout (no manifest) => files directly in .rag/<domain>/, still read until the indexer writes a generation
+MANIFEST_FILE = "manifest.json"
+GENERATION_DIR_PREFIX = "gen-"
+
+# files in the legacy layout, removed once a generation is published
+LEGACY_DATA_FILES = [
+    "vectors.index",
+    "chunks.json",
+    "files.json",
+    "chunk_store.json",
+    "chunk_store.rows.npy",
+    "chunk_store.files.npy",
+    "chunk_store.text.bin",
+    "exact_vectors.npy",
+    "exact_ids.npy",
+]
+
+# prior generation is kept => a reader that read the old manifest right before the switch can still open its files
+#   FYI mmapped files stay valid after they're deleted (on unix), so only opening is a concern
+KEEP_PRIOR_GENERATIONS = 1
+
+
+class DomainManifest(BaseModel):
+    generation: int
+    dir: str
+    published: float  # epoch seconds
+
+
+def generation_dir_name(generation: int) -> str:
+    return f"{GENERATION_DIR_PREFIX}{generation:06d}"
+
+
+def read_manifest(domain_dir: Path) -> Optional[DomainManifest]:
+    manifest_path = domain_dir / MANIFEST_FILE
+    if not manifest_path.exists():
+        return None
+    return DomainManifest.model_validate_json(manifest_path.read_text())
+
+
+def current_generation(domain_dir: Path) -> int:
+    """ 0 => legacy layout (or nothing indexed yet) """
+    manifest = read_manifest(domain_dir)
+    return manifest.generation if manifest else 0
+
+
+def data_dir_for(domain_dir: Path) -> tuple[int, Path]:
+    """ returns (generation, dir w/ the current generation's files) """
+    manifest = read_manifest(domain_dir)
+    if manifest is None:
+        return 0, domain_dir
+    return manifest.generation, domain_dir / manifest.dir
+
+
+def new_generation_dir(domain_dir: Path) -> tuple[int, Path]:
+    """ empty dir for the next generation, invisible to readers until publish_generation """
+    generation = current_generation(domain_dir) + 1
+    gen_dir = domain_dir / generation_dir_name(generation)
+    if gen_dir.exists():
+        # i.e. indexer died before publishing it
+        shutil.rmtree(gen_dir)
+    gen_dir.mkdir(parents=True)
+    return generation, gen_dir
+
+
+def publish_generation(domain_dir: Path, generation: int):
+    manifest = DomainManifest(generation=generation, dir=generation_dir_name(generation), published=time.time())
+    tmp_path = domain_dir / (MANIFEST_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        f.write(manifest.model_dump_json())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, domain_dir / MANIFEST_FILE)
+    logger.info(f"Published {domain_dir.name} generation {generation}")
+
+    _remove_old_data(domain_dir, generation)
+
+
+def _remove_old_data(domain_dir: Path, generation: int):
+    for name in LEGACY_DATA_FILES:
+        (domain_dir / name).unlink(missing_ok=True)
+
+    for gen_dir in domain_dir.glob(f"{GENERATION_DIR_PREFIX}*"):
+        try:
+            gen = int(gen_dir.name.removeprefix(GENERATION_DIR_PREFIX))
+        except ValueError:
+            continue
+        if gen < generation - KEEP_PRIOR_GENERATIONS or gen > generation:
+            shutil.rmtree(gen_dir, ignore_errors=True)
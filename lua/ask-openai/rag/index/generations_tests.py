@@ -0,0 +1,100 @@
+from pathlib import Path
+
+import faiss
+import numpy as np
+import pytest
+
+from config.vector_index import VectorIndexConfig
+from index import storage, workspace
+from index.chunk_store import write_chunk_store
+from index.generations import MANIFEST_FILE, data_dir_for, new_generation_dir, publish_generation, read_manifest
+from index.storage import Chunk, lazy_load_all_domains, load_domain
+from index.testing import chunk_for, write_domain
+from index.vector_index import build_index, write_index
+
+
+def write_generation(domain_dir: Path, chunk: Chunk) -> int:
+    generation, gen_dir = new_generation_dir(domain_dir)
+    vecs = np.random.default_rng(generation).standard_normal((1, 8)).astype(np.float32)
+    faiss.normalize_L2(vecs)
+    write_index(build_index(vecs, np.array([chunk.faiss_id], dtype=np.int64), VectorIndexConfig()), gen_dir / "vectors.index")
+    write_chunk_store(gen_dir, {chunk.file: [chunk]}, {})
+    publish_generation(domain_dir, generation)
+    return generation
+
+
+def test_publish_switches_generation(tmp_path):
+    write_domain(tmp_path, "lua", "/repo/foo.lua")
+    domain_dir = tmp_path / "lua"
+    assert data_dir_for(domain_dir) == (0, domain_dir)
+
+    first = chunk_for("first", "/repo/foo.lua")
+    assert write_generation(domain_dir, first) == 1
+
+    assert data_dir_for(domain_dir) == (1, domain_dir / "gen-000001")
+    assert not (domain_dir / "vectors.index").exists()  # legacy layout removed
+    dataset = load_domain(tmp_path, "lua")
+    assert dataset.generation == 1
+    assert dataset.chunks_by_file == {"/repo/foo.lua": [first]}
+
+    # * prior generation is kept, older ones are removed
+    write_generation(domain_dir, chunk_for("second", "/repo/foo.lua"))
+    write_generation(domain_dir, chunk_for("third", "/repo/foo.lua"))
+    assert read_manifest(domain_dir).generation == 3
+    assert sorted(p.name for p in domain_dir.glob("gen-*")) == ["gen-000002", "gen-000003"]
+    assert (domain_dir / MANIFEST_FILE).exists()
+
+
+@pytest.mark.asyncio
+async def test_reload_swaps_in_new_generation(tmp_path, monkeypatch):
+    monkeypatch.setattr(workspace.project, "folder", tmp_path)
+    dot_rag_dir = tmp_path / ".rag"
+    write_domain(dot_rag_dir, "lua", str(tmp_path / "foo.lua"))
+    datasets = lazy_load_all_domains(dot_rag_dir)
+    before = await datasets.load("lua")
+    assert await datasets.reload_changed_domains() == []
+
+    after_chunk = chunk_for("reindexed", str(tmp_path / "foo.lua"))
+    write_generation(dot_rag_dir / "lua", after_chunk)
+    write_domain(dot_rag_dir, "python", str(tmp_path / "foo.py"))
+
+    assert await datasets.reload_changed_domains() == ["lua"]
+
+    after = datasets.all_datasets["lua"]
+    assert after is not before and after.generation == 1
+    assert datasets.get_chunk_by_faiss_id(after_chunk.faiss_id) == after_chunk
+    # in flight searches keep the old dataset
+    assert before.index.ntotal == 1 and before.generation == 0
+    assert "python" in datasets.unloaded_domains
+
+
+@pytest.mark.asyncio
+async def test_update_during_reload_lands_in_reloaded_dataset(tmp_path, monkeypatch):
+    monkeypatch.setattr(workspace.project, "folder", tmp_path)
+    dot_rag_dir = tmp_path / ".rag"
+    file = str(tmp_path / "foo.lua")
+    write_domain(dot_rag_dir, "lua", file)
+    datasets = lazy_load_all_domains(dot_rag_dir)
+    datasets.vector_cache = None
+    before = await datasets.load("lua")
+    num_encodes = 0
+
+    async def encode_while_reloading(passages):
+        nonlocal num_encodes
+        num_encodes += 1
+        if num_encodes == 1:
+            # indexer publishes while the LS is encoding the edit
+            write_generation(dot_rag_dir / "lua", chunk_for("reindexed", file))
+            assert await datasets.reload_changed_domains() == ["lua"]
+        return np.random.default_rng(0).standard_normal((len(passages), 8)).astype(np.float32)
+
+    monkeypatch.setattr(storage, "encode_passages", encode_while_reloading)
+    edited = chunk_for("edited", file)
+
+    await datasets.update_file(file, [edited])
+
+    after = datasets.all_datasets["lua"]
+    assert after is not before
+    assert num_encodes == 2
+    assert after.chunks_by_file[file] == [edited]
+    assert datasets.get_chunk_by_faiss_id(edited.faiss_id) == edited
@@ -0,0 +1,220 @@
+import argparse
+import threading
+import time
+from typing import Iterable
+
+import faiss
+import numpy as np
+
+from logs import get_logger
+from index.storage import RAGDataset
+from index.vector_index import get_vectors_and_ids
+
+logger = get_logger(__name__)
+
+# rebuild w/o dead rows once they're this fraction of all rows
+COMPACT_DEAD_FRACTION = 0.25
+
+
+class GlobalIndex:
+    """ one flat index over every loaded domain, each row tagged w/ its domain
+
+    GLOBAL/EVERYTHING search => one search restricted to the wanted domains (IDSelectorBitmap)
+      vs searching each domain w/ an oversampled top_k and merging, returns exactly the global top_k
+    FYI a second copy of the vectors (float32), opt in via .rag.yaml global_index
+    """
+
+    def __init__(self, dimensions: int):
+        self.index = faiss.IndexFlatIP(dimensions)
+        # * per row (row == position in index)
+        self.faiss_ids = np.empty(0, dtype=np.int64)
+        self.domain_codes = np.empty(0, dtype=np.int16)
+        self.live = np.empty(0, dtype=bool)  # False => replaced/removed by an LS update
+        self.domains: list[str] = []  # code => domain
+        # datasets this was built from, see sync
+        self.sources: dict[str, RAGDataset] = {}
+        # dead rows the last compact kept (tombstones)
+        self._num_dead_kept = 0
+        # search runs on a worker thread (see semantic_grep), add_rows/replace on the event loop
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def build(datasets: dict[str, RAGDataset]) -> "GlobalIndex | None":
+        """ FYI reconstructs every domain's vectors, run on a worker thread (see Datasets.sync_global_index) """
+        with_vectors = {domain: ds for domain, ds in sorted(datasets.items()) if ds.index is not None}
+        if not with_vectors:
+            return None
+        dimensions = next(iter(with_vectors.values())).index.d
+        global_index = GlobalIndex(dimensions)
+        with logger.timer(f"Build global index for {len(with_vectors)} domains"):
+            for domain, dataset in with_vectors.items():
+                global_index._append(domain, *domain_rows(dataset))
+        logger.info(f"Global index has {global_index.index.ntotal} vectors ({global_index.index.ntotal * dimensions * 4 / 2**20:.1f} MiB)")
+        global_index.sources = dict(datasets)
+        return global_index
+
+    def covers(self, datasets: dict[str, RAGDataset]) -> bool:
+        """ True => rows are current for each of these datasets (built/synced from the same RAGDataset) """
+        return all(self.sources.get(domain) is dataset for domain, dataset in datasets.items())
+
+    def can_add(self, datasets: dict[str, RAGDataset]) -> bool:
+        """ False => a domain was reloaded/removed (or dimensions differ), rebuild """
+        if any(datasets.get(domain) is not dataset for domain, dataset in self.sources.items()):
+            return False
+        return all(dataset.index is None or dataset.index.d == self.index.d for dataset in datasets.values())
+
+    def add_rows(self, rows_by_domain: dict[str, tuple[np.ndarray, np.ndarray, np.ndarray]], datasets: dict[str, RAGDataset]):
+        """ add newly loaded domains, rows from domain_rows (computed off the event loop) """
+        with self._lock:
+            for domain, rows in sorted(rows_by_domain.items()):
+                self._append(domain, *rows)
+        self.sources.update(datasets)
+
+    def has_source(self, dataset: RAGDataset) -> bool:
+        return self.sources.get(dataset.domain) is dataset
+
+    def _code_for(self, domain: str) -> int:
+        if domain not in self.domains:
+            self.domains.append(domain)
+        return self.domains.index(domain)
+
+    def _append(self, domain: str, ids: np.ndarray, vecs: np.ndarray, live: np.ndarray | None = None):
+        self.index.add(np.ascontiguousarray(vecs, dtype=np.float32))
+        self.faiss_ids = np.concatenate([self.faiss_ids, ids.astype(np.int64)])
+        self.domain_codes = np.concatenate([self.domain_codes, np.full(len(ids), self._code_for(domain), dtype=np.int16)])
+        self.live = np.concatenate([self.live, np.ones(len(ids), dtype=bool) if live is None else live])
+
+    def replace(self, domain: str, prior_ids: list[int], new_ids: list[int], added_ids: np.ndarray, added_vecs: np.ndarray):
+        """ mirrors an LS update of one file (see RAGDataset.apply_file_update) """
+        with self._lock:
+            in_domain = self.domain_codes == self._code_for(domain)
+            self.live[in_domain & np.isin(self.faiss_ids, np.array(prior_ids, dtype=np.int64))] = False
+            # i.e. HNSW datasets only add vectors they don't have => unchanged/revived chunks are rows already
+            kept = np.setdiff1d(np.array(new_ids, dtype=np.int64), added_ids)
+            self.live[in_domain & np.isin(self.faiss_ids, kept)] = True
+            self._append(domain, added_ids, added_vecs)
+
+    def needs_compact(self) -> bool:
+        """ True => compact (reconstructs every kept row, see Datasets.sync_global_index) """
+        num_dead = len(self.live) - int(self.live.sum())
+        return num_dead - self._num_dead_kept > COMPACT_DEAD_FRACTION * len(self.live)
+
+    def compact(self):
+        """ rebuild w/o dead rows, FYI run on a worker thread """
+        with self._lock:
+            keep = self.live.copy()
+            for code, domain in enumerate(self.domains):
+                dataset = self.sources.get(domain)
+                if dataset is None:
+                    continue
+                with dataset._index_lock:
+                    tombstoned = np.fromiter(dataset.tombstoned_ids, dtype=np.int64, count=len(dataset.tombstoned_ids))
+                if len(tombstoned):
+                    # HNSW tombstones can be revived w/o the dataset re-adding their vectors => keep their rows
+                    keep |= (self.domain_codes == code) & np.isin(self.faiss_ids, tombstoned)
+            rows = np.flatnonzero(keep)
+            vecs = self.index.reconstruct_batch(rows) if len(rows) else np.empty((0, self.index.d), dtype=np.float32)
+            self.index = faiss.IndexFlatIP(self.index.d)
+            self.index.add(vecs)
+            self.faiss_ids = self.faiss_ids[rows]
+            self.domain_codes = self.domain_codes[rows]
+            self.live = self.live[rows]
+            self._num_dead_kept = len(rows) - int(self.live.sum())
+
+    def search(self, query_vectors: np.ndarray, top_k: int, domains: Iterable[str]) -> tuple[np.ndarray, np.ndarray]:
+        """ same shape as index.search, ids are faiss ids (-1 when fewer than top_k rows match) """
+        with self._lock:
+            codes = [self.domains.index(d) for d in domains if d in self.domains]
+            allowed = self.live & np.isin(self.domain_codes, codes)
+            # FYI IDSelectorBitmap reads bit (i & 7) of byte (i >> 3) => little bit order
+            bitmap = np.packbits(allowed, bitorder="little")
+            selector = faiss.IDSelectorBitmap(len(allowed), faiss.swig_ptr(bitmap))
+            scores, rows = self.index.search(query_vectors, top_k, params=faiss.SearchParameters(sel=selector))
+            ids = np.where(rows >= 0, self.faiss_ids[rows], -1)
+            return scores, ids
+
+
+def domain_rows(dataset: RAGDataset) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ (ids, vecs, live) for a domain's rows, run on a worker thread
+
+    FYI only the snapshot holds the dataset's index lock => LS updates to this domain don't wait on the reconstruct
+    """
+    with dataset._index_lock:
+        # mmapped => never modified in place (first update copies it, see materialize_index), else a copy (memcpy, no decode)
+        index = dataset.index if dataset.index_is_mmapped else faiss.clone_index(dataset.index)
+        exact_vectors = dataset.exact_vectors.snapshot() if dataset.exact_vectors is not None else None
+        tombstoned = np.fromiter(dataset.tombstoned_ids, dtype=np.int64, count=len(dataset.tombstoned_ids))
+
+    vecs, ids = get_vectors_and_ids(index)
+    if exact_vectors is not None:
+        # lossy index => prefer float32 vectors
+        exact, found = exact_vectors.get_many(ids)
+        vecs = np.where(found[:, None], exact, vecs)
+    # tombstoned => dead row, an LS update can revive it (see replace)
+    live = ~np.isin(ids, tombstoned)
+    return ids, vecs, live
+
+
+def benchmark(num_domains: int, vectors_per_domain: int, dimensions: int, top_k: int, num_queries: int):
+    """ loop over domains (oversampled top_k per domain + merge) vs one filtered search """
+    from config.vector_index import VectorIndexConfig
+    from index.vector_index import build_index
+
+    rng = np.random.default_rng(0)
+    datasets: dict[str, RAGDataset] = {}
+    for d in range(num_domains):
+        vecs = rng.standard_normal((vectors_per_domain, dimensions)).astype(np.float32)
+        faiss.normalize_L2(vecs)
+        ids = np.arange(vectors_per_domain, dtype=np.int64) + d * vectors_per_domain
+        datasets[f"domain{d}"] = RAGDataset(f"domain{d}", {}, {}, build_index(vecs, ids, VectorIndexConfig()))
+    queries = rng.standard_normal((num_queries, dimensions)).astype(np.float32)
+    faiss.normalize_L2(queries)
+    searched = list(datasets)[:max(1, num_domains * 3 // 4)]  # i.e. global_query_domains
+
+    start = time.perf_counter()
+    global_index = GlobalIndex.build(datasets)
+    build_ms = (time.perf_counter() - start) * 1000
+    assert global_index is not None
+
+    top_k_per_domain = max(1, round(1.5 * top_k / len(searched)))  # same as semantic_grep
+    loop_hits = 0
+    start = time.perf_counter()
+    for query in queries:
+        scores, ids = [], []
+        for domain in searched:
+            _scores, _ids = datasets[domain].search(query[None, :], top_k_per_domain)
+            scores.extend(_scores[0])
+            ids.extend(_ids[0])
+        loop_top = [id for id, _ in sorted(zip(ids, scores), key=lambda x: x[1], reverse=True)[:top_k]]
+        _, exact = global_index.search(query[None, :], top_k, searched)
+        loop_hits += len(set(loop_top) & set(exact[0].tolist()))
+    loop_ms = (time.perf_counter() - start) * 1000 / num_queries
+
+    start = time.perf_counter()
+    for query in queries:
+        global_index.search(query[None, :], top_k, searched)
+    global_ms = (time.perf_counter() - start) * 1000 / num_queries
+
+    # FYI loop timing includes one global search per query (for recall), subtract it
+    loop_ms -= global_ms
+    print(f"{num_domains} domains x {vectors_per_domain} vectors (d={dimensions}), searching {len(searched)}, top_k={top_k}")
+    print(f"  global index build: {build_ms:,.1f} ms")
+    print(f"  per domain loop:    {loop_ms:.3f} ms/query, recall@{top_k} vs exact global top_k {loop_hits / (num_queries * top_k):.3f}")
+    print(f"  global index:       {global_ms:.3f} ms/query, recall@{top_k} 1.000")
+
+
+def main():
+    # usage:
+    #   python3 -m index.global_index --domains 24
+    parser = argparse.ArgumentParser(description="benchmark GLOBAL search: per domain loop vs global index")
+    parser.add_argument("--domains", type=int, default=24)
+    parser.add_argument("--vectors-per-domain", type=int, default=2000)
+    parser.add_argument("--dimensions", type=int, default=1024)
+    parser.add_argument("--top-k", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=100)
+    args = parser.parse_args()
+    benchmark(args.domains, args.vectors_per_domain, args.dimensions, args.top_k, args.queries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import asyncio
+import threading
+
+import faiss
+import numpy as np
+import pytest
+
+from config.vector_index import KIND_HNSW, VectorIndexConfig
+from index import workspace
+from index import global_index as global_index_module
+from index.global_index import GlobalIndex, domain_rows
+from index.storage import Datasets, RAGDataset
+from index.testing import FakeVectorCache, chunk_for, random_vectors
+from index.vector_index import build_index
+
+
+def dataset_for(domain: str, seed: int, num_vectors: int = 200, kind: str = "flat") -> RAGDataset:
+    vecs, ids = random_vectors(num_vectors, seed=seed)
+    ids = ids + seed * 1_000_000  # unique across domains
+    return RAGDataset(domain, {}, {}, build_index(vecs, ids, VectorIndexConfig(kind=kind)))
+
+
+def exact_top_k(datasets: list[RAGDataset], query: np.ndarray, k: int) -> list[int]:
+    scores, ids = [], []
+    for dataset in datasets:
+        _scores, _ids = dataset.index.search(query, k)
+        scores.extend(_scores[0])
+        ids.extend(_ids[0])
+    return [id for id, _ in sorted(zip(ids, scores), key=lambda x: x[1], reverse=True)[:k]]
+
+
+def test_search_is_exact_top_k_of_selected_domains():
+    datasets = {d: dataset_for(d, seed) for seed, d in enumerate(["lua", "python", "markdown"], start=1)}
+    global_index = GlobalIndex.build(datasets)
+    query, _ = random_vectors(1, seed=42)
+
+    _, ids = global_index.search(query, 10, ["lua", "markdown"])
+
+    assert ids[0].tolist() == exact_top_k([datasets["lua"], datasets["markdown"]], query, 10)
+
+    # * fewer matches than top_k => -1 padded (like faiss)
+    _, ids = global_index.search(query, 300, ["lua"])
+    assert (ids[0] == -1).sum() == 100
+
+
+@pytest.mark.asyncio
+async def test_sync_adds_loaded_domains_and_rebuilds_reloaded():
+    lua = dataset_for("lua", 1)
+    datasets = Datasets({"lua": lua})
+    global_index = await datasets.sync_global_index()
+    assert global_index is not None and global_index.covers({"lua": lua})
+
+    python = datasets.all_datasets["python"] = dataset_for("python", 2)
+    assert datasets.get_global_index({"lua": lua}) is global_index  # python isn't searched => still current
+    assert datasets.get_global_index({"python": python}) is None  # adding python in the background
+    assert await datasets.sync_global_index() is global_index
+    assert global_index.index.ntotal == 400
+
+    reloaded = datasets.all_datasets["lua"] = dataset_for("lua", 3)
+    assert not global_index.can_add(datasets.all_datasets)
+    rebuilt = await datasets.sync_global_index()
+    assert rebuilt is not global_index and rebuilt.covers({"lua": reloaded, "python": python})
+
+
+@pytest.mark.asyncio
+async def test_sync_builds_off_the_event_loop(monkeypatch):
+    datasets = Datasets({"lua": dataset_for("lua", 1)})
+    building = threading.Event()
+    release = threading.Event()
+    build = GlobalIndex.build
+
+    def slow_build(datasets):
+        building.set()
+        release.wait(timeout=5)
+        return build(datasets)
+
+    monkeypatch.setattr(GlobalIndex, "build", staticmethod(slow_build))
+
+    assert datasets.get_global_index(datasets.all_datasets) is None
+    await asyncio.to_thread(building.wait, 5)
+    # event loop is free while the build runs, searches fall back to per domain meanwhile
+    assert datasets.get_global_index(datasets.all_datasets) is None
+    release.set()
+    assert await datasets.sync_global_index() is datasets.get_global_index(datasets.all_datasets) is not None
+
+
+@pytest.mark.asyncio
+async def test_update_during_build_is_not_lost(monkeypatch, tmp_path):
+    monkeypatch.setattr(workspace.project, "folder", tmp_path)
+    file = str(tmp_path / "foo.lua")
+    before = chunk_for("before edit", file)
+    vecs, _ = random_vectors(1)
+    index = build_index(vecs, np.array([before.faiss_id], dtype=np.int64), VectorIndexConfig())
+    datasets = Datasets({"lua": RAGDataset("lua", {file: [before]}, {}, index)}, vector_cache=FakeVectorCache())  # type: ignore
+    build = GlobalIndex.build
+    after_edit = chunk_for("after edit", file)
+    builds = []
+
+    def build_then_edit(snapshot):
+        global_index = build(snapshot)
+        builds.append(global_index)
+        if len(builds) == 1:
+            # LS update lands after the build read the vectors
+            asyncio.run_coroutine_threadsafe(datasets.update_file(file, [after_edit]), loop).result(timeout=5)
+        return global_index
+
+    loop = asyncio.get_running_loop()
+    monkeypatch.setattr(GlobalIndex, "build", staticmethod(build_then_edit))
+
+    global_index = await datasets.sync_global_index()
+
+    assert len(builds) == 2 and global_index is builds[1]
+    _, ids = global_index.search(vecs, 5, ["lua"])
+    assert [id for id in ids[0].tolist() if id != -1] == [after_edit.faiss_id]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("kind", ["flat", KIND_HNSW])
+async def test_ls_updates_are_applied(monkeypatch, tmp_path, kind):
+    monkeypatch.setattr(workspace.project, "folder", tmp_path)
+    file = str(tmp_path / "foo.lua")
+    kept, edited = chunk_for("kept", file), chunk_for("before edit", file)
+    vecs, _ = random_vectors(2)
+    index = build_index(vecs, np.array([kept.faiss_id, edited.faiss_id], dtype=np.int64), VectorIndexConfig(kind=kind))
+    datasets = Datasets({"lua": RAGDataset("lua", {file: [kept, edited]}, {}, index)}, vector_cache=FakeVectorCache())  # type: ignore
+    global_index = await datasets.sync_global_index()
+
+    after_edit = chunk_for("after edit", file)
+    await datasets.update_file(file, [kept, after_edit])
+    _, ids = global_index.search(vecs[:1], 5, ["lua"])
+    assert sorted(id for id in ids[0].tolist() if id != -1) == sorted([kept.faiss_id, after_edit.faiss_id])
+
+    # * undo => HNSW revives the tombstoned row
+    await datasets.update_file(file, [kept, edited])
+    _, ids = global_index.search(vecs[:1], 5, ["lua"])
+    assert sorted(id for id in ids[0].tolist() if id != -1) == sorted([kept.faiss_id, edited.faiss_id])
+    assert datasets.get_global_index(datasets.all_datasets) is global_index
+
+
+def test_domain_rows_reconstructs_outside_dataset_lock(monkeypatch):
+    dataset = dataset_for("lua", 1)
+    locked_while_reconstructing = []
+    get_vectors_and_ids = global_index_module.get_vectors_and_ids
+
+    def checking_get_vectors_and_ids(index):
+        locked_while_reconstructing.append(dataset._index_lock.locked())
+        return get_vectors_and_ids(index)
+
+    monkeypatch.setattr(global_index_module, "get_vectors_and_ids", checking_get_vectors_and_ids)
+
+    ids, vecs, live = domain_rows(dataset)
+
+    assert locked_while_reconstructing == [False]
+    assert len(ids) == len(vecs) == 200 and live.all()
+
+
+@pytest.mark.asyncio
+async def test_compacts_in_background_sync(monkeypatch, tmp_path):
+    monkeypatch.setattr(workspace.project, "folder", tmp_path)
+    file = str(tmp_path / "foo.lua")
+    chunks = [chunk_for(f"chunk {i}", file) for i in range(4)]
+    vecs, _ = random_vectors(4)
+    index = build_index(vecs, np.array([c.faiss_id for c in chunks], dtype=np.int64), VectorIndexConfig())
+    datasets = Datasets({"lua": RAGDataset("lua", {file: chunks}, {}, index)}, vector_cache=FakeVectorCache())  # type: ignore
+    global_index = await datasets.sync_global_index()
+    compactions = []
+    compact = global_index.compact
+    monkeypatch.setattr(global_index, "compact", lambda: compactions.append(threading.current_thread().name) or compact())
+
+    edited = [chunk_for("edited", file)]
+    await datasets.update_file(file, edited)
+    # 4 of 5 rows dead => compact, after the update returns
+    assert global_index.needs_compact()
+    assert await datasets.sync_global_index() is global_index
+
+    assert len(compactions) == 1 and compactions[0] != threading.current_thread().name
+    assert not global_index.needs_compact()
+    assert global_index.index.ntotal == 1
+    _, ids = global_index.search(vecs[:1], 5, ["lua"])
+    assert [id for id in ids[0].tolist() if id != -1] == [edited[0].faiss_id]
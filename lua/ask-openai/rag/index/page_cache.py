@@ -0,0 +1,59 @@
+import ctypes
+import ctypes.util
+import mmap
+import sys
+from pathlib import Path
+
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+# FYI mincore reports which pages of a mapping are in the page cache
+#   => tells a cold start (read from disk) apart from a warm start (another process/prior run already loaded it)
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        # macOS declares vec as char*, same layout
+        _libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.POINTER(ctypes.c_ubyte)]
+        _libc.mincore.restype = ctypes.c_int
+    return _libc
+
+
+def resident_fraction(path: Path) -> float | None:
+    """ fraction of the file's pages in the page cache, None if unknown (empty file, no mincore) """
+    if sys.platform not in ("linux", "darwin"):
+        return None
+    try:
+        size = path.stat().st_size
+        if size == 0:
+            return None
+        with open(path, "rb") as f:
+            # ACCESS_COPY => private writable mapping (ctypes needs writable), never written so nothing is copied
+            mapped = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_COPY)
+        try:
+            num_pages = (size + mmap.PAGESIZE - 1) // mmap.PAGESIZE
+            vec = (ctypes.c_ubyte * num_pages)()
+            start = ctypes.c_char.from_buffer(mapped)
+            try:
+                result = _get_libc().mincore(ctypes.addressof(start), size, vec)
+            finally:
+                del start  # release buffer export, else close fails
+            if result != 0:
+                return None
+            return sum(page & 1 for page in vec) / num_pages
+        finally:
+            mapped.close()
+    except Exception as e:
+        logger.debug(f"mincore failed for {path}: {e}")
+        return None
+
+
+def describe_residency(fraction: float | None) -> str:
+    if fraction is None:
+        return "page cache unknown"
+    temperature = "warm" if fraction >= 0.5 else "cold"
+    return f"{temperature}, {fraction:.0%} in page cache"
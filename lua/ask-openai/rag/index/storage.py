@@ -1,8 +1,12 @@
+import asyncio
+import contextlib
 import hashlib
 import json
+import threading
+import humanize
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Optional, Protocol, cast, Iterable
+from typing import Callable, Optional, Protocol, cast, Iterable
 from enum import Enum, StrEnum
 
 # FYI if you go back to inference in the same process as FAISS, then torch has to be imported before FAISS (issue w/ qwen3 model load blowing up)
@@ -11,11 +15,16 @@ import faiss
 
 import numpy as np
 from numpy.typing import NDArray
-from pydantic import BaseModel
+from pydantic import BaseModel, SerializerFunctionWrapHandler, model_serializer
 
-from logs import get_logger
+from logs import Timer, get_logger
 from config.domains import resolve_semantic_domain, resolve_semantic_domain_for_vim_filetype
 from inference.client.embedder import encode_passages
+from index.vector_cache import VectorCache
+from index.exact_vectors import ExactVectors
+from index.generations import current_generation, data_dir_for
+from index.page_cache import describe_residency, resident_fraction
+from index.vector_index import describe_index, get_ids, materialize_index, read_index, supports_remove_ids
 
 logger = get_logger(__name__)
 
@@ -32,12 +41,15 @@ def chunk_id_with_columns_for(file_path: Path, chunk_type: str, start_line_base0
     return hashlib.sha256(chunk_str.encode()).hexdigest()[:16]
 
 
+FAISS_ID_MASK = 0x7FFFFFFFFFFFFFFF
+
+
 def chunk_id_to_faiss_id(chunk_id: str) -> int:
     """Convert chunk ID to FAISS ID (signed int64)"""
     # Convert hex string directly to int and mask for signed int64
     hash_int = int(chunk_id, 16)  # hex => int
     # Mask to fit in signed int64 (0x7FFFFFFFFFFFFFFF = 2^63 - 1)
-    return hash_int & 0x7FFFFFFFFFFFFFFF
+    return hash_int & FAISS_ID_MASK
 
 
 class FileStat(BaseModel):
@@ -88,6 +100,16 @@ class Chunk(BaseModel):
     def base1(self) -> "_Pos":
         return _Pos(self, 1)  # 1-based
 
+    def _decode_lazy_fields(self):
+        """ overridden by chunks that decode fields on first access (see chunk_store.StoredChunk) """
+
+    @model_serializer(mode="wrap")
+    def _serialize(self, handler: SerializerFunctionWrapHandler):
+        # FYI pydantic serializes from __dict__ => lazy fields must be decoded first
+        #   here (vs overriding model_dump) => also applies when nested, i.e. JournalEntry.chunks
+        self._decode_lazy_fields()
+        return handler(self)
+
 
 @dataclass(frozen=True, slots=True)
 class _Pos:
@@ -115,6 +137,76 @@ class _Pos:
         return self._chunk.end_column0 + self.base
 
 
+# * faiss_id => chunk lookups
+# merge updates into the sorted arrays once there are this many (or 1/8th of the chunks, whichever is larger)
+COMPACT_MIN_UPDATES = 1024
+
+
+class ChunkLookup:
+    """ faiss_id => chunk, sorted int64 ids w/ a parallel row index into one flat list of chunks
+
+    FYI vs dict[int, Chunk] => no int object + dict entry per chunk, builds w/o calling chunk.faiss_id per chunk
+      and a whole result set resolves w/ one np.searchsorted
+    """
+
+    def __init__(self, chunks: list[Chunk], ids: np.ndarray):
+        """ ids[i] is chunks[i].faiss_id """
+        order = np.argsort(ids, kind="stable")
+        self._chunks = chunks
+        self._ids: np.ndarray = ids[order]
+        self._rows: np.ndarray = order
+        # edits since build (LS update_file), None => removed
+        self._updated: dict[int, Optional[Chunk]] = {}
+
+    @classmethod
+    def from_chunks_by_file(cls, chunks_by_file: dict[str, list[Chunk]]) -> "ChunkLookup":
+        chunks = [chunk for file_chunks in chunks_by_file.values() for chunk in file_chunks]
+        # hex => uint64 in one pass, then mask to signed int64 (same as chunk_id_to_faiss_id)
+        ids = np.fromiter((int(chunk.id, 16) for chunk in chunks), dtype=np.uint64, count=len(chunks))
+        ids = (ids & np.uint64(FAISS_ID_MASK)).astype(np.int64)
+        return cls(chunks, ids)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @property
+    def num_updates(self) -> int:
+        return len(self._updated)
+
+    @property
+    def nbytes(self) -> int:
+        # excludes chunks themselves
+        return self._ids.nbytes + self._rows.nbytes + 8 * len(self._chunks)
+
+    def get_many(self, ids: Iterable[int] | np.ndarray) -> list[Optional[Chunk]]:
+        """ None for ids w/o a chunk (i.e. tombstoned, other domain) """
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        if len(self._ids) == 0:
+            chunks: list[Optional[Chunk]] = [None] * len(ids)
+        else:
+            positions = np.minimum(np.searchsorted(self._ids, ids), len(self._ids) - 1)
+            found = self._ids[positions] == ids
+            rows = self._rows[positions]
+            chunks = [self._chunks[row] if hit else None for row, hit in zip(rows.tolist(), found.tolist())]
+
+        if self._updated:
+            for i, id in enumerate(ids.tolist()):
+                if id in self._updated:
+                    chunks[i] = self._updated[id]
+        return chunks
+
+    def get(self, faiss_id: int) -> Optional[Chunk]:
+        return self.get_many([faiss_id])[0]
+
+    def update(self, prior_ids: list[int], new_chunks: list[Chunk]) -> bool:
+        """ one file's chunks changed, returns True when it's time to compact (rebuild from chunks_by_file) """
+        for prior_id in prior_ids:
+            self._updated[prior_id] = None
+        for chunk in new_chunks:
+            self._updated[chunk.faiss_id] = chunk
+        return len(self._updated) >= max(COMPACT_MIN_UPDATES, len(self._ids) // 8)
+
+
 # * FAISS type hint wrappers
 class Int64VectorIndex(Protocol):
     """ Type hint wrapper for FAISS/swigfaiss runtime types so I can get some decent completions in dev """
@@ -137,13 +229,10 @@ class FaissIndexView:
 
     @property
     def ids(self) -> Int64Vector | None:
-        if hasattr(self.dataset.index, 'id_map'):
-            return cast(Int64Vector, faiss.vector_to_array(self.dataset.index.id_map))
-        else:
-            # TODO does this happen when creating a brand new index (not loading from file)
-            #  if so, how do I want to handle this? return empty?
-            #  AND, is this ever set? or is id_map tied to the loaded file and not what I add in memory?!
+        if self.dataset.index is None:
             return None
+        # FYI IVF stores ids in its inverted lists (no id_map)
+        return cast(Int64Vector, get_ids(self.dataset.index))
 
     def _check_for_duplicate_ids(self) -> Iterable[tuple[np.int64, int]]:
         """ NOTE: there should NOT be any duplicates """
@@ -163,18 +252,137 @@ class FaissIndexView:
 @dataclass
 class RAGDataset:
 
-    def __init__(self, domain, chunks_by_file, files_by_path, index):
+    def __init__(self, domain, chunks_by_file, files_by_path, index, exact_vectors=None, index_is_mmapped=False):
         self.domain = domain
         self.chunks_by_file = chunks_by_file
         self.stat_by_path = files_by_path
         self.index = index
         self.index_view = FaissIndexView(self)
+        self.tombstoned_ids = set()
+        self.exact_vectors = exact_vectors
+        self.index_is_mmapped = index_is_mmapped
+        self.chunk_lookup = ChunkLookup.from_chunks_by_file(chunks_by_file)
+        self.journal_bytes_replayed = 0
+        self.generation = 0
+        self.num_updates = 0
+        self._index_lock = threading.Lock()
 
     domain: str
     chunks_by_file: dict[str, list[Chunk]]
     stat_by_path: dict[str, FileStat]
     index: faiss.Index
     index_view: FaissIndexView
+    # ids left in an index that can't remove_ids (HNSW), lookups return no chunk so searches skip them
+    #   indexer rebuilds w/o them on its next run
+    tombstoned_ids: set[int]
+    # only for lossy indexes (sq8/fp16/pq), used to rescore candidates
+    exact_vectors: Optional[ExactVectors]
+    # read only until materialize_index (first update)
+    index_is_mmapped: bool
+    # faiss_id => chunk, live chunks only (tombstoned/replaced ids resolve to None)
+    chunk_lookup: ChunkLookup
+    # > 0 => LS updates were replayed on top of the files on disk, indexer compacts them
+    journal_bytes_replayed: int
+    # see generations, 0 => legacy layout
+    generation: int
+    # LS updates applied since load
+    num_updates: int
+    # searches run on worker threads (see semantic_grep) => serialize them w/ updates (add/remove_ids, materialize_index)
+    _index_lock: threading.Lock
+
+    def search(self, query_vectors: np.ndarray, top_k: int, rescore_factor: int = 4) -> tuple[np.ndarray, np.ndarray]:
+        """ same as index.search, w/ exact rescoring of top_k * rescore_factor candidates when the index is lossy """
+        with self._index_lock:
+            if self.exact_vectors is None or rescore_factor <= 1:
+                return self.index.search(query_vectors, top_k)
+            scores, ids = self.index.search(query_vectors, top_k * rescore_factor)
+            return self.exact_vectors.rescore(query_vectors, scores, ids, top_k)
+
+    def get_chunks_by_faiss_ids(self, faiss_ids: Iterable[int] | np.ndarray) -> list[Optional[Chunk]]:
+        return self.chunk_lookup.get_many(faiss_ids)
+
+    def set_file_chunks(self, file_path_str: str, prior_faiss_ids: list[int], new_chunks: list[Chunk]):
+        self.chunks_by_file[file_path_str] = new_chunks
+        if self.chunk_lookup.update(prior_faiss_ids, new_chunks):
+            with logger.timer(f"Compact {self.domain} chunk lookup"):
+                self.chunk_lookup = ChunkLookup.from_chunks_by_file(self.chunks_by_file)
+
+    def set_file_stat(self, file_path_str: str, stat: Optional[FileStat]):
+        if stat is None:
+            self.stat_by_path.pop(file_path_str, None)
+        else:
+            self.stat_by_path[file_path_str] = stat
+
+    def plan_file_update(self, file_path_str: str, new_chunks: list[Chunk]) -> Optional[tuple[list[int], list[Chunk]]]:
+        """ returns (prior_faiss_ids, chunks_to_add) w/o modifying anything, None => chunks didn't change """
+        # * find prior chunks (if any)
+        prior_chunks: list[Chunk] | None = None
+        if file_path_str in self.chunks_by_file:
+            from index import workspace
+            logger.debug(f"Prior chunks exist for {workspace.get_relative_path_to(file_path_str)}")
+            prior_chunks = self.chunks_by_file[file_path_str]
+
+        if not prior_chunks:
+            logger.debug(f"No prior_chunks")
+            prior_chunks = []
+
+        # * FAISS UPDATES:
+        new_faiss_ids = [c.faiss_id for c in new_chunks]
+        prior_faiss_ids = [c.faiss_id for c in prior_chunks]
+
+        # * YES! if chunks match, skip encoding which is most expensive part!
+        if prior_faiss_ids == new_faiss_ids:
+            logger.debug(f"prior_chunks match new_chunks, SKIP re-encoding!")
+            return None
+
+        # * useful troubleshooting when rebuilding (won't need this if chunks match)
+        logger.pp_debug("prior_chunks", prior_chunks)
+        logger.pp_debug("new_chunks", new_chunks)
+        logger.pp_debug("new_faiss_ids", new_faiss_ids)
+        logger.pp_debug("prior_faiss_ids", prior_faiss_ids)
+
+        if supports_remove_ids(self.index):
+            return prior_faiss_ids, new_chunks
+
+        # i.e. HNSW => only add vectors that aren't already in the index (prior vectors are tombstoned)
+        in_index = set(prior_faiss_ids) | self.tombstoned_ids
+        return prior_faiss_ids, [c for c in new_chunks if c.faiss_id not in in_index]
+
+    def apply_file_update(self, file_path_str: str, prior_faiss_ids: list[int], new_chunks: list[Chunk], chunks_to_add: list[Chunk], vecs_np: np.ndarray, stat: Optional[FileStat] = None):
+        """ vecs_np aligned w/ chunks_to_add, see plan_file_update """
+        self.apply_index_update(prior_faiss_ids, new_chunks, chunks_to_add, vecs_np)
+        self.apply_chunk_update(file_path_str, prior_faiss_ids, new_chunks, stat)
+
+    def apply_index_update(self, prior_faiss_ids: list[int], new_chunks: list[Chunk], chunks_to_add: list[Chunk], vecs_np: np.ndarray):
+        """ FYI waits on in flight searches (index lock) => LS runs this on a worker thread (see Datasets.update_file) """
+        with self._index_lock:
+            if self.index_is_mmapped:
+                # FYI this domain's vectors are no longer shared w/ other processes (until next load)
+                with logger.timer(f"Copy mmapped {self.domain} index into memory for update"):
+                    self.index = materialize_index(self.index)
+                self.index_is_mmapped = False
+
+            if supports_remove_ids(self.index):
+                prior_selector = faiss.IDSelectorArray(np.array(prior_faiss_ids, dtype="int64"))
+                self.index.remove_ids(prior_selector)
+            else:
+                new_ids = {c.faiss_id for c in new_chunks}
+                self.tombstoned_ids |= set(prior_faiss_ids) - new_ids
+                self.tombstoned_ids -= new_ids  # revived (i.e. undo an edit)
+                logger.debug(f"{self.domain} has {len(self.tombstoned_ids)} tombstoned vectors")
+
+            if chunks_to_add:
+                faiss_ids_np = np.array([c.faiss_id for c in chunks_to_add], dtype="int64")
+                self.index.add_with_ids(vecs_np, faiss_ids_np)
+                if self.exact_vectors is not None:
+                    self.exact_vectors.put_many(faiss_ids_np, vecs_np)
+
+    def apply_chunk_update(self, file_path_str: str, prior_faiss_ids: list[int], new_chunks: list[Chunk], stat: Optional[FileStat] = None):
+        # * update file's list of chunks (and faiss_id lookups)
+        self.set_file_chunks(file_path_str, prior_faiss_ids, new_chunks)
+        if stat is not None:
+            self.set_file_stat(file_path_str, stat)
+        self.num_updates += 1
 
     def num_chunks(self) -> int:
         return sum(len(chunks) for chunks in self.chunks_by_file.values())
@@ -188,27 +396,243 @@ class RAGDataset:
 
 @dataclass
 class Datasets:
+    # loaded domains only, see lazy_load_all_domains
     all_datasets: dict[str, RAGDataset]
-    # FYI must use default_factory else the default dict {} is shared among all instances! b/c defaults are evaluated ONCE in scope that declares this class
-    _chunks_by_faiss_id: dict[int, Chunk] = field(default_factory=dict)
+    vector_cache: Optional[VectorCache] = None
+
+    # * lazy loading => domains on disk that are loaded on first search/update
+    dot_rag_dir: Optional[Path] = None
+    # FYI must use default_factory else the default set() is shared among all instances! b/c defaults are evaluated ONCE in scope that declares this class
+    unloaded_domains: set[str] = field(default_factory=set)
+    mmap: bool = True
+    # i.e. validate each domain as it loads
+    on_domain_loaded: Optional[Callable[[RAGDataset], None]] = None
+    # one load per domain, shared by concurrent callers
+    _loading: dict[str, asyncio.Task] = field(default_factory=dict)
+
+    # * LS updates are journaled to .rag/<domain>/journal.jsonl (see update_journal)
+    journal_updates: bool = False
+    _journals: dict[str, "UpdateJournal"] = field(default_factory=dict)
+    # one LS update/reload at a time per domain (updates are applied on worker threads, see update_file)
+    _update_locks: dict[str, asyncio.Lock] = field(default_factory=dict)
+
+    # * hot reload when the indexer publishes a new generation (see watch_generations)
+    _watch_task: Optional[asyncio.Task] = None
+
+    # built on first use, see get_global_index
+    _global_index: Optional["GlobalIndex"] = None
+    _global_index_task: Optional[asyncio.Task] = None
+
+    def domains(self) -> list[str]:
+        """ loaded + unloaded """
+        return sorted(set(self.all_datasets) | self.unloaded_domains)
+
+    async def load(self, domain: str) -> Optional[RAGDataset]:
+        dataset = self.all_datasets.get(domain)
+        if dataset is not None or domain not in self.unloaded_domains:
+            return dataset
+
+        task = self._loading.get(domain)
+        if task is None:
+            task = asyncio.create_task(self._load(domain))
+            self._loading[domain] = task
+        # shield => cancelling one caller (i.e. a stopped search) doesn't cancel the load for everyone else
+        return await asyncio.shield(task)
+
+    async def _load(self, domain: str) -> RAGDataset:
+        try:
+            assert self.dot_rag_dir is not None
+            # FYI thread => other domains (and requests) keep going while this one reads from disk
+            dataset = await asyncio.to_thread(load_domain, self.dot_rag_dir, domain, self.mmap)
+            self.all_datasets[domain] = dataset
+            self.unloaded_domains.discard(domain)
+            if self.on_domain_loaded is not None:
+                try:
+                    self.on_domain_loaded(dataset)
+                except Exception:
+                    logger.exception(f"on_domain_loaded failed for {domain}")
+            return dataset
+        finally:
+            self._loading.pop(domain, None)
+
+    async def load_many(self, domains: Iterable[str]) -> dict[str, RAGDataset]:
+        """ concurrent, returns loaded datasets (skips unknown domains) """
+        domains = list(domains)
+        pending = [d for d in domains if d in self.unloaded_domains]
+        if pending:
+            with logger.timer(f"Load {len(pending)} domains {pending}"):
+                await asyncio.gather(*(self.load(d) for d in pending))
+        return {d: self.all_datasets[d] for d in domains if d in self.all_datasets}
+
+    def prefetch(self, domain: str):
+        """ start loading in the background (i.e. domain of a buffer that was just opened) """
+        if domain not in self.unloaded_domains or domain in self._loading:
+            return
 
-    def __post_init__(self):
-        # * build _chunks_by_faiss_id off of chunks_by_file
-        for dataset in self.all_datasets.values():
-            for _, chunks in dataset.chunks_by_file.items():
-                for chunk in chunks:
-                    faiss_id = chunk.faiss_id
-                    self._chunks_by_faiss_id[faiss_id] = chunk
+        def log_failure(task: asyncio.Task):
+            if not task.cancelled() and task.exception() is not None:
+                logger.error(f"prefetch {domain} failed", exc_info=task.exception())
+
+        logger.info(f"prefetch {domain}")
+        task = asyncio.create_task(self._load(domain))
+        self._loading[domain] = task
+        task.add_done_callback(log_failure)
+
+    def prefetch_for_file(self, file_path: str | Path):
+        domain = resolve_semantic_domain(file_path)
+        if domain:
+            self.prefetch(domain)
+
+    async def reload_changed_domains(self) -> list[str]:
+        """ swap in domains w/ a newer generation on disk, returns reloaded domains
+
+        FYI in flight searches keep the RAGDataset they started with, new searches get the reloaded one
+        """
+        assert self.dot_rag_dir is not None
+
+        # * domains the indexer added/removed
+        on_disk = {dir.name for dir in get_domain_dirs(self.dot_rag_dir)}
+        for domain in on_disk - set(self.all_datasets) - self.unloaded_domains:
+            logger.info(f"new domain {domain} (load on first use)")
+            self.unloaded_domains.add(domain)
+        for domain in self.domains():
+            if domain not in on_disk and domain not in self._loading:
+                logger.info(f"domain {domain} was removed")
+                self.unloaded_domains.discard(domain)
+                self.all_datasets.pop(domain, None)
+
+        reloaded = []
+        for domain, dataset in list(self.all_datasets.items()):
+            if domain in self._loading or current_generation(self.dot_rag_dir / domain) == dataset.generation:
+                continue
+
+            # FYI file updates wait until the reload is swapped in => none land mid reload (they'd be missing from what was just loaded)
+            async with self._update_lock_for(domain):
+                journal = self._journals.get(domain)
+                if journal is not None:
+                    # reload replays the journal => include this LS's own pending updates
+                    await journal.flush()
+
+                with logger.timer(f"Reload {domain}"):
+                    reloaded_dataset = await asyncio.to_thread(load_domain, self.dot_rag_dir, domain, self.mmap)
+
+                if self.all_datasets.get(domain) is not dataset:
+                    logger.info(f"{domain} changed during reload, retry on next check")
+                    continue
+                self.all_datasets[domain] = reloaded_dataset
+            reloaded.append(domain)
+            if self.on_domain_loaded is not None:
+                try:
+                    self.on_domain_loaded(reloaded_dataset)
+                except Exception:
+                    logger.exception(f"on_domain_loaded failed for {domain}")
+        return reloaded
+
+    async def watch_generations(self, interval_sec: float):
+        """ poll each domain's manifest.json, runs until cancelled """
+        while True:
+            await asyncio.sleep(interval_sec)
+            try:
+                await self.reload_changed_domains()
+            except Exception:
+                logger.exception("check for new generations failed")
+
+    def start_watching_generations(self, interval_sec: float):
+        if self.dot_rag_dir is None or interval_sec <= 0 or self._watch_task is not None:
+            return
+        logger.info(f"watching for new index generations every {interval_sec}s")
+        self._watch_task = asyncio.create_task(self.watch_generations(interval_sec))
 
-    def get_chunk_by_faiss_id(self, faiss_id) -> Optional[Chunk]:
-        # now consumers have no knowledge of the cache
-        #  this will help with updates too, to not let the updater have to think about this
-        # FYI I don't have to remove items here b/c they are content hashed so doesn't matter if they're left behind (for now)
-        # PRN might wanna move this to the dataset level to update it on updates to a doc in a dataset
-        return self._chunks_by_faiss_id.get(faiss_id)
+    def get_global_index(self, datasets: dict[str, RAGDataset]) -> Optional["GlobalIndex"]:
+        """ combined index, None => not (yet) current for these datasets, search them per domain meanwhile
 
-    def for_file(self, file_path: str | Path | None = None, vim_filetype: str | None = None):
+        FYI never builds on the event loop, out of sync => sync in the background (see sync_global_index)
+        """
+        if self._global_index is not None and self._global_index.covers(datasets):
+            return self._global_index
+        self.start_syncing_global_index()
+        return None
+
+    def start_syncing_global_index(self):
+        if self._global_index_task is not None:
+            return
+
+        def log_failure(task: asyncio.Task):
+            if not task.cancelled() and task.exception() is not None:
+                logger.error("sync global index failed", exc_info=task.exception())
+
+        self._global_index_task = asyncio.create_task(self._sync_global_index())
+        self._global_index_task.add_done_callback(log_failure)
+
+    async def sync_global_index(self) -> Optional["GlobalIndex"]:
+        """ wait for the global index to cover all loaded domains """
+        self.start_syncing_global_index()
+        assert self._global_index_task is not None
+        await asyncio.shield(self._global_index_task)
+        return self._global_index
+
+    async def _sync_global_index(self):
+        """ newly loaded domains are added, a reloaded domain => rebuild (LS updates are applied incrementally, see update_file), too many dead rows => compact
 
+        vectors are reconstructed on a worker thread => LSP requests keep going
+        """
+        from index.global_index import GlobalIndex, domain_rows
+        try:
+            while True:
+                datasets = dict(self.all_datasets)
+                global_index = self._global_index
+                if global_index is not None and global_index.covers(datasets):
+                    if global_index.needs_compact():
+                        # FYI update locks => no LS update lands between a dataset's tombstones changing and its global rows (replace)
+                        async with self._update_locks_for(global_index.sources):
+                            with logger.timer("Compact global index"):
+                                await asyncio.to_thread(global_index.compact)
+                    return
+
+                if global_index is not None and global_index.can_add(datasets):
+                    read = {domain: ds for domain, ds in datasets.items() if domain not in global_index.sources}
+                    num_updates = {domain: ds.num_updates for domain, ds in read.items()}
+                    with logger.timer(f"Add {sorted(read)} to global index"):
+                        rows_by_domain = await asyncio.to_thread(lambda: {domain: domain_rows(ds) for domain, ds in read.items() if ds.index is not None})
+                else:
+                    read = datasets
+                    num_updates = {domain: ds.num_updates for domain, ds in read.items()}
+                    global_index = await asyncio.to_thread(GlobalIndex.build, datasets)
+                    rows_by_domain = {}
+
+                # FYI update locks => no LS update (or reload) of a read domain between this check and installing
+                async with self._update_locks_for(read):
+                    if any(self.all_datasets.get(domain) is not ds or ds.num_updates != num_updates[domain] for domain, ds in read.items()):
+                        # i.e. reloaded or updated by the LS while reading its vectors
+                        logger.info("domains changed while syncing global index, retry")
+                        continue
+                    if global_index is None:
+                        # no vectors yet
+                        self._global_index = None
+                        return
+                    # FYI worker thread => waits on in flight global searches w/o stalling the event loop
+                    await asyncio.to_thread(global_index.add_rows, rows_by_domain, datasets)
+                    self._global_index = global_index
+        finally:
+            self._global_index_task = None
+
+    def get_chunk_by_faiss_id(self, faiss_id) -> Optional[Chunk]:
+        return self.get_chunks_by_faiss_ids([faiss_id])[0]
+
+    def get_chunks_by_faiss_ids(self, faiss_ids: Iterable[int] | np.ndarray) -> list[Optional[Chunk]]:
+        """ resolve a whole result set at once (loaded domains only), None => no chunk (i.e. tombstoned) """
+        faiss_ids = np.asarray(faiss_ids, dtype=np.int64).ravel()
+        chunks: list[Optional[Chunk]] = [None] * len(faiss_ids)
+        for dataset in self.all_datasets.values():
+            missing = [i for i, chunk in enumerate(chunks) if chunk is None]
+            if not missing:
+                break
+            found = dataset.get_chunks_by_faiss_ids(faiss_ids[missing])
+            for i, chunk in zip(missing, found):
+                chunks[i] = chunk
+        return chunks
+
+    def _domain_for(self, file_path: str | Path | None = None, vim_filetype: str | None = None) -> Optional[str]:
         if file_path is not None:
             domain = resolve_semantic_domain(file_path)
         elif vim_filetype is not None:
@@ -219,66 +643,103 @@ class Datasets:
         if domain is None or domain == '':
             logger.error("No semantic domain resolved for file, can't find dataset!")
             return None
+        return domain
 
+    def for_file(self, file_path: str | Path | None = None, vim_filetype: str | None = None):
+        """ loaded datasets only, see load_for_file """
+        domain = self._domain_for(file_path, vim_filetype)
+        if domain is None:
+            return None
         return self.all_datasets.get(domain)
 
-    async def update_file(self, file_path_str: str | Path, new_chunks: list[Chunk]):
-        file_path_str = str(file_path_str)  # must be str, just let people pass either
-
-        dataset = self.for_file(file_path_str)
-        if dataset is None:
-            logger.error(f"No dataset for path: {file_path_str}")
-            # TODO should I create it then (from scratch) as first file?
-            return
-
-        if dataset.index is None:
-            logger.error(f"Dataset {dataset.domain} has no index")
-            return
-
-        # * find prior chunks (if any)
-        prior_chunks: list[Chunk] | None = None
-        if file_path_str in dataset.chunks_by_file:
-            from index import workspace
-            logger.debug(f"Prior chunks exist for {workspace.get_relative_path_to(file_path_str)}")
-            prior_chunks = dataset.chunks_by_file[file_path_str]
-
-        if not prior_chunks:
-            logger.debug(f"No prior_chunks")
-            prior_chunks = []
-
-        # * FAISS UPDATES:
-        new_faiss_ids = [c.faiss_id for c in new_chunks]
-        prior_faiss_ids = [c.faiss_id for c in prior_chunks]
-
-        # * YES! if chunks match, skip encoding which is most expensive part!
-        if prior_faiss_ids == new_faiss_ids:
-            logger.debug(f"prior_chunks match new_chunks, SKIP re-encoding!")
-            return
-
-        # * useful troubleshooting when rebuilding (won't need this if chunks match)
-        logger.pp_debug("prior_chunks", prior_chunks)
-        logger.pp_debug("new_chunks", new_chunks)
-        logger.pp_debug("new_faiss_ids", new_faiss_ids)
-        logger.pp_debug("prior_faiss_ids", prior_faiss_ids)
-
-        prior_selector = faiss.IDSelectorArray(np.array(prior_faiss_ids, dtype="int64"))
-        dataset.index.remove_ids(prior_selector)
-
-        passages = [chunk.text for chunk in new_chunks]
-        vecs_np = await encode_passages(passages)
-
-        faiss_ids_np = np.array(new_faiss_ids, dtype="int64")
+    async def load_for_file(self, file_path: str | Path | None = None, vim_filetype: str | None = None) -> Optional[RAGDataset]:
+        domain = self._domain_for(file_path, vim_filetype)
+        if domain is None:
+            return None
+        return await self.load(domain)
 
-        dataset.index.add_with_ids(vecs_np, faiss_ids_np)
+    async def update_file(self, file_path_str: str | Path, new_chunks: list[Chunk], stat: Optional[FileStat] = None):
+        file_path_str = str(file_path_str)  # must be str, just let people pass either
 
-        # * update file's list of chunks
-        dataset.chunks_by_file[file_path_str] = new_chunks
+        while True:
+            dataset = await self.load_for_file(file_path_str)
+            if dataset is None:
+                logger.error(f"No dataset for path: {file_path_str}")
+                # TODO should I create it then (from scratch) as first file?
+                return
+
+            if dataset.index is None:
+                logger.error(f"Dataset {dataset.domain} has no index")
+                return
+
+            planned = dataset.plan_file_update(file_path_str, new_chunks)
+            if planned is None:
+                return
+            prior_faiss_ids, chunks_to_add = planned
+
+            vecs_np = np.empty((0, dataset.index.d), dtype=np.float32)
+            if chunks_to_add:
+                passages = [chunk.text for chunk in chunks_to_add]
+                if self.vector_cache is None:
+                    vecs_np = await encode_passages(passages)
+                else:
+                    # typically only the edited chunk(s) are misses
+                    vecs_np = await self.vector_cache.encode_passages(passages, dataset.index.d)
+
+            # FYI update lock => dataset can't be swapped out (reload) before the update is applied and journaled
+            async with self._update_lock_for(dataset.domain):
+                if self.all_datasets.get(dataset.domain) is not dataset:
+                    # i.e. hot reloaded while encoding => applying to the old dataset would lose the update
+                    logger.info(f"{dataset.domain} reloaded while encoding {file_path_str}, re-plan against reloaded dataset")
+                    continue
+                await self._apply_update(dataset, file_path_str, prior_faiss_ids, new_chunks, chunks_to_add, vecs_np, stat)
+                return
+
+    async def _apply_update(self, dataset: RAGDataset, file_path_str: str, prior_faiss_ids: list[int], new_chunks: list[Chunk], chunks_to_add: list[Chunk], vecs_np: np.ndarray, stat: Optional[FileStat]):
+        # FYI index updates wait on in flight searches (i.e. a GLOBAL scan on a worker thread) => worker thread too, else a save stalls the event loop
+        await asyncio.to_thread(dataset.apply_index_update, prior_faiss_ids, new_chunks, chunks_to_add, vecs_np)
+        dataset.apply_chunk_update(file_path_str, prior_faiss_ids, new_chunks, stat)
+        faiss_ids_np = np.array([c.faiss_id for c in chunks_to_add], dtype="int64")
+        global_index = self._global_index
+        if global_index is not None and global_index.has_source(dataset):
+            await asyncio.to_thread(global_index.replace, dataset.domain, prior_faiss_ids, [c.faiss_id for c in new_chunks], faiss_ids_np, vecs_np)
+            if global_index.needs_compact():
+                self.start_syncing_global_index()
+
+        # * write-behind => survives LS restart, indexer compacts it
+        journal = self._journal_for(dataset.domain)
+        if journal is not None:
+            from index.update_journal import JournalEntry
+            journal.append(JournalEntry.create(file_path_str, stat, new_chunks, faiss_ids_np, vecs_np, dataset.index.d))
+
+    def _update_lock_for(self, domain: str) -> asyncio.Lock:
+        lock = self._update_locks.get(domain)
+        if lock is None:
+            lock = self._update_locks[domain] = asyncio.Lock()
+        return lock
+
+    @contextlib.asynccontextmanager
+    async def _update_locks_for(self, domains: Iterable[str]):
+        # sorted => same order everywhere, no deadlocks
+        async with contextlib.AsyncExitStack() as locks:
+            for domain in sorted(domains):
+                await locks.enter_async_context(self._update_lock_for(domain))
+            yield
+
+    def _journal_for(self, domain: str) -> Optional["UpdateJournal"]:
+        if self.dot_rag_dir is None or not self.journal_updates:
+            return None
+        journal = self._journals.get(domain)
+        if journal is None:
+            from index.update_journal import UpdateJournal
+            journal = UpdateJournal(self.dot_rag_dir / domain)
+            self._journals[domain] = journal
+        return journal
 
-        # * updates for cache in _chunks_by_faiss_id
-        for prior_id in prior_faiss_ids:
-            del self._chunks_by_faiss_id[prior_id]
-        for new_chunk in new_chunks:
-            self._chunks_by_faiss_id[new_chunk.faiss_id] = new_chunk
+    def flush_journals(self):
+        """ i.e. on LS shutdown, else pending entries are written in the background """
+        for journal in self._journals.values():
+            journal.flush_now()
 
 
 def load_chunks_by_file(chunks_json_path: Path) -> dict[str, list[Chunk]]:
@@ -293,52 +754,96 @@ def load_file_stats_by_file(files_json_path: Path):
         return files_by_path
 
 
-def load_domain(dot_rag_dir: Path, domain: str) -> RAGDataset:
-    """Load prior indexed data for a given semantic domain."""
+def load_domain(dot_rag_dir: Path, domain: str, mmap: bool = False) -> RAGDataset:
+    """Load prior indexed data for a given semantic domain.
+
+    mmap => share vectors w/ other processes via page cache (read only until an update copies it), load is ~O(metadata)
+    """
     domain_dir = dot_rag_dir / domain
+    # FYI current generation's files (see generations), prior generation is kept so this can't be pulled out from under us
+    generation, data_dir = data_dir_for(domain_dir) if domain_dir.exists() else (0, domain_dir)
 
-    vectors_index_path = domain_dir / "vectors.index"
+    vectors_index_path = data_dir / "vectors.index"
     index = None
     if vectors_index_path.exists():
+        residency = resident_fraction(vectors_index_path)
         try:
-            index = faiss.read_index(str(vectors_index_path))
+            with Timer() as timer:
+                index = read_index(vectors_index_path, mmap=mmap)
+            mode = "mmap" if mmap else "read"
+            logger.info(f"{domain} vectors.index {mode} in {timer.elapsed_ms():,.2f} ms ({describe_residency(residency)})")
         except Exception as e:
             logger.exception("Warning: Could not load existing index")
     else:
         logger.info(f"No vectors.index: {vectors_index_path}")
 
-    chunks_json_path = domain_dir / "chunks.json"
     chunks_by_file: dict[str, list[Chunk]] = {}
+    files_by_path = {}
 
-    if chunks_json_path.exists():
+    from index.chunk_store import has_chunk_store, load_chunk_store
+    if has_chunk_store(data_dir):
         try:
-            chunks_by_file = load_chunks_by_file(chunks_json_path)
+            with Timer() as timer:
+                chunks_by_file, files_by_path = load_chunk_store(data_dir)
+            logger.info(f"{domain} chunk store loaded in {timer.elapsed_ms():,.2f} ms")
         except Exception as e:
-            logger.exception(f"Warning: Could not load existing chunks: {e}")
+            logger.exception(f"Warning: Could not load chunk store: {e}")
     else:
-        logger.info(f"No chunks.json: {chunks_json_path}")
+        # * legacy json (until the indexer's next run, or `python -m index.chunk_store .rag`, migrates it)
+        chunks_json_path = data_dir / "chunks.json"
+        if chunks_json_path.exists():
+            try:
+                chunks_by_file = load_chunks_by_file(chunks_json_path)
+            except Exception as e:
+                logger.exception(f"Warning: Could not load existing chunks: {e}")
+        else:
+            logger.info(f"No chunk store or chunks.json: {data_dir}")
+
+        files_json_path = data_dir / "files.json"
+        if files_json_path.exists():
+            try:
+                files_by_path = load_file_stats_by_file(files_json_path)
+            except Exception as e:
+                logger.exception(f"Warning: Could not load file stats {e}")
+        else:
+            logger.info(f"No files.json: {files_json_path}")
 
-    files_json_path = domain_dir / "files.json"
-    files_by_path = {}
-    if files_json_path.exists():
-        try:
-            files_by_path = load_file_stats_by_file(files_json_path)
-        except Exception as e:
-            logger.exception(f"Warning: Could not load file stats {e}")
-    else:
-        logger.info(f"No files.json: {files_json_path}")
+    exact_vectors = ExactVectors.load(data_dir) if index is not None else None
+
+    dataset = RAGDataset(domain, chunks_by_file, files_by_path, index, exact_vectors, index_is_mmapped=mmap and index is not None)
+    dataset.generation = generation
 
-    dataset = RAGDataset(domain, chunks_by_file, files_by_path, index)
+    # * LS updates since the indexer last wrote this domain
+    from index.update_journal import replay_journal
+    try:
+        dataset.journal_bytes_replayed = replay_journal(dataset, domain_dir)
+    except Exception as e:
+        logger.exception(f"Warning: Could not replay journal: {e}")
 
     num_chunks = dataset.num_chunks()
     log_num_vectors = dataset.num_vectors()
-    logger.info(f"Loaded {domain} - {dataset.num_files()} file stats, {log_num_vectors} FAISS vectors, {num_chunks} chunks")
+    logger.info(f"Loaded {domain} generation {generation} - {dataset.num_files()} file stats, {log_num_vectors} FAISS vectors, {num_chunks} chunks")
+    if index is not None:
+        log_memory_footprint(dataset, vectors_index_path)
     if num_chunks != (log_num_vectors or 0):
         logger.error(f"Num chunks ({num_chunks}) != Num vectors ({log_num_vectors}) which suggests problems with FAISS index vectors or otherwise, use rag_validate_index to check")
 
     return dataset
 
 
+def log_memory_footprint(dataset: RAGDataset, vectors_index_path: Path):
+    # FYI index file size ~= index memory, w/ mmap it's page cache shared across processes (vs private to this one)
+    index_bytes = vectors_index_path.stat().st_size
+    per_vector = f", {index_bytes / dataset.index.ntotal:.0f} B/vector" if dataset.index.ntotal else ""
+    shared = " (mmapped)" if dataset.index_is_mmapped else ""
+    message = f"{dataset.domain} memory: {describe_index(dataset.index)}{shared} index {humanize.naturalsize(index_bytes, binary=True)}{per_vector}"
+    if dataset.exact_vectors is not None:
+        # memmapped => resident only as rescoring touches it
+        message += f", exact vectors {humanize.naturalsize(dataset.exact_vectors.nbytes, binary=True)} on disk (memmapped)"
+    message += f", chunk lookup {humanize.naturalsize(dataset.chunk_lookup.nbytes, binary=True)}"
+    logger.info(message)
+
+
 def get_domain_dirs(dot_rag_dir: Path) -> list[Path]:
     dot_rag_dir = Path(dot_rag_dir)
     if not dot_rag_dir.exists():
@@ -349,12 +854,14 @@ def get_domain_dirs(dot_rag_dir: Path) -> list[Path]:
     return [p for p in Path(dot_rag_dir).glob("*") if p.is_dir()]
 
 
-def load_all_domains(dot_rag_dir: Path) -> Datasets:
+def load_all_domains(dot_rag_dir: Path, mmap: bool = True) -> Datasets:
     """Load all indexed domains from disk (.rag/ dir)
 
     Directory names under .rag/ are now semantic domains
     - not file extensions, nor filetypes/vim_filetypes
     - i.e. "yaml/" contains both .yaml and .yml files
+
+    mmap by default b/c this is the LS/MCP startup path, see load_domain
     """
     dot_rag_dir = Path(dot_rag_dir)
     domain_dirs = get_domain_dirs(dot_rag_dir)
@@ -362,13 +869,28 @@ def load_all_domains(dot_rag_dir: Path) -> Datasets:
     total_chunks = 0
     total_vectors = 0
     total_files = 0
-    for dir in sorted(domain_dirs):
-        domain = dir.name
-        dataset = load_domain(dot_rag_dir, domain)
-        datasets[domain] = dataset
-        total_chunks += dataset.num_chunks()
-        total_vectors += dataset.num_vectors()
-        total_files += dataset.num_files()
-
-    logger.info(f"Loaded all datasets - {total_files} total files, {total_vectors} total FAISS vectors, {total_chunks} total chunks")
-    return Datasets(datasets)
+    with Timer() as timer:
+        for dir in sorted(domain_dirs):
+            domain = dir.name
+            dataset = load_domain(dot_rag_dir, domain, mmap=mmap)
+            datasets[domain] = dataset
+            total_chunks += dataset.num_chunks()
+            total_vectors += dataset.num_vectors()
+            total_files += dataset.num_files()
+
+    logger.info(f"Loaded all datasets in {timer.elapsed_ms():,.2f} ms - {total_files} total files, {total_vectors} total FAISS vectors, {total_chunks} total chunks")
+    return Datasets(datasets, vector_cache=VectorCache.for_dot_rag_dir(dot_rag_dir), dot_rag_dir=dot_rag_dir, mmap=mmap)
+
+
+def lazy_load_all_domains(dot_rag_dir: Path, mmap: bool = True) -> Datasets:
+    """ like load_all_domains, but each domain loads on first search/update (most sessions only touch a domain or two) """
+    dot_rag_dir = Path(dot_rag_dir)
+    domains = {dir.name for dir in get_domain_dirs(dot_rag_dir)}
+    logger.info(f"Found {len(domains)} domains (load on first use): {sorted(domains)}")
+    return Datasets(
+        {},
+        vector_cache=VectorCache.for_dot_rag_dir(dot_rag_dir),
+        dot_rag_dir=dot_rag_dir,
+        unloaded_domains=domains,
+        mmap=mmap,
+    )
@@ -0,0 +1,204 @@
+import asyncio
+import threading
+import time
+
+import faiss
+import numpy as np
+import pytest
+
+from config.vector_index import VectorIndexConfig
+from index import storage, workspace
+from index.storage import ChunkLookup, lazy_load_all_domains
+from index.testing import FakeVectorCache, chunk_for, write_domain
+from index.vector_index import build_index
+
+
+@pytest.fixture
+def dot_rag_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(workspace.project, "folder", tmp_path)
+    dot_rag_dir = tmp_path / ".rag"
+    write_domain(dot_rag_dir, "lua", str(tmp_path / "foo.lua"))
+    write_domain(dot_rag_dir, "python", str(tmp_path / "foo.py"))
+    write_domain(dot_rag_dir, "markdown", str(tmp_path / "foo.md"))
+    return dot_rag_dir
+
+
+@pytest.fixture
+def load_calls(monkeypatch):
+    calls = []
+    load_domain = storage.load_domain
+
+    def counting_load_domain(dot_rag_dir, domain, mmap=False):
+        calls.append(domain)
+        return load_domain(dot_rag_dir, domain, mmap)
+
+    monkeypatch.setattr(storage, "load_domain", counting_load_domain)
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_domains_load_on_first_use(dot_rag_dir, load_calls):
+    datasets = lazy_load_all_domains(dot_rag_dir)
+    assert datasets.domains() == ["lua", "markdown", "python"]
+    assert datasets.all_datasets == {}
+
+    lua = await datasets.load_for_file(dot_rag_dir.parent / "bar.lua")
+
+    assert lua is not None and lua.index.ntotal == 1
+    assert load_calls == ["lua"]
+    assert datasets.for_file(dot_rag_dir.parent / "bar.lua") is lua
+    assert datasets.get_chunk_by_faiss_id(lua.chunks_by_file[str(dot_rag_dir.parent / "foo.lua")][0].faiss_id) is not None
+
+    # * already loaded => no reload
+    assert await datasets.load("lua") is lua
+    assert load_calls == ["lua"]
+    assert await datasets.load("rust") is None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_loads_share_one_load(dot_rag_dir, load_calls):
+    datasets = lazy_load_all_domains(dot_rag_dir)
+
+    datasets.prefetch("python")
+    first, second, loaded = await asyncio.gather(
+        datasets.load("lua"),
+        datasets.load("lua"),
+        datasets.load_many(["lua", "python", "markdown"]),
+    )
+
+    assert first is second is loaded["lua"]
+    assert sorted(load_calls) == ["lua", "markdown", "python"]
+    assert sorted(loaded) == ["lua", "markdown", "python"]
+    assert datasets.unloaded_domains == set()
+
+
+@pytest.mark.asyncio
+async def test_on_domain_loaded_runs_per_domain(dot_rag_dir):
+    datasets = lazy_load_all_domains(dot_rag_dir)
+    loaded = []
+    datasets.on_domain_loaded = lambda dataset: loaded.append(dataset.domain)
+
+    datasets.prefetch_for_file(dot_rag_dir.parent / "new.md")
+    await datasets.load_many(["markdown"])
+
+    assert loaded == ["markdown"]
+
+
+def test_chunk_lookup_resolves_result_sets():
+    chunks_by_file = {
+        "/repo/a.lua": [chunk_for("a1", "/repo/a.lua"), chunk_for("a2", "/repo/a.lua")],
+        "/repo/b.lua": [chunk_for("b1", "/repo/b.lua")],
+    }
+    lookup = ChunkLookup.from_chunks_by_file(chunks_by_file)
+    a1, a2 = chunks_by_file["/repo/a.lua"]
+    b1 = chunks_by_file["/repo/b.lua"][0]
+
+    # FYI faiss pads w/ -1 when there are fewer than k results
+    assert lookup.get_many(np.array([b1.faiss_id, -1, a1.faiss_id, a2.faiss_id + 1])) == [b1, None, a1, None]
+    assert lookup.get(a2.faiss_id) is a2
+    assert ChunkLookup.from_chunks_by_file({}).get_many([a1.faiss_id]) == [None]
+
+
+def test_chunk_lookup_updates():
+    a1 = chunk_for("a1", "/repo/a.lua")
+    dataset = storage.RAGDataset("lua", {"/repo/a.lua": [a1]}, {}, None)
+    edited = chunk_for("a1 edited", "/repo/a.lua")
+
+    dataset.set_file_chunks("/repo/a.lua", [a1.faiss_id], [edited])
+
+    assert dataset.get_chunks_by_faiss_ids([a1.faiss_id, edited.faiss_id]) == [None, edited]
+    assert dataset.chunk_lookup.num_updates == 2
+
+
+def test_chunk_lookup_compacts(monkeypatch):
+    monkeypatch.setattr(storage, "COMPACT_MIN_UPDATES", 2)
+    a1 = chunk_for("a1", "/repo/a.lua")
+    dataset = storage.RAGDataset("lua", {"/repo/a.lua": [a1]}, {}, None)
+    edited = chunk_for("a1 edited", "/repo/a.lua")
+
+    dataset.set_file_chunks("/repo/a.lua", [a1.faiss_id], [edited])
+
+    # i.e. rebuilt from chunks_by_file
+    assert dataset.chunk_lookup.num_updates == 0
+    assert len(dataset.chunk_lookup) == 1
+    assert dataset.get_chunks_by_faiss_ids([a1.faiss_id, edited.faiss_id]) == [None, edited]
+
+
+@pytest.mark.asyncio
+async def test_searches_on_threads_during_updates():
+    # i.e. semantic_grep searches on worker threads while LS updates run on the event loop
+    vecs = np.random.default_rng(0).standard_normal((200, 8)).astype(np.float32)
+    faiss.normalize_L2(vecs)
+    chunks = [chunk_for(f"chunk {i}", "/repo/a.lua") for i in range(200)]
+    ids = np.array([c.faiss_id for c in chunks], dtype=np.int64)
+    dataset = storage.RAGDataset("lua", {"/repo/a.lua": chunks}, {}, build_index(vecs, ids, VectorIndexConfig()))
+
+    searches = [asyncio.to_thread(dataset.search, vecs[i:i + 1], 10) for i in range(50)]
+    for i in range(20):
+        edited = chunk_for(f"edit {i}", "/repo/a.lua")
+        prior_ids = [c.faiss_id for c in dataset.chunks_by_file["/repo/a.lua"]]
+        new_chunks = dataset.chunks_by_file["/repo/a.lua"][1:] + [edited]
+        dataset.apply_file_update("/repo/a.lua", prior_ids, new_chunks, new_chunks, np.concatenate([vecs[1:], vecs[:1]]))
+        await asyncio.sleep(0)
+
+    for scores, _ in await asyncio.gather(*searches):
+        assert np.all(scores[0][:-1] >= scores[0][1:])
+    assert dataset.index.ntotal == 200
+
+
+def hold_lock_on_thread(lock, seconds: float) -> threading.Thread:
+    """ i.e. a long GLOBAL search on a worker thread """
+    acquired = threading.Event()
+
+    def hold():
+        with lock:
+            acquired.set()
+            time.sleep(seconds)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    acquired.wait()
+    return thread
+
+
+async def max_event_loop_stall_ms(awaitable) -> float:
+    stalls = []
+
+    async def tick():
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            stalls.append((time.perf_counter() - start) * 1000)
+
+    ticker = asyncio.create_task(tick())
+    await asyncio.sleep(0.005)  # ticking before the awaitable starts
+    try:
+        await awaitable
+        await asyncio.sleep(0.005)  # ticker records the last stall
+    finally:
+        ticker.cancel()
+    return max(stalls, default=0)
+
+
+@pytest.mark.asyncio
+async def test_update_waits_on_search_without_blocking_event_loop(monkeypatch, tmp_path):
+
+    monkeypatch.setattr(workspace.project, "folder", tmp_path)
+    file = str(tmp_path / "a.lua")
+    before = chunk_for("before", file)
+    vecs = np.random.default_rng(0).standard_normal((1, 8)).astype(np.float32)
+    dataset = storage.RAGDataset("lua", {file: [before]}, {}, build_index(vecs, np.array([before.faiss_id], dtype=np.int64), VectorIndexConfig()))
+    datasets = storage.Datasets({"lua": dataset}, vector_cache=FakeVectorCache())  # type: ignore
+    global_index = await datasets.sync_global_index()
+    assert global_index is not None
+
+    for lock in [dataset._index_lock, global_index._lock]:
+        search = hold_lock_on_thread(lock, 0.3)
+        edited = chunk_for(f"edited while {lock} held", file)
+
+        assert await max_event_loop_stall_ms(datasets.update_file(file, [edited])) < 100
+        search.join()
+        assert dataset.chunks_by_file[file] == [edited]
+
+    _, ids = global_index.search(vecs, 5, ["lua"])
+    assert [id for id in ids[0].tolist() if id != -1] == [edited.faiss_id]
@@ -0,0 +1,61 @@
+""" helpers shared by *_tests.py (test modules don't import each other) """
+import hashlib
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+from config.vector_index import VectorIndexConfig
+from index.pydants import write_json
+from index.storage import Chunk, ChunkType, chunk_id_to_faiss_id
+from index.vector_index import build_index, write_index
+
+
+def chunk_for(text: str, file: str) -> Chunk:
+    # FYI sha256, not hash() => same ids regardless of PYTHONHASHSEED
+    chunk_id = hashlib.sha256(text.encode()).hexdigest()[:16]
+    return Chunk(
+        id=chunk_id,
+        id_int=str(chunk_id_to_faiss_id(chunk_id)),
+        text=text,
+        file=file,
+        start_line0=0,
+        start_column0=0,
+        end_line0=0,
+        end_column0=None,
+        type=ChunkType.LINES,
+        file_hash="hash",
+    )
+
+
+def random_vectors(num_vectors: int, dimensions: int = 32, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    vecs = np.random.default_rng(seed).standard_normal((num_vectors, dimensions)).astype(np.float32)
+    faiss.normalize_L2(vecs)
+    ids = np.arange(num_vectors, dtype=np.int64) * 7 + 3  # not sequential, like chunk ids
+    return vecs, ids
+
+
+def write_domain(dot_rag_dir: Path, domain: str, file: str) -> Chunk:
+    """ one chunk domain, legacy (chunks.json) layout """
+    chunk = chunk_for(f"{domain} chunk", file)
+    vecs = np.random.default_rng(0).standard_normal((1, 8)).astype(np.float32)
+    faiss.normalize_L2(vecs)
+    domain_dir = dot_rag_dir / domain
+    domain_dir.mkdir(parents=True)
+    write_index(build_index(vecs, np.array([chunk.faiss_id], dtype=np.int64), VectorIndexConfig()), domain_dir / "vectors.index")
+    write_json({file: [chunk]}, domain_dir / "chunks.json")
+    write_json({}, domain_dir / "files.json")
+    return chunk
+
+
+class FakeVectorCache:
+    """ stands in for VectorCache => no inference server needed, records what was encoded """
+
+    def __init__(self):
+        self.encoded: list[str] = []
+
+    async def encode_passages(self, passages: list[str], dimensions: int) -> np.ndarray:
+        self.encoded.extend(passages)
+        vecs = np.random.default_rng(len(self.encoded)).standard_normal((len(passages), dimensions)).astype(np.float32)
+        faiss.normalize_L2(vecs)
+        return vecs
@@ -0,0 +1,162 @@
+import asyncio
+import base64
+import os
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from pydantic import BaseModel
+
+from logs import get_logger
+from index.storage import Chunk, FileStat, RAGDataset
+
+logger = get_logger(__name__)
+
+# * append-only journal of LS updates (file saves), one json line per file update
+#   LS appends in the background (write-behind), load_domain replays it, indexer compacts it (see compact_journal)
+#   => vectors the editor already paid for survive an LS restart and the indexer doesn't re-embed those files
+JOURNAL_FILE = "journal.jsonl"
+
+# batch saves that land close together into one write
+FLUSH_DELAY_SEC = 1.0
+
+
+class JournalEntry(BaseModel):
+    file: str
+    # None => LS couldn't stat the file, indexer re-chunks it
+    stat: Optional[FileStat]
+    chunks: list[Chunk]
+    # vectors added to the index by this update (not every chunk, i.e. HNSW keeps unchanged vectors)
+    ids: list[int]
+    # float32, len(ids) x dimensions, base64
+    vectors: str
+    dimensions: int
+
+    @staticmethod
+    def create(file: str, stat: Optional[FileStat], chunks: list[Chunk], ids: np.ndarray, vecs: np.ndarray, dimensions: int) -> "JournalEntry":
+        # FYI explicit dimensions => no vectors (i.e. file saved empty, HNSW revived tombstones) still reshapes
+        vecs = np.ascontiguousarray(vecs, dtype=np.float32).reshape(len(ids), dimensions)
+        return JournalEntry(
+            file=file,
+            stat=stat,
+            chunks=chunks,
+            ids=[int(id) for id in ids],
+            vectors=base64.b64encode(vecs.tobytes()).decode("ascii"),
+            dimensions=dimensions,
+        )
+
+    def vectors_by_id(self) -> dict[int, np.ndarray]:
+        vecs = np.frombuffer(base64.b64decode(self.vectors), dtype=np.float32).reshape(len(self.ids), self.dimensions)
+        return dict(zip(self.ids, vecs))
+
+
+def read_journal(domain_dir: Path) -> tuple[list[JournalEntry], int]:
+    """ returns (entries, bytes read), stops at a partial last line (i.e. LS mid write) """
+    journal_path = domain_dir / JOURNAL_FILE
+    if not journal_path.exists():
+        return [], 0
+
+    entries: list[JournalEntry] = []
+    num_bytes = 0
+    with open(journal_path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                logger.warning(f"{journal_path} ends w/ a partial entry, ignoring it")
+                break
+            try:
+                entries.append(JournalEntry.model_validate_json(line))
+            except Exception as e:
+                # i.e. torn write w/ entries appended after it, skip it so it's compacted away
+                logger.error(f"{journal_path} has a corrupt entry at byte {num_bytes}, skipping it: {e}")
+            num_bytes += len(line)
+    return entries, num_bytes
+
+
+def replay_journal(dataset: RAGDataset, domain_dir: Path) -> int:
+    """ apply LS updates on top of what the indexer last wrote, returns bytes replayed (see compact_journal) """
+    entries, num_bytes = read_journal(domain_dir)
+    if not entries:
+        return 0
+    if dataset.index is None:
+        logger.warning(f"{dataset.domain} has no index, ignoring {len(entries)} journal entries")
+        return 0
+
+    with logger.timer(f"Replay {len(entries)} journal entries for {dataset.domain}"):
+        # FYI a later entry can re-add vectors an earlier entry added (i.e. flat indexes remove then add all of a file's chunks)
+        vectors_by_id: dict[int, np.ndarray] = {}
+        for entry in entries:
+            vectors_by_id.update(entry.vectors_by_id())
+            planned = dataset.plan_file_update(entry.file, entry.chunks)
+            if planned is None:
+                dataset.set_file_stat(entry.file, entry.stat)
+                continue
+            prior_faiss_ids, chunks_to_add = planned
+            missing = [c.faiss_id for c in chunks_to_add if c.faiss_id not in vectors_by_id]
+            if missing:
+                # i.e. entry was journaled against an older index, drop the stat => indexer re-embeds the file
+                logger.warning(f"journal entry for {entry.file} is missing {len(missing)} vectors, skipping it")
+                dataset.set_file_stat(entry.file, None)
+                continue
+            vecs = np.array([vectors_by_id[c.faiss_id] for c in chunks_to_add], dtype=np.float32).reshape(len(chunks_to_add), dataset.index.d)
+            dataset.apply_file_update(entry.file, prior_faiss_ids, entry.chunks, chunks_to_add, vecs, entry.stat)
+    return num_bytes
+
+
+def compact_journal(domain_dir: Path, num_bytes_replayed: int):
+    """ after the indexer writes everything it replayed, drop those entries (keep any the LS appended since) """
+    journal_path = domain_dir / JOURNAL_FILE
+    if not journal_path.exists():
+        return
+    with open(journal_path, "rb") as f:
+        f.seek(num_bytes_replayed)
+        tail = f.read()
+    if not tail:
+        journal_path.unlink()
+        return
+    # FYI an LS append racing this replace can be lost => its file's mtime is newer than the stat the indexer wrote, next run re-embeds it
+    tmp_path = journal_path.with_name(journal_path.name + ".tmp")
+    tmp_path.write_bytes(tail)
+    os.replace(tmp_path, journal_path)
+
+
+class UpdateJournal:
+    """ LS side, buffers entries and appends them on a background thread (off the request path) """
+
+    def __init__(self, domain_dir: Path, flush_delay_sec: float = FLUSH_DELAY_SEC):
+        self.journal_path = domain_dir / JOURNAL_FILE
+        self.flush_delay_sec = flush_delay_sec
+        self._pending: list[bytes] = []
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def append(self, entry: JournalEntry):
+        self._pending.append(entry.model_dump_json().encode("utf-8") + b"\n")
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_delay_sec)
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception(f"Failed to write {self.journal_path}")
+
+    async def flush(self):
+        lines, self._pending = self._pending, []
+        if lines:
+            await asyncio.to_thread(self._write, lines)
+
+    def flush_now(self):
+        """ i.e. on shutdown """
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        lines, self._pending = self._pending, []
+        if lines:
+            self._write(lines)
+
+    def _write(self, lines: list[bytes]):
+        # one write per flush => entries are whole lines unless the process dies mid write (read_journal skips a partial line)
+        with open(self.journal_path, "ab") as f:
+            f.write(b"".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+        logger.debug(f"Journaled {len(lines)} updates to {self.journal_path}")
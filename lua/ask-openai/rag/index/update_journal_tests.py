@@ -0,0 +1,111 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from config.vector_index import KIND_FLAT, KIND_HNSW, VectorIndexConfig
+from index import workspace
+from index.chunk_store import write_chunk_store
+from index.storage import Chunk, Datasets, FileStat, load_domain
+from index.testing import FakeVectorCache, chunk_for, random_vectors
+from index.update_journal import JOURNAL_FILE, compact_journal, read_journal
+from index.vector_index import build_index, get_vectors_and_ids, write_index
+
+
+def write_domain(dot_rag_dir: Path, file: str, chunks: list[Chunk], kind: str) -> Path:
+    domain_dir = dot_rag_dir / "lua"
+    domain_dir.mkdir(parents=True)
+    vecs, _ = random_vectors(len(chunks))
+    ids = np.array([c.faiss_id for c in chunks], dtype=np.int64)
+    write_index(build_index(vecs, ids, VectorIndexConfig(kind=kind)), domain_dir / "vectors.index")
+    write_chunk_store(domain_dir, {file: chunks}, {file: FileStat(mtime=1.0, size=1, hash="hash", path=file)})
+    return domain_dir
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("kind", [KIND_FLAT, KIND_HNSW])
+async def test_ls_updates_survive_reload(monkeypatch, tmp_path, kind):
+    monkeypatch.setattr(workspace.project, "folder", tmp_path)
+    file = str(tmp_path / "foo.lua")
+    kept, edited = chunk_for("kept", file), chunk_for("before edit", file)
+    domain_dir = write_domain(tmp_path, file, [kept, edited], kind)
+
+    datasets = Datasets({"lua": load_domain(tmp_path, "lua")}, vector_cache=FakeVectorCache(), dot_rag_dir=tmp_path, journal_updates=True)  # type: ignore
+    after_edit = chunk_for("after edit", file)
+    stat = FileStat(mtime=2.0, size=2, hash="new hash", path=file)
+    await datasets.update_file(file, [kept, after_edit], stat)
+    live_vecs, live_ids = get_vectors_and_ids(datasets.all_datasets["lua"].index)
+    datasets.flush_journals()
+
+    reloaded = load_domain(tmp_path, "lua")
+
+    assert reloaded.journal_bytes_replayed == (domain_dir / JOURNAL_FILE).stat().st_size
+    assert reloaded.chunks_by_file[file] == [kept, after_edit]
+    assert reloaded.stat_by_path[file] == stat
+    assert reloaded.get_chunks_by_faiss_ids([edited.faiss_id, after_edit.faiss_id]) == [None, after_edit]
+    vecs, ids = get_vectors_and_ids(reloaded.index)
+    np.testing.assert_array_equal(vecs[np.argsort(ids)], live_vecs[np.argsort(live_ids)])
+    if kind == KIND_HNSW:
+        assert reloaded.tombstoned_ids == {edited.faiss_id}
+
+
+def test_partial_last_entry_is_ignored(tmp_path):
+    file = str(tmp_path / "foo.lua")
+    domain_dir = write_domain(tmp_path, file, [chunk_for("kept", file)], KIND_FLAT)
+    (domain_dir / JOURNAL_FILE).write_bytes(b'{"file": "torn')
+
+    entries, num_bytes = read_journal(domain_dir)
+
+    assert entries == [] and num_bytes == 0
+    assert load_domain(tmp_path, "lua").journal_bytes_replayed == 0
+
+
+def test_compact_keeps_entries_appended_after_replay(tmp_path):
+    journal_path = tmp_path / JOURNAL_FILE
+    journal_path.write_bytes(b"replayed\nappended since\n")
+
+    compact_journal(tmp_path, len(b"replayed\n"))
+    assert journal_path.read_bytes() == b"appended since\n"
+
+    compact_journal(tmp_path, len(b"appended since\n"))
+    assert not journal_path.exists()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("kind", [KIND_FLAT, KIND_HNSW])
+async def test_file_saved_empty_survives_reload(monkeypatch, tmp_path, kind):
+    monkeypatch.setattr(workspace.project, "folder", tmp_path)
+    file = str(tmp_path / "foo.lua")
+    chunk = chunk_for("deleted", file)
+    write_domain(tmp_path, file, [chunk], kind)
+    datasets = Datasets({"lua": load_domain(tmp_path, "lua")}, vector_cache=FakeVectorCache(), dot_rag_dir=tmp_path, journal_updates=True)  # type: ignore
+
+    await datasets.update_file(file, [])
+    datasets.flush_journals()
+
+    entries, _ = read_journal(tmp_path / "lua")
+    assert len(entries) == 1 and entries[0].ids == []
+    reloaded = load_domain(tmp_path, "lua")
+    assert reloaded.chunks_by_file[file] == []
+    assert reloaded.get_chunks_by_faiss_ids([chunk.faiss_id]) == [None]
+
+
+@pytest.mark.asyncio
+async def test_hnsw_revive_only_update_survives_reload(monkeypatch, tmp_path):
+    monkeypatch.setattr(workspace.project, "folder", tmp_path)
+    file = str(tmp_path / "foo.lua")
+    kept, edited = chunk_for("kept", file), chunk_for("before edit", file)
+    write_domain(tmp_path, file, [kept, edited], KIND_HNSW)
+    datasets = Datasets({"lua": load_domain(tmp_path, "lua")}, vector_cache=FakeVectorCache(), dot_rag_dir=tmp_path, journal_updates=True)  # type: ignore
+
+    after_edit = chunk_for("after edit", file)
+    await datasets.update_file(file, [kept, after_edit])
+    # * undo => edited is still in the index (tombstoned), no vectors added
+    await datasets.update_file(file, [kept, edited])
+    datasets.flush_journals()
+
+    entries, _ = read_journal(tmp_path / "lua")
+    assert [len(entry.ids) for entry in entries] == [1, 0]
+    reloaded = load_domain(tmp_path, "lua")
+    assert reloaded.chunks_by_file[file] == [kept, edited]
+    assert reloaded.tombstoned_ids == {after_edit.faiss_id}
@@ -12,7 +12,7 @@ from collections import Counter
 from pathlib import Path
 from typing import Set
 from logs import get_logger, logging_fwk_to_console
-from index.storage import Datasets
+from index.storage import Datasets, RAGDataset
 from chunks.chunker import get_file_stat
 from index import workspace
 
@@ -30,53 +30,56 @@ class DatasetsValidator:
 
     def validate_datasets(self):
         for dataset in self.datasets.all_datasets.values():
-            any_problem_with_this_dataset = False
-
-            # * compare # vectors to # IDs
-            num_vectors_based_on_ntotal = dataset.index_view.num_vectors()
-            ids = dataset.index_view.ids
-            if len(ids) != num_vectors_based_on_ntotal:
-                logger.error(f"{len(ids)=} != {num_vectors_based_on_ntotal=}")
-                any_problem_with_this_dataset = True
-
-            # * test for duplicate IDs
-            duplicate_ids = list(dataset.index_view._check_for_duplicate_ids())
-            for id, count in duplicate_ids:
-                if count <= 1:
-                    continue
-                any_problem_with_this_dataset = True
-                chunk = self.datasets.get_chunk_by_faiss_id(id)
-                if chunk is None:
-                    logger.error(f"Duplicate ID found: {id} - {count}x - missing chunk too")
-                else:
-                    logger.error(f"Duplicate ID found: {id} with {count}x - {chunk.file} L{chunk.base0.start_line}-{chunk.base0.end_line}")
-
-            # * compare chunk counts vs ID counts
-            num_unique_ids_based_on_ids = len(duplicate_ids)
-            num_chunks_based_on_chunks = sum([len(file) for file in dataset.chunks_by_file.values()])
-
-            if num_unique_ids_based_on_ids != num_chunks_based_on_chunks:
-                any_problem_with_this_dataset = True
-                logger.error(f"chunk count mismatch: {num_unique_ids_based_on_ids=} != {num_chunks_based_on_chunks=}")
-
-            num_vectors_based_on_ids = sum([count for _, count in duplicate_ids])
-            if num_vectors_based_on_ntotal != num_vectors_based_on_ids:
-                any_problem_with_this_dataset = True
-                logger.error(f"vectors count mismatch: {num_vectors_based_on_ntotal=} != {num_vectors_based_on_ids=}")
-
-            if any_problem_with_this_dataset:
-                logger.info(f"{num_vectors_based_on_ntotal=}")
-
-                # look for mismatch in datasets (i.e. missing chunks or vectors for old chunks)
-                logger.info(f'{num_vectors_based_on_ids=} {num_unique_ids_based_on_ids=}')
-                logger.info(f'{num_chunks_based_on_chunks=}')
-
-            self.any_problems = self.any_problems or any_problem_with_this_dataset
+            self.validate_dataset(dataset)
 
         if self.any_problems:
             logger.error("[bold red]AT LEAST ONE PROBLEM DISCOVERED")
         else:
-            logger.info("[bold green]ALL CHECKS PASS!")
+            logger.info(f"[bold green]ALL CHECKS PASS! ({len(self.datasets.all_datasets)} loaded domains)")
+
+    def validate_dataset(self, dataset: RAGDataset):
+        any_problem_with_this_dataset = False
+
+        # * compare # vectors to # IDs
+        num_vectors_based_on_ntotal = dataset.index_view.num_vectors()
+        ids = dataset.index_view.ids
+        if len(ids) != num_vectors_based_on_ntotal:
+            logger.error(f"{len(ids)=} != {num_vectors_based_on_ntotal=}")
+            any_problem_with_this_dataset = True
+
+        # * test for duplicate IDs
+        duplicate_ids = list(dataset.index_view._check_for_duplicate_ids())
+        for id, count in duplicate_ids:
+            if count <= 1:
+                continue
+            any_problem_with_this_dataset = True
+            chunk = self.datasets.get_chunk_by_faiss_id(id)
+            if chunk is None:
+                logger.error(f"Duplicate ID found: {id} - {count}x - missing chunk too")
+            else:
+                logger.error(f"Duplicate ID found: {id} with {count}x - {chunk.file} L{chunk.base0.start_line}-{chunk.base0.end_line}")
+
+        # * compare chunk counts vs ID counts
+        num_unique_ids_based_on_ids = len(duplicate_ids)
+        num_chunks_based_on_chunks = sum([len(file) for file in dataset.chunks_by_file.values()])
+
+        if num_unique_ids_based_on_ids != num_chunks_based_on_chunks:
+            any_problem_with_this_dataset = True
+            logger.error(f"chunk count mismatch: {num_unique_ids_based_on_ids=} != {num_chunks_based_on_chunks=}")
+
+        num_vectors_based_on_ids = sum([count for _, count in duplicate_ids])
+        if num_vectors_based_on_ntotal != num_vectors_based_on_ids:
+            any_problem_with_this_dataset = True
+            logger.error(f"vectors count mismatch: {num_vectors_based_on_ntotal=} != {num_vectors_based_on_ids=}")
+
+        if any_problem_with_this_dataset:
+            logger.info(f"{num_vectors_based_on_ntotal=}")
+
+            # look for mismatch in datasets (i.e. missing chunks or vectors for old chunks)
+            logger.info(f'{num_vectors_based_on_ids=} {num_unique_ids_based_on_ids=}')
+            logger.info(f'{num_chunks_based_on_chunks=}')
+
+        self.any_problems = self.any_problems or any_problem_with_this_dataset
 
     def warn_about_unindexed_domains(self, datasets: Datasets) -> None:
         """Warn about semantic domains with many files that aren't indexed."""
@@ -96,7 +99,7 @@ class DatasetsValidator:
 
         EXTENSION_COUNT_THRESHOLD = 10
         frequent_domains = {domain for domain, count in domain_counts.items() if count > EXTENSION_COUNT_THRESHOLD}
-        indexed_domains = set(datasets.all_datasets.keys())
+        indexed_domains = set(datasets.domains())
         missing_domains = frequent_domains - indexed_domains
 
         if missing_domains:
@@ -109,7 +112,7 @@ class DatasetsValidator:
     def compare_config_vs_indexed_domains(self, datasets: Datasets, config: workspace.RagConfig) -> None:
         """Compare configured semantic domains against what's actually indexed on disk."""
 
-        present_domains = set(datasets.all_datasets.keys())
+        present_domains = set(datasets.domains())
         configured_domains = set(config.allowed_semantic_domains)
 
         # worth pointing out when there are legit domains that are not configured to be indexed... very likely a mistake
@@ -164,7 +167,7 @@ async def main():
     dot_rag_dir = Path(args.dot_rag_path)
     workspace_folder = dot_rag_dir.parent
     await workspace.from_folder(workspace_folder)
-    workspace.load_datasets()
+    workspace.load_datasets(lazy=False)
 
     # explicit calls to validate b/c that's what this module does! don't use this via workspace.validate_datasets()
     validator = DatasetsValidator(workspace.datasets)
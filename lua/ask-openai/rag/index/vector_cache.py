@@ -0,0 +1,145 @@
+import hashlib
+import sqlite3
+import time
+from pathlib import Path
+
+import numpy as np
+
+from logs import get_logger
+from inference.client.embedder import EMBEDDING_MODEL_ID, encode_passages
+
+logger = get_logger(__name__)
+
+# FYI lives next to domain dirs in .rag/ => MUST be a file (not a dir) else it looks like a (vestigial) domain
+VECTOR_CACHE_FILE_NAME = "vector_cache.sqlite"
+
+# sqlite default SQLITE_MAX_VARIABLE_NUMBER is 999 (older builds), stay well under it
+_MAX_KEYS_PER_SELECT = 500
+
+# rows past this (all models/dimensions) are pruned, least recently used first
+#  FYI 1024 dims => ~4KB/row => ~800MB at the cap, well above the chunk count of the repos I index
+MAX_CACHED_VECTORS = 200_000
+
+
+def text_hash_for(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class VectorCache:
+    """ content-addressed embeddings, keyed by (model, dimensions, sha256(text))
+
+    chunk ids include the whole file's hash, so a one line edit changes every chunk id in the file
+    BUT most chunk texts are verbatim the same => look them up here before asking the inference server to re-encode them
+    shared by indexer + language server (sqlite handles locking across processes)
+    """
+
+    def __init__(self, db_path: Path, model_id: str = EMBEDDING_MODEL_ID, max_rows: int = MAX_CACHED_VECTORS):
+        self.db_path = Path(db_path)
+        self.model_id = model_id
+        self.max_rows = max_rows
+        self.hits = 0
+        self.misses = 0
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path, timeout=30)
+        # WAL => readers (LS) don't block on the writer (indexer) and vice versa
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS vectors (
+                model TEXT NOT NULL,
+                dimensions INTEGER NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (model, dimensions, text_hash)
+            )
+        """)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(vectors)")}
+        if "last_used" not in columns:
+            # cache created before pruning => existing rows are least recently used
+            self.conn.execute("ALTER TABLE vectors ADD COLUMN last_used REAL NOT NULL DEFAULT 0")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS vectors_last_used ON vectors (last_used)")
+        self.conn.commit()
+
+    @staticmethod
+    def for_dot_rag_dir(dot_rag_dir: Path) -> "VectorCache":
+        return VectorCache(Path(dot_rag_dir) / VECTOR_CACHE_FILE_NAME)
+
+    def close(self):
+        self.conn.close()
+
+    def get_many(self, texts: list[str], dimensions: int) -> list[np.ndarray | None]:
+        """ returns one entry per text, None => cache miss """
+        hashes = [text_hash_for(t) for t in texts]
+
+        vector_by_hash: dict[str, np.ndarray] = {}
+        unique_hashes = list(set(hashes))
+        for start in range(0, len(unique_hashes), _MAX_KEYS_PER_SELECT):
+            batch = unique_hashes[start:start + _MAX_KEYS_PER_SELECT]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.conn.execute(
+                f"SELECT text_hash, vector FROM vectors WHERE model = ? AND dimensions = ? AND text_hash IN ({placeholders})",
+                [self.model_id, dimensions, *batch],
+            )
+            for text_hash, blob in rows:
+                vector_by_hash[text_hash] = np.frombuffer(blob, dtype=np.float32)
+
+        self._touch(list(vector_by_hash), dimensions)
+        return [vector_by_hash.get(h) for h in hashes]
+
+    def _touch(self, hit_hashes: list[str], dimensions: int):
+        """ hits => most recently used => pruned last """
+        if not hit_hashes:
+            return
+        now = time.time()
+        for start in range(0, len(hit_hashes), _MAX_KEYS_PER_SELECT):
+            batch = hit_hashes[start:start + _MAX_KEYS_PER_SELECT]
+            placeholders = ",".join("?" * len(batch))
+            self.conn.execute(
+                f"UPDATE vectors SET last_used = ? WHERE model = ? AND dimensions = ? AND text_hash IN ({placeholders})",
+                [now, self.model_id, dimensions, *batch],
+            )
+        self.conn.commit()
+
+    def put_many(self, texts: list[str], vecs: np.ndarray):
+        vecs = np.ascontiguousarray(vecs, dtype=np.float32)
+        dimensions = vecs.shape[1]
+        now = time.time()
+        rows = [(self.model_id, dimensions, text_hash_for(text), vec.tobytes(), now) for text, vec in zip(texts, vecs)]
+        self.conn.executemany("INSERT OR REPLACE INTO vectors (model, dimensions, text_hash, vector, last_used) VALUES (?, ?, ?, ?, ?)", rows)
+        self._prune()
+        self.conn.commit()
+
+    def _prune(self):
+        num_rows = self.conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+        if num_rows <= self.max_rows:
+            return
+        # FYI rowid => any model/dimensions, least recently used first
+        self.conn.execute(
+            "DELETE FROM vectors WHERE rowid IN (SELECT rowid FROM vectors ORDER BY last_used LIMIT ?)",
+            [num_rows - self.max_rows],
+        )
+        logger.info(f"vector cache: pruned {num_rows - self.max_rows} least recently used vectors")
+
+    async def encode_passages(self, passages: list[str], dimensions: int) -> np.ndarray:
+        """ drop-in for embedder.encode_passages => only cache misses are sent to the inference server """
+        cached = self.get_many(passages, dimensions)
+        miss_indexes = [i for i, vec in enumerate(cached) if vec is None]
+
+        num_hits = len(passages) - len(miss_indexes)
+        self.hits += num_hits
+        self.misses += len(miss_indexes)
+        logger.info(f"vector cache: {num_hits} hits, {len(miss_indexes)} misses (lifetime: {self.hits} hits, {self.misses} misses)")
+
+        vecs_np = np.empty((len(passages), dimensions), dtype=np.float32)
+        for i, vec in enumerate(cached):
+            if vec is not None:
+                vecs_np[i] = vec
+
+        if miss_indexes:
+            miss_passages = [passages[i] for i in miss_indexes]
+            miss_vecs = await encode_passages(miss_passages)
+            self.put_many(miss_passages, miss_vecs)
+            vecs_np[miss_indexes] = miss_vecs
+
+        return vecs_np
@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+from index import vector_cache
+from index.vector_cache import VectorCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = VectorCache.for_dot_rag_dir(tmp_path / ".rag")
+    yield cache
+    cache.close()
+
+
+def fake_vecs(texts: list[str], dimensions: int = 4) -> np.ndarray:
+    # deterministic per text, so hits and misses can be compared to what an encode would return
+    return np.array([[len(t) + i for i in range(dimensions)] for t in texts], dtype=np.float32)
+
+
+def test_get_many_misses_when_empty(cache):
+    assert cache.get_many(["foo", "bar"], dimensions=4) == [None, None]
+
+
+def test_put_then_get_round_trips_vectors(cache):
+    cache.put_many(["foo", "barbaz"], fake_vecs(["foo", "barbaz"]))
+
+    foo, barbaz, missing = cache.get_many(["foo", "barbaz", "missing"], dimensions=4)
+
+    np.testing.assert_array_equal(foo, fake_vecs(["foo"])[0])
+    np.testing.assert_array_equal(barbaz, fake_vecs(["barbaz"])[0])
+    assert missing is None
+
+
+def test_dimensions_and_model_are_part_of_key(cache, tmp_path):
+    cache.put_many(["foo"], fake_vecs(["foo"], dimensions=4))
+
+    assert cache.get_many(["foo"], dimensions=8) == [None]
+
+    other_model = VectorCache(cache.db_path, model_id="other/model")
+    assert other_model.get_many(["foo"], dimensions=4) == [None]
+    other_model.close()
+
+
+def test_persists_across_instances(cache):
+    cache.put_many(["foo"], fake_vecs(["foo"]))
+
+    reopened = VectorCache(cache.db_path)
+    assert reopened.get_many(["foo"], dimensions=4)[0] is not None
+    reopened.close()
+
+
+@pytest.mark.asyncio
+async def test_encode_passages_only_encodes_misses(cache, monkeypatch):
+    encoded_batches: list[list[str]] = []
+
+    async def fake_encode_passages(passages: list[str]) -> np.ndarray:
+        encoded_batches.append(passages)
+        return fake_vecs(passages)
+
+    monkeypatch.setattr(vector_cache, "encode_passages", fake_encode_passages)
+
+    cache.put_many(["unchanged"], fake_vecs(["unchanged"]))
+
+    passages = ["edited", "unchanged", "also new"]
+    vecs = await cache.encode_passages(passages, dimensions=4)
+
+    assert encoded_batches == [["edited", "also new"]]
+    np.testing.assert_array_equal(vecs, fake_vecs(passages))
+    assert cache.hits == 1
+    assert cache.misses == 2
+
+    # * second time, everything is cached
+    vecs = await cache.encode_passages(passages, dimensions=4)
+    assert len(encoded_batches) == 1
+    np.testing.assert_array_equal(vecs, fake_vecs(passages))
+
+
+def test_prunes_least_recently_used_past_max_rows(tmp_path, monkeypatch):
+    clock = iter(range(1, 100))
+    monkeypatch.setattr(vector_cache.time, "time", lambda: next(clock))
+    cache = VectorCache(tmp_path / "vectors.sqlite", max_rows=2)
+    cache.put_many(["a"], fake_vecs(["a"]))
+    cache.put_many(["bb"], fake_vecs(["bb"]))
+    assert cache.get_many(["a"], dimensions=4)[0] is not None  # a is now most recent
+
+    cache.put_many(["ccc"], fake_vecs(["ccc"]))
+
+    a, bb, ccc = cache.get_many(["a", "bb", "ccc"], dimensions=4)
+    assert bb is None
+    assert a is not None and ccc is not None
+    cache.close()
+
+
+def test_adds_last_used_to_cache_created_before_pruning(tmp_path, monkeypatch):
+    import sqlite3
+    clock = iter(range(1, 100))
+    monkeypatch.setattr(vector_cache.time, "time", lambda: next(clock))
+    db_path = tmp_path / "vectors.sqlite"
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE vectors (model TEXT NOT NULL, dimensions INTEGER NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, PRIMARY KEY (model, dimensions, text_hash))")
+    conn.execute("INSERT INTO vectors VALUES (?, ?, ?, ?)", [vector_cache.EMBEDDING_MODEL_ID, 4, vector_cache.text_hash_for("old"), fake_vecs(["old"]).tobytes()])
+    conn.commit()
+    conn.close()
+
+    cache = VectorCache(db_path, max_rows=1)
+    np.testing.assert_array_equal(cache.get_many(["old"], dimensions=4)[0], fake_vecs(["old"])[0])
+
+    cache.put_many(["new"], fake_vecs(["new"]))
+    # old was touched by get_many, but before new was put
+    assert cache.get_many(["old", "new"], dimensions=4)[0] is None
+    cache.close()
@@ -0,0 +1,259 @@
+import math
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+from config.vector_index import (
+    ENCODING_FLAT,
+    ENCODING_FP16,
+    ENCODING_PQ,
+    ENCODING_SQ8,
+    KIND_FLAT,
+    KIND_HNSW,
+    KIND_IVF,
+    VectorIndexConfig,
+)
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+# FYI index layouts per kind:
+#   flat => IndexIDMap(IndexFlatIP)
+#   hnsw => IndexIDMap(IndexHNSWFlat)  ... HNSW cannot remove_ids
+#   ivf  => IndexIVFFlat (NOT wrapped in IndexIDMap, IVF stores ids itself and IDMap's remove_ids corrupts the id mapping for IVF)
+# w/ encoding, Flat storage above is swapped for SQ8/SQfp16/PQ (i.e. IndexIDMap(IndexScalarQuantizer), IndexIVFPQ)
+
+# k-means wants >= 39 training points per list (faiss warns below that)
+IVF_MIN_POINTS_PER_LIST = 39
+# more training points than this per list => slower training, no real gain
+IVF_MAX_TRAINING_POINTS_PER_LIST = 256
+# retrain when the ideal nlist (for current size) is this many times the trained nlist
+#   i.e. lists are ~4x overfull => each probe scans 4x the vectors it was sized for
+IVF_RETRAIN_GROWTH = 2.0
+
+
+def read_index(path: Path, mmap: bool = False) -> faiss.Index:
+    """ mmap => vectors (codes) stay in the page cache, shared by every process that maps the file (LS, MCP server, each editor)
+
+    FYI mmapped indexes are READ ONLY, faiss aborts the process on add/remove => materialize_index first
+    """
+    # IO_FLAG_MMAP_IFC maps flat codes (IDMap/HNSW storage) and IVF lists, IO_FLAG_MMAP is for OnDiskInvertedLists only
+    return faiss.read_index(str(path), faiss.IO_FLAG_MMAP_IFC if mmap else 0)
+
+
+def materialize_index(index: faiss.Index) -> faiss.Index:
+    """ in memory copy of an mmapped index (clone_index keeps the mapping) """
+    return faiss.deserialize_index(faiss.serialize_index(index))
+
+
+def write_index(index: faiss.Index, path: Path):
+    # replace, never overwrite in place => processes that mmapped the old file keep a valid mapping (else SIGBUS)
+    tmp_path = path.with_name(path.name + ".tmp")
+    faiss.write_index(index, str(tmp_path))
+    os.replace(tmp_path, path)
+
+
+def new_flat_index(dimensions: int) -> faiss.Index:
+    return faiss.IndexIDMap(faiss.IndexFlatIP(dimensions))
+
+
+def _inner(index: faiss.Index) -> faiss.Index:
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def index_kind(index: faiss.Index) -> str:
+    inner = _inner(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        return KIND_HNSW
+    if isinstance(inner, faiss.IndexIVF):
+        return KIND_IVF
+    return KIND_FLAT
+
+
+def index_encoding(index: faiss.Index) -> str:
+    inner = _inner(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner = faiss.downcast_index(inner.storage)
+    if isinstance(inner, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return ENCODING_FP16 if inner.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else ENCODING_SQ8
+    if isinstance(inner, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return ENCODING_PQ
+    return ENCODING_FLAT
+
+
+def is_lossy_index(index: faiss.Index) -> bool:
+    """ lossy => can't read back the float32 vectors """
+    return index_encoding(index) != ENCODING_FLAT
+
+
+def describe_index(index: faiss.Index) -> str:
+    return f"{index_kind(index)}/{index_encoding(index)}"
+
+
+def supports_remove_ids(index: faiss.Index) -> bool:
+    return index_kind(index) != KIND_HNSW
+
+
+def get_ids(index: faiss.Index) -> np.ndarray:
+    """ ids in storage order (matches get_vectors_and_ids) """
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.vector_to_array(index.id_map)
+
+    ivf = faiss.extract_index_ivf(index)
+    invlists = ivf.invlists
+    ids = [
+        faiss.rev_swig_ptr(invlists.get_ids(list_no), invlists.list_size(list_no)).copy()
+        for list_no in range(ivf.nlist)
+        if invlists.list_size(list_no) > 0
+    ]
+    return np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+
+
+def get_vectors_and_ids(index: faiss.Index) -> tuple[np.ndarray, np.ndarray]:
+    """ all stored vectors w/ their ids, exact for flat storage (Flat, HNSWFlat, IVFFlat), lossy otherwise (use ExactVectors) """
+    ids = get_ids(index)
+    if isinstance(index, faiss.IndexIDMap):
+        # IDMap => sequential internal ids, aligned w/ id_map
+        return _inner(index).reconstruct_n(0, index.ntotal), ids
+
+    ivf = faiss.extract_index_ivf(index)
+    if isinstance(ivf, faiss.IndexIVFFlat):
+        # codes ARE the float32 vectors
+        invlists = ivf.invlists
+        vecs = [
+            faiss.rev_swig_ptr(invlists.get_codes(list_no), invlists.list_size(list_no) * invlists.code_size).copy().view(np.float32)
+            for list_no in range(ivf.nlist)
+            if invlists.list_size(list_no) > 0
+        ]
+        if not vecs:
+            return np.empty((0, index.d), dtype=np.float32), ids
+        return np.concatenate(vecs).reshape(-1, index.d), ids
+
+    # quantized codes => lossy decode
+    ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+    return index.reconstruct_batch(ids), ids
+
+
+def to_flat_index(index: faiss.Index) -> faiss.Index:
+    if index_kind(index) == KIND_FLAT and isinstance(index, faiss.IndexIDMap):
+        return index
+    vecs, ids = get_vectors_and_ids(index)
+    flat = new_flat_index(index.d)
+    flat.add_with_ids(vecs, ids)
+    return flat
+
+
+def ivf_nlist_for(config: VectorIndexConfig, num_vectors: int) -> int:
+    if config.ivf_nlist is not None:
+        return config.ivf_nlist
+    ideal = round(4 * math.sqrt(num_vectors))
+    return max(1, min(ideal, num_vectors // IVF_MIN_POINTS_PER_LIST))
+
+
+def ivf_needs_retrain(index: faiss.Index, config: VectorIndexConfig) -> bool:
+    trained_nlist = faiss.extract_index_ivf(index).nlist
+    return ivf_nlist_for(config, index.ntotal) >= IVF_RETRAIN_GROWTH * trained_nlist
+
+
+def needs_rebuild(index: faiss.Index, config: VectorIndexConfig) -> bool:
+    """ does index match the kind/encoding config wants for its current size? """
+    current = index_kind(index)
+    wanted = config.resolve_kind(index.ntotal)
+    if current != wanted:
+        return True
+    if index_encoding(index) != config.resolve_encoding(index.ntotal):
+        return True
+    if current == KIND_IVF:
+        return ivf_needs_retrain(index, config)
+    return False
+
+
+def _storage_factory(encoding: str, config: VectorIndexConfig, dimensions: int) -> str:
+    if encoding == ENCODING_PQ and dimensions % config.pq_m != 0:
+        raise ValueError(f"pq_m={config.pq_m} must divide {dimensions=}")
+    return {
+        ENCODING_FLAT: "Flat",
+        ENCODING_FP16: "SQfp16",
+        ENCODING_SQ8: "SQ8",
+        ENCODING_PQ: f"PQ{config.pq_m}",
+    }[encoding]
+
+
+def build_index(vecs: np.ndarray, ids: np.ndarray, config: VectorIndexConfig) -> faiss.Index:
+    dimensions = vecs.shape[1]
+    kind = config.resolve_kind(len(vecs))
+    storage = _storage_factory(config.resolve_encoding(len(vecs)), config, dimensions)
+
+    if kind == KIND_FLAT:
+        index = faiss.index_factory(dimensions, f"IDMap,{storage}", faiss.METRIC_INNER_PRODUCT)
+
+    elif kind == KIND_HNSW:
+        index = faiss.index_factory(dimensions, f"IDMap,HNSW{config.hnsw_m},{storage}", faiss.METRIC_INNER_PRODUCT)
+        hnsw = faiss.downcast_index(index.index)
+        hnsw.hnsw.efConstruction = config.hnsw_ef_construction
+        hnsw.hnsw.efSearch = config.hnsw_ef_search  # FYI persisted w/ the index
+
+    elif kind == KIND_IVF:
+        nlist = ivf_nlist_for(config, len(vecs))
+        index = faiss.index_factory(dimensions, f"IVF{nlist},{storage}", faiss.METRIC_INNER_PRODUCT)
+        index.nprobe = min(config.ivf_nprobe, nlist)  # FYI persisted w/ the index
+
+    else:
+        raise ValueError(f"unsupported vector index {kind=}")
+
+    if not index.is_trained:
+        # IVF centroids and/or SQ8 ranges/PQ codebooks
+        num_training = len(vecs)
+        if kind == KIND_IVF:
+            num_training = min(num_training, ivf_nlist_for(config, len(vecs)) * IVF_MAX_TRAINING_POINTS_PER_LIST)
+        training = vecs[np.random.default_rng(0).choice(len(vecs), num_training, replace=False)]
+        with logger.timer(f"Train {describe_index(index)} on {num_training} vectors"):
+            index.train(training)
+
+    index.add_with_ids(vecs, ids)
+    return index
+
+
+@dataclass
+class RecallReport:
+    k: int
+    num_queries: int
+    recall: float
+    exact_ms_per_query: float
+    approx_ms_per_query: float
+
+    def __str__(self) -> str:
+        speedup = self.exact_ms_per_query / self.approx_ms_per_query if self.approx_ms_per_query else float("inf")
+        return (f"recall@{self.k}={self.recall:.3f} over {self.num_queries} queries, "
+                f"latency {self.approx_ms_per_query:.3f} ms vs flat {self.exact_ms_per_query:.3f} ms ({speedup:.1f}x)")
+
+
+def measure_recall(index: faiss.Index, vecs: np.ndarray, ids: np.ndarray, k: int = 10, num_queries: int = 200) -> RecallReport:
+    """ recall@k + latency of index vs exact (flat) search, using a sample of stored vectors as queries """
+    num_queries = min(num_queries, len(vecs))
+    k = min(k, len(vecs))
+    queries = vecs[np.random.default_rng(1).choice(len(vecs), num_queries, replace=False)]
+
+    start = time.perf_counter()
+    _, exact_positions = faiss.knn(queries, vecs, k, metric=faiss.METRIC_INNER_PRODUCT)
+    exact_ms = (time.perf_counter() - start) * 1000
+    exact_ids = ids[exact_positions]
+
+    start = time.perf_counter()
+    _, approx_ids = index.search(queries, k)
+    approx_ms = (time.perf_counter() - start) * 1000
+
+    hits = sum(len(set(exact).intersection(approx)) for exact, approx in zip(exact_ids, approx_ids))
+    return RecallReport(
+        k=k,
+        num_queries=num_queries,
+        recall=hits / (num_queries * k),
+        exact_ms_per_query=exact_ms / num_queries,
+        approx_ms_per_query=approx_ms / num_queries,
+    )
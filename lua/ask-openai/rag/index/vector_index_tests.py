@@ -0,0 +1,183 @@
+import faiss
+import numpy as np
+import pytest
+
+from config.vector_index import ENCODING_FLAT, ENCODING_FP16, ENCODING_PQ, ENCODING_SQ8, KIND_FLAT, KIND_HNSW, KIND_IVF, VectorIndexConfig
+from index import workspace
+from index.testing import FakeVectorCache, chunk_for, random_vectors
+from index.storage import Datasets, RAGDataset, load_domain
+from index.vector_index import (
+    build_index,
+    get_vectors_and_ids,
+    index_encoding,
+    index_kind,
+    ivf_nlist_for,
+    measure_recall,
+    needs_rebuild,
+    read_index,
+    supports_remove_ids,
+    to_flat_index,
+    write_index,
+)
+
+
+@pytest.mark.parametrize("kind", [KIND_FLAT, KIND_HNSW, KIND_IVF])
+def test_build_round_trips_vectors_and_ids(kind):
+    vecs, ids = random_vectors(2000)
+
+    index = build_index(vecs, ids, VectorIndexConfig(kind=kind))
+
+    assert index_kind(index) == kind
+    stored_vecs, stored_ids = get_vectors_and_ids(index)
+    order = np.argsort(stored_ids)
+    np.testing.assert_array_equal(stored_ids[order], ids)
+    np.testing.assert_array_equal(stored_vecs[order], vecs)
+
+
+def test_ivf_remove_ids_keeps_ids_correct():
+    vecs, ids = random_vectors(2000)
+    index = build_index(vecs, ids, VectorIndexConfig(kind=KIND_IVF, ivf_nprobe=1000))
+
+    index.remove_ids(faiss.IDSelectorArray(ids[:10]))
+
+    _, found = index.search(vecs[10:12], 1)
+    assert found[:, 0].tolist() == ids[10:12].tolist()
+    assert supports_remove_ids(index)
+
+
+def test_hnsw_is_converted_to_flat_for_updates():
+    vecs, ids = random_vectors(500)
+    hnsw = build_index(vecs, ids, VectorIndexConfig(kind=KIND_HNSW))
+    assert not supports_remove_ids(hnsw)
+
+    flat = to_flat_index(hnsw)
+
+    assert index_kind(flat) == KIND_FLAT
+    assert flat.ntotal == 500
+
+
+def test_needs_rebuild_when_domain_outgrows_flat_or_ivf_lists():
+    config = VectorIndexConfig(flat_max_vectors=1000)
+    small_vecs, small_ids = random_vectors(1000)
+    flat = build_index(small_vecs, small_ids, config)
+    assert not needs_rebuild(flat, config)
+
+    vecs, ids = random_vectors(3000, seed=1)
+    flat.add_with_ids(vecs, ids + 1)
+    assert needs_rebuild(flat, config)
+
+    ivf = build_index(*get_vectors_and_ids(flat), config)
+    assert index_kind(ivf) == KIND_IVF
+    assert not needs_rebuild(ivf, config)
+
+    # * grow past list sizing => retrain
+    trained_nlist = faiss.extract_index_ivf(ivf).nlist
+    more_vecs, more_ids = random_vectors(20000, seed=2)
+    ivf.add_with_ids(more_vecs, more_ids + 2)
+    assert ivf_nlist_for(config, ivf.ntotal) >= 2 * trained_nlist
+    assert needs_rebuild(ivf, config)
+
+
+def test_measure_recall_vs_flat():
+    vecs, ids = random_vectors(2000)
+
+    exact = measure_recall(build_index(vecs, ids, VectorIndexConfig(kind=KIND_FLAT)), vecs, ids, k=10, num_queries=50)
+    approx = measure_recall(build_index(vecs, ids, VectorIndexConfig(kind=KIND_IVF, ivf_nprobe=1)), vecs, ids, k=10, num_queries=50)
+
+    assert exact.recall == 1.0
+    assert 0 < approx.recall < 1.0
+    assert "recall@10" in str(approx)
+
+
+
+@pytest.mark.parametrize("kind", [KIND_FLAT, KIND_HNSW, KIND_IVF])
+@pytest.mark.parametrize("encoding", [ENCODING_FP16, ENCODING_SQ8])
+def test_build_scalar_quantized(kind, encoding):
+    vecs, ids = random_vectors(2000)
+
+    index = build_index(vecs, ids, VectorIndexConfig(kind=kind, encoding=encoding, ivf_nprobe=1000))
+
+    assert (index_kind(index), index_encoding(index)) == (kind, encoding)
+    _, found = index.search(vecs[:5], 1)
+    assert found[:, 0].tolist() == ids[:5].tolist()
+    stored_vecs, stored_ids = get_vectors_and_ids(index)
+    order = np.argsort(stored_ids)
+    np.testing.assert_allclose(stored_vecs[order], vecs, atol=0.02)  # lossy
+
+
+def test_product_quantized_needs_pq_m_to_divide_dimensions():
+    # FYI not building PQ here, training codebooks is slow (~20s on one core)
+    vecs, ids = random_vectors(256 * 39)
+
+    with pytest.raises(ValueError, match="pq_m"):
+        build_index(vecs, ids, VectorIndexConfig(encoding=ENCODING_PQ, pq_m=5))
+
+
+def test_needs_rebuild_when_encoding_changes():
+    vecs, ids = random_vectors(500)
+    flat = build_index(vecs, ids, VectorIndexConfig())
+    sq8 = VectorIndexConfig(encoding=ENCODING_SQ8)
+
+    assert index_encoding(flat) == ENCODING_FLAT
+    assert needs_rebuild(flat, sq8)
+    assert not needs_rebuild(build_index(vecs, ids, sq8), sq8)
+    # * pq w/ too few vectors => stays flat
+    assert not needs_rebuild(flat, VectorIndexConfig(encoding=ENCODING_PQ))
+
+@pytest.mark.asyncio
+async def test_update_file_tombstones_vectors_in_hnsw(monkeypatch, tmp_path):
+    file = str(tmp_path / "foo.lua")
+    kept, edited = chunk_for("kept", file), chunk_for("before edit", file)
+    vecs, _ = random_vectors(2)
+    index = build_index(vecs, np.array([kept.faiss_id, edited.faiss_id], dtype=np.int64), VectorIndexConfig(kind=KIND_HNSW))
+    dataset = RAGDataset("lua", {file: [kept, edited]}, {}, index)
+    cache = FakeVectorCache()
+    datasets = Datasets({"lua": dataset}, vector_cache=cache)  # type: ignore
+    monkeypatch.setattr(workspace.project, "folder", tmp_path)
+
+    after_edit = chunk_for("after edit", file)
+    await datasets.update_file(file, [kept, after_edit])
+
+    assert cache.encoded == ["after edit"]  # kept is already in the index
+    assert index.ntotal == 3
+    assert dataset.tombstoned_ids == {edited.faiss_id}
+    assert datasets.get_chunk_by_faiss_id(edited.faiss_id) is None
+
+    # * undo edit => revived, no new vector
+    await datasets.update_file(file, [kept, edited])
+    assert index.ntotal == 3
+    assert dataset.tombstoned_ids == {after_edit.faiss_id}
+    assert datasets.get_chunk_by_faiss_id(edited.faiss_id) == edited
+
+
+@pytest.mark.parametrize("kind", [KIND_FLAT, KIND_HNSW, KIND_IVF])
+def test_mmapped_index_searches_like_read_index(tmp_path, kind):
+    vecs, ids = random_vectors(2000)
+    path = tmp_path / "vectors.index"
+    write_index(build_index(vecs, ids, VectorIndexConfig(kind=kind, ivf_nprobe=1000)), path)
+
+    mmapped = read_index(path, mmap=True)
+
+    _, found = mmapped.search(vecs[:3], 1)
+    assert found[:, 0].tolist() == ids[:3].tolist()
+    assert index_kind(mmapped) == kind
+
+
+@pytest.mark.asyncio
+async def test_update_file_copies_mmapped_index_into_memory(monkeypatch, tmp_path):
+    file = str(tmp_path / "foo.lua")
+    before = chunk_for("before edit", file)
+    vecs, _ = random_vectors(1)
+    (tmp_path / "lua").mkdir()
+    write_index(build_index(vecs, np.array([before.faiss_id], dtype=np.int64), VectorIndexConfig()), tmp_path / "lua" / "vectors.index")
+    dataset = load_domain(tmp_path, "lua", mmap=True)
+    dataset.chunks_by_file = {file: [before]}
+    datasets = Datasets({"lua": dataset}, vector_cache=FakeVectorCache())  # type: ignore
+    monkeypatch.setattr(workspace.project, "folder", tmp_path)
+    assert dataset.index_is_mmapped
+
+    # FYI w/o the copy, faiss aborts the process (can't resize a mmapped vector)
+    await datasets.update_file(file, [chunk_for("after edit", file)])
+
+    assert not dataset.index_is_mmapped
+    assert dataset.index.ntotal == 1
@@ -7,7 +7,7 @@ from typing import Optional
 
 from logs import get_logger
 from config import RagConfig, load_config
-from index.storage import Datasets, load_all_domains
+from index.storage import Datasets, lazy_load_all_domains, load_all_domains
 
 logger = get_logger(__name__)
 
@@ -85,9 +85,13 @@ async def from_folder(folder: str | Path):
 
     await load_rag_config(project.folder)
 
-def load_datasets():
+def load_datasets(lazy: bool = True):
+    """ lazy => domains load on first search/update (or prefetch) """
     global datasets
-    datasets = load_all_domains(project.dot_rag_dir)
+    if lazy:
+        datasets = lazy_load_all_domains(project.dot_rag_dir)
+    else:
+        datasets = load_all_domains(project.dot_rag_dir)
 
 async def load_rag_config(root_path: Path) -> RagConfig:
     rag_yaml = root_path / ".rag.yaml"
@@ -124,3 +128,5 @@ def validate_datasets():
 
     validator = DatasetsValidator(datasets)
     validator.validate_datasets()
+    # lazy => validate the rest as they load
+    datasets.on_domain_loaded = validator.validate_dataset
@@ -1,7 +1,7 @@
 import aiofiles
 import asyncio
 from logs import get_logger
-from inference.client.embedder import get_shape, encode_passages, signal_hotpath_done_in_background
+from inference.client.embedder import get_shape, signal_hotpath_done_in_background
 
 logger = get_logger(__name__)
 
@@ -11,7 +11,9 @@ import argparse
 import logging
 import subprocess
 import sys
+import time
 import yaml
+from collections import deque
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Optional, Set
@@ -19,10 +21,29 @@ from typing import Optional, Set
 import faiss
 import numpy as np
 
-from index.pydants import write_json
-
-from index.storage import Chunk, FileStat, load_domain
-from chunks.chunker import RAGChunkerOptions, build_chunks_from_file, get_file_stat
+from index.storage import Chunk, FileStat, RAGDataset, load_domain
+from index.vector_cache import VECTOR_CACHE_FILE_NAME, VectorCache
+from index.exact_vectors import ExactVectors
+from index.chunk_store import migrate_domain, write_chunk_store
+from index.update_journal import compact_journal
+from index.generations import new_generation_dir, publish_generation
+from config.vector_index import KIND_FLAT
+from index.vector_index import (
+    build_index,
+    describe_index,
+    get_ids,
+    get_vectors_and_ids,
+    index_kind,
+    is_lossy_index,
+    measure_recall,
+    needs_rebuild,
+    new_flat_index,
+    supports_remove_ids,
+    to_flat_index,
+    write_index,
+)
+from chunks.chunker import RAGChunkerOptions
+from chunks.pool import ChunkerPool, stat_and_chunk_file
 from config import RagConfig, load_config
 from index.ignores import is_file_ignored_allchecks
 from config.domains import (
@@ -54,6 +75,7 @@ class ProgramArgs:
     dry_run: bool = False
     level: int = 0
     domain: str | None = None
+    workers: int | None = None  # chunker processes, None => os.cpu_count()
 
     def limited_to_one_domain(self) -> bool:
         return self.domain is not None
@@ -67,6 +89,131 @@ class ProgramArgs:
         return default_allowed_domains
 
 
+@dataclass
+class EncodedBatch:
+    chunks: list[Chunk]
+    vecs: np.ndarray
+
+
+class EmbeddingPipeline:
+    """ producer/consumer stages so chunking, encoding and FAISS inserts overlap
+
+    chunk producer => (bounded queue of chunked files) => encoder (N batches in flight) => (queue of vectors) => FAISS sink
+    before this, all changed files were chunked first and only then encoded => inference server idled while chunking and vice versa
+    """
+
+    def __init__(
+        self,
+        chunker_pool: ChunkerPool,
+        vector_cache: VectorCache,
+        options: RAGChunkerOptions,
+        encode_batch_size: int = 64,
+        max_encodes_in_flight: int = 2,
+        max_queued_files: int = 64,
+    ):
+        self.chunker_pool = chunker_pool
+        self.vector_cache = vector_cache
+        self.options = options
+        # FYI encode_batch_size is passages per encode_passages call, the client further splits those into server side batches
+        self.encode_batch_size = encode_batch_size
+        self.max_encodes_in_flight = max_encodes_in_flight
+        self.max_queued_files = max_queued_files
+
+    async def run(self, index: faiss.Index, changed_paths: Set[Path]) -> tuple[dict[str, FileStat], dict[str, list[Chunk]]]:
+        """ adds vectors for all chunks of changed_paths to index, returns the stats and chunks for those files """
+        stat_by_path: dict[str, FileStat] = {}
+        chunks_by_file: dict[str, list[Chunk]] = {}
+
+        chunked_files: asyncio.Queue[list[Chunk] | None] = asyncio.Queue(maxsize=self.max_queued_files)
+        encoded_batches: asyncio.Queue[asyncio.Task[EncodedBatch] | None] = asyncio.Queue(maxsize=self.max_encodes_in_flight)
+        self.start_ns = time.time_ns()
+
+        async with asyncio.TaskGroup() as tg:
+            # FYI if any stage fails, TaskGroup cancels the others and re-raises
+            tg.create_task(self._produce_chunks(changed_paths, stat_by_path, chunks_by_file, chunked_files))
+            tg.create_task(self._encode_chunks(index.d, chunked_files, encoded_batches))
+            tg.create_task(self._add_to_index(index, encoded_batches))
+
+        return stat_by_path, chunks_by_file
+
+    async def _produce_chunks(self, changed_paths, stat_by_path, chunks_by_file, chunked_files: asyncio.Queue):
+        # sorted + emit in submission order => same FAISS insert order as serial chunking
+        sorted_paths = sorted(changed_paths, key=str)
+        use_pool = self.chunker_pool.should_use_pool(len(sorted_paths))
+
+        def chunk_one(path: Path):
+            if use_pool:
+                return asyncio.ensure_future(self.chunker_pool.stat_and_chunk(path, self.options))
+            # one at a time on a thread => frees event loop to talk to the inference server while chunking
+            #  (one at a time b/c parsers are cached per process, not per thread)
+            return asyncio.ensure_future(asyncio.to_thread(stat_and_chunk_file, path, self.options))
+
+        async def emit(path: Path, pending_file: asyncio.Future):
+            stat, chunks = await pending_file
+            stat_by_path[str(path)] = stat
+            chunks_by_file[str(path)] = chunks
+            if chunks:
+                await chunked_files.put(chunks)
+
+        window = self.chunker_pool.max_workers * 2 if use_pool else 1
+        pending: deque[tuple[Path, asyncio.Future]] = deque()
+        try:
+            for path in sorted_paths:
+                pending.append((path, chunk_one(path)))
+                if len(pending) >= window:
+                    await emit(*pending.popleft())
+            while pending:
+                await emit(*pending.popleft())
+        finally:
+            for _, pending_file in pending:
+                pending_file.cancel()
+
+        await chunked_files.put(None)
+
+    async def _encode_chunks(self, dimensions: int, chunked_files: asyncio.Queue, encoded_batches: asyncio.Queue):
+        in_flight = asyncio.Semaphore(self.max_encodes_in_flight)
+
+        async def encode(batch: list[Chunk]) -> EncodedBatch:
+            try:
+                vecs = await self.vector_cache.encode_passages([c.text for c in batch], dimensions)
+                return EncodedBatch(batch, vecs)
+            finally:
+                in_flight.release()
+
+        async with asyncio.TaskGroup() as encodes:
+
+            async def start_encode(batch: list[Chunk]):
+                await in_flight.acquire()  # backpressure => stop pulling chunks when N batches are already in flight
+                # FYI queue the task (not its result) in submission order => sink awaits them FIFO => FAISS insert order is path order even when a later batch finishes first
+                await encoded_batches.put(encodes.create_task(encode(batch)))
+
+            batch: list[Chunk] = []
+            while (chunks := await chunked_files.get()) is not None:
+                batch.extend(chunks)
+                while len(batch) >= self.encode_batch_size:
+                    await start_encode(batch[:self.encode_batch_size])
+                    batch = batch[self.encode_batch_size:]
+            if batch:
+                await start_encode(batch)
+
+        await encoded_batches.put(None)
+
+    async def _add_to_index(self, index: faiss.Index, encoded_batches: asyncio.Queue):
+        num_vectors = 0
+        while (pending_batch := await encoded_batches.get()) is not None:
+            encoded = await pending_batch
+            if num_vectors == 0:
+                elapsed_ms = (time.time_ns() - self.start_ns) / 1_000_000
+                logger.info(f"Time to first embedding batch: {elapsed_ms:,.2f} ms")
+
+            faiss_ids_np = np.array([c.faiss_id for c in encoded.chunks], dtype="int64")
+            logger.pp_debug("new_faiss_ids", faiss_ids_np.tolist())
+            index.add_with_ids(encoded.vecs, faiss_ids_np)
+            num_vectors += len(encoded.chunks)
+
+        logger.info(f"Added {num_vectors} vectors")
+
+
 def trash_dir(directory):
     directory = Path(directory)
     if not directory.exists():
@@ -74,6 +221,18 @@ def trash_dir(directory):
     subprocess.run(["trash", directory], check=IGNORE_FAILURE)
 
 
+def trash_index(dot_rag_dir):
+    """ --rebuild => trash everything in .rag BUT the vector cache, else the rebuild re-encodes every (unchanged) chunk """
+    dot_rag_dir = Path(dot_rag_dir)
+    if not dot_rag_dir.exists():
+        return
+    for path in sorted(dot_rag_dir.iterdir()):
+        # FYI prefix => sqlite's -wal/-shm files too
+        if path.name.startswith(VECTOR_CACHE_FILE_NAME):
+            continue
+        trash_dir(path)
+
+
 class IncrementalRAGIndexer:
 
     def __init__(
@@ -86,6 +245,8 @@ class IncrementalRAGIndexer:
         self.source_code_dir = workspace.project.folder
         self.program_args = program_args or ProgramArgs()
         self.config = workspace.get_config()
+        self.vector_cache = VectorCache.for_dot_rag_dir(self.dot_rag_dir)
+        self.chunker_pool = ChunkerPool(self.program_args.workers)
 
     async def main(self):
         if not self.config.enabled:
@@ -96,11 +257,14 @@ class IncrementalRAGIndexer:
 
         files_by_domain = find_files_by_semantic_domain(self.source_code_dir)
 
-        for domain in sorted(allowed_domains):
-            files = files_by_domain.get(domain, set())
-            if not any(files):
-                continue
-            await self.build_index(domain, files)
+        try:
+            for domain in sorted(allowed_domains):
+                files = files_by_domain.get(domain, set())
+                if not any(files):
+                    continue
+                await self.build_index(domain, files)
+        finally:
+            self.chunker_pool.shutdown()
 
         # Only flag/trash when doing a full reindex (no --domain override)
         if not self.program_args.limited_to_one_domain():
@@ -184,25 +348,25 @@ class IncrementalRAGIndexer:
         self,
         index: Optional[faiss.Index],
         not_changed_chunks_by_file: dict[str, list[Chunk]],
-        updated_chunks_by_file: dict[str, list[Chunk]],
-    ) -> faiss.Index:
-        """Update FAISS index incrementally using IndexIDMap"""
+        changed_paths: Set[Path],
+    ) -> tuple[faiss.Index, dict[str, FileStat], dict[str, list[Chunk]]]:
+        """Update FAISS index incrementally using IndexIDMap
+
+        returns the index + stats/chunks of changed files (chunked as part of the embedding pipeline)
+        """
 
         # Create base index if it doesn't exist
         if index is None:
             shape = await get_shape()
             # 768 for "intfloat/e5-base-v2"
             # 1024 for Qwen3
-            base_index = faiss.IndexFlatIP(shape)
-            index = faiss.IndexIDMap(base_index)
+            index = new_flat_index(shape)
             # FYI if someone deletes the vectors file... this won't recreate it if stat still exists...
-
-        new_chunks: list[Chunk] = []
-        new_faiss_ids: list[int] = []
-        for file_chunks in updated_chunks_by_file.values():
-            for chunk in file_chunks:
-                new_chunks.append(chunk)
-                new_faiss_ids.append(chunk.faiss_id)
+            #   FYI starts flat, apply_vector_index_config picks the configured kind once all vectors are added
+        elif not supports_remove_ids(index):
+            # i.e. HNSW => update a flat copy, then rebuild it
+            with logger.timer(f"Copy {index_kind(index)} vectors to flat index for update"):
+                index = to_flat_index(index)
 
         # FYI FIX THE updated check logic... don't try to work around it here
         #  fix it so a chunk that is VERBATIM same content is NOT marked updated just b/c another part of the file is... OR just b/c timestamp on file changes!
@@ -220,18 +384,56 @@ class IncrementalRAGIndexer:
         not_keep_selector = faiss.IDSelectorNot(keep_selector)
         index.remove_ids(not_keep_selector)
 
-        if new_chunks:
-            logger.pp_debug("new_faiss_ids", new_faiss_ids)
-
-            with logger.timer("Encode new vectors"):
-                passages = [chunk.text for chunk in new_chunks]
-                vecs_np = await encode_passages(passages)
+        pipeline = EmbeddingPipeline(self.chunker_pool, self.vector_cache, self.options)
+        with logger.timer("Chunk + encode changed files"):
+            changed_stat_by_path, updated_chunks_by_file = await pipeline.run(index, changed_paths)
 
-            faiss_ids_np = np.array(new_faiss_ids, dtype="int64")
+        return index, changed_stat_by_path, updated_chunks_by_file
 
-            index.add_with_ids(vecs_np, faiss_ids_np)
-
-        return index
+    async def collect_exact_vectors(
+        self,
+        prior_files: RAGDataset,
+        index: faiss.Index,
+        all_chunks_by_file: dict[str, list[Chunk]],
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """ float32 vectors for every id in index, for rescoring w/ a lossy index (can't decode those from the index) """
+        if prior_files.index is None or not is_lossy_index(prior_files.index):
+            # prior + added vectors are all float32 => index has them
+            return get_vectors_and_ids(index)
+
+        ids = get_ids(index)
+        if prior_files.exact_vectors is not None:
+            vecs, found = prior_files.exact_vectors.get_many(ids)
+        else:
+            vecs, found = np.zeros((len(ids), index.d), dtype=np.float32), np.zeros(len(ids), dtype=bool)
+
+        missing = np.flatnonzero(~found)
+        if len(missing) > 0:
+            # i.e. vectors added this run, vector cache => no re-encoding
+            text_by_faiss_id = {chunk.faiss_id: chunk.text for chunks in all_chunks_by_file.values() for chunk in chunks}
+            passages = [text_by_faiss_id[faiss_id] for faiss_id in ids[missing].tolist()]
+            with logger.timer(f"Lookup {len(passages)} exact vectors"):
+                vecs[missing] = await self.vector_cache.encode_passages(passages, index.d)
+        return vecs, ids
+
+    def apply_vector_index_config(self, domain: str, index: faiss.Index, exact: tuple[np.ndarray, np.ndarray] | None = None) -> faiss.Index:
+        """ rebuild index if its kind/encoding doesn't match config for its size (i.e. flat => ivf as domain grows) or IVF lists are overfull
+
+        exact = (vecs, ids) w/ float32 vectors, else they're read back from index
+        """
+        config = self.config.vector_index_for(domain)
+        if not needs_rebuild(index, config):
+            return index
+
+        kind = config.resolve_kind(index.ntotal)
+        encoding = config.resolve_encoding(index.ntotal)
+        vecs, ids = exact if exact is not None else get_vectors_and_ids(index)
+        with logger.timer(f"Build {kind}/{encoding} index for {domain} ({len(ids)} vectors, was {describe_index(index)})"):
+            rebuilt = build_index(vecs, ids, config)
+
+        if (index_kind(rebuilt) != KIND_FLAT or is_lossy_index(rebuilt)) and len(ids) > 0:
+            logger.info(f"{domain} {kind}/{encoding} vs flat: {measure_recall(rebuilt, vecs, ids)}")
+        return rebuilt
 
     async def build_index(self, domain: str, current_files: set[str] = set()):
         """Build or update the RAG index incrementally for a given semantic domain."""
@@ -244,15 +446,21 @@ class IncrementalRAGIndexer:
 
         logger.pp_debug("files_diff", files_diff)
 
-        if not files_diff.changed and not files_diff.deleted:
+        # LS updates (journal) replayed by load_domain => write them out even if nothing else changed
+        has_journal = prior_files.journal_bytes_replayed > 0
+        if not files_diff.changed and not files_diff.deleted and not has_journal:
             message = f"[green]No changes detected, [white bold]{domain}[/] index is up to date!"
             if self.program_args.dry_run:
                 logger.warning(message)
             else:
                 logger.info(message)
+                # FYI no changes => nothing rewritten, so convert legacy chunks.json/files.json here
+                migrate_domain(self.dot_rag_dir / domain)
             return
 
         if self.program_args.dry_run:
+            if has_journal:
+                logger.warning(f"[DRY RUN] Would compact {prior_files.journal_bytes_replayed} bytes of LS updates")
             if files_diff.changed:
                 logger.warning(f"[DRY RUN] Changed files: {sorted(str(p) for p in files_diff.changed)}")
             if files_diff.deleted:
@@ -261,54 +469,52 @@ class IncrementalRAGIndexer:
 
         all_stat_by_path = {path_str: prior_files.stat_by_path[path_str] for path_str in files_diff.not_changed}
         not_changed_chunks_by_file = {path_str: prior_files.chunks_by_file[path_str] for path_str in files_diff.not_changed}
-        logger.info(f'{len(files_diff.changed)} changed, {len(files_diff.deleted)} deleted')
-
-        updated_chunks_by_file: dict[str, list[Chunk]] = {}
-        for file_path in files_diff.changed:
-            file_path_str = str(file_path)
+        logger.info(f'{len(files_diff.changed)} changed, {len(files_diff.deleted)} deleted, {prior_files.journal_bytes_replayed} bytes of LS updates')
 
-            stat = get_file_stat(file_path)
-            all_stat_by_path[file_path_str] = stat
+        # * Incrementally update the FAISS index
+        #   FYI changed files are chunked in the same pipeline that encodes them (overlaps chunking w/ embedding)
+        index, changed_stat_by_path, updated_chunks_by_file = await self.update_faiss_index_incrementally(
+            prior_files.index,
+            not_changed_chunks_by_file,
+            files_diff.changed,
+        )
+        all_stat_by_path.update(changed_stat_by_path)
+        all_chunks_by_file = not_changed_chunks_by_file.copy()
+        all_chunks_by_file.update(updated_chunks_by_file)
 
-            # Create new chunks for this file
-            chunks = build_chunks_from_file(file_path, stat.hash, self.options)
-            updated_chunks_by_file[file_path_str] = chunks
+        # * lossy encoding => keep float32 vectors alongside, to rescore candidates
+        #   also when switching from lossy back to flat, so it's rebuilt w/o the quantization error
+        exact = None
+        if self.config.vector_index_for(domain).is_lossy(index.ntotal) or is_lossy_index(index):
+            exact = await self.collect_exact_vectors(prior_files, index, all_chunks_by_file)
+        index = self.apply_vector_index_config(domain, index, exact)
 
         logger.pp_debug("Deleted chunks", files_diff.deleted)
         logger.pp_debug("Updated chunks", updated_chunks_by_file)
         logger.pp_debug("NOT changed chunks", not_changed_chunks_by_file)
 
-        # * Incrementally update the FAISS index
-        if files_diff.changed or files_diff.deleted:
-            index = await self.update_faiss_index_incrementally(
-                prior_files.index,
-                not_changed_chunks_by_file,
-                updated_chunks_by_file,
-            )
-        else:
-            index = prior_files.index
-
-        if index is None:
-            return
-
         # Save everything under the domain_dir key
+        #   FYI into a new generation dir, readers (LS/MCP) don't see any of it until it's published
         domain_dir = self.dot_rag_dir / domain
         domain_dir.mkdir(exist_ok=True, parents=True)
+        generation, gen_dir = new_generation_dir(domain_dir)
 
         is_dry_run = self.program_args.dry_run
-        faiss.write_index(index, str(domain_dir / "vectors.index"))
+        write_index(index, gen_dir / "vectors.index")
+        if exact is not None and is_lossy_index(index):
+            with logger.timer("Save exact vectors"):
+                ExactVectors.write(gen_dir, exact[1], exact[0])
 
         logger.pp_debug("ids: ", prior_files.index_view.ids)
 
-        with logger.timer("Save chunks"):
-            all_chunks_by_file = not_changed_chunks_by_file.copy()
-            all_chunks_by_file.update(updated_chunks_by_file)
+        with logger.timer("Save chunks + file stats"):
             # logger.pp_debug("all_chunks_by_file", all_chunks_by_file)
             # logger.pp_debug("all_stat_by_path", all_stat_by_path)
-            write_json(all_chunks_by_file, domain_dir / "chunks.json")
+            write_chunk_store(gen_dir, all_chunks_by_file, all_stat_by_path)
 
-        with logger.timer("Save file stats"):
-            write_json(all_stat_by_path, domain_dir / "files.json")
+        publish_generation(domain_dir, generation)
+        # FYI only after everything it replayed is published
+        compact_journal(domain_dir, prior_files.journal_bytes_replayed)
 
         logger.debug(f"[green]Index updated successfully!")
         if files_diff.changed:
@@ -328,6 +534,7 @@ async def main():
         parser.add_argument("--dry-run", action="store_true", help="Dry run: compute changes but don't write anything")
         parser.add_argument("--githook", action="store_true", help="Run in git hook mode")
         parser.add_argument("--domain", type=str, help="Only process files with the specified semantic domain")
+        parser.add_argument("--workers", type=int, help="Number of chunker processes (default: number of cores)")
 
         argcomplete.autocomplete(parser)
         args = parser.parse_args()
@@ -340,6 +547,7 @@ async def main():
             dry_run=args.dry_run,
             level=logging.WARNING,
             domain=args.domain,
+            workers=args.workers,
         )
         if args.githook:
             program_args.level = logging.WARN
@@ -360,9 +568,9 @@ async def main():
         is_dry_run = args.dry_run
         if args.rebuild:
             if is_dry_run:
-                logger.warning(f"[DRY RUN] Would trash rag dir: {workspace.project.dot_rag_dir}")
+                logger.warning(f"[DRY RUN] Would trash rag dir (except {VECTOR_CACHE_FILE_NAME}): {workspace.project.dot_rag_dir}")
             else:
-                trash_dir(workspace.project.dot_rag_dir)
+                trash_index(workspace.project.dot_rag_dir)
 
         indexer = IncrementalRAGIndexer(RAGChunkerOptions.ProductionOptions(), args)
         await indexer.main()
@@ -1,3 +1,4 @@
+import asyncio
 import os
 from config.domains import find_files_by_semantic_domain
 from logs import get_logger, logging_fwk_to_console, print_code
@@ -16,7 +17,9 @@ import rich
 from indexer import IncrementalRAGIndexer
 from chunks.chunker import RAGChunkerOptions
 from inference.client.embedder import encode_query
-from index.storage import ChunkType, load_all_domains, load_chunks_by_file, load_file_stats_by_file
+from index.chunk_store import load_chunk_store
+from index.generations import data_dir_for
+from index.storage import ChunkType, load_all_domains
 from config import RagConfig
 from index.ignores import reset_cache_bewteen_tests
 from index import workspace
@@ -53,15 +56,20 @@ def reset_testing():
 class TestBuildIndex:
 
     def get_vector_index(self):
-        vectors_index_path = dot_rag_dir / "lua" / "vectors.index"
+        _, data_dir = data_dir_for(dot_rag_dir / "lua")
+        vectors_index_path = data_dir / "vectors.index"
         index = faiss.read_index(str(vectors_index_path))
         return index
 
     def get_chunks_by_file(self):
-        return load_chunks_by_file(dot_rag_dir / "lua/chunks.json")
+        _, data_dir = data_dir_for(dot_rag_dir / "lua")
+        chunks_by_file, _ = load_chunk_store(data_dir)
+        return chunks_by_file
 
     def get_files(self):
-        return load_file_stats_by_file(dot_rag_dir / "lua" / "files.json")
+        _, data_dir = data_dir_for(dot_rag_dir / "lua")
+        _, stat_by_path = load_chunk_store(data_dir)
+        return stat_by_path
 
     async def build_lua_index(self):
         files_by_domain = find_files_by_semantic_domain(workspace.project.folder)
@@ -153,7 +161,7 @@ class TestBuildIndex:
         #   FYI updater tests will alter the index and break this test
         await self.build_lua_index()
 
-        chunks_by_file = load_chunks_by_file(dot_rag_dir / "lua/chunks.json")
+        chunks_by_file = self.get_chunks_by_file()
         assert len(chunks_by_file) == 1
         chunks = next(iter(chunks_by_file.values()))
         # I do not to replicate tests of building id/id_int and hard coding the values so...
@@ -400,3 +408,102 @@ class TestBuildIndex:
     async def PRN_test_timing_of_batch_vs_individual_chunk_encoding():
         # I suspect batching is a big boost in perf, but I need to understand more before I commit to designs one way or another
         pass
+
+
+class FakeVectorCache:
+    """ stands in for VectorCache => no inference server needed """
+
+    def __init__(self, delays_s: list[float] | None = None):
+        self.batches: list[list[str]] = []
+        # delay per batch (cycled) => encodes finish out of order
+        self.delays_s = delays_s or [0]
+
+    async def encode_passages(self, passages: list[str], dimensions: int) -> np.ndarray:
+        self.batches.append(passages)
+        await asyncio.sleep(self.delays_s[(len(self.batches) - 1) % len(self.delays_s)])
+        return np.ones((len(passages), dimensions), dtype=np.float32)
+
+
+class TestEmbeddingPipeline:
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("max_workers", [1, 2])  # 2 => chunked on the spawn pool
+    async def test_all_changed_chunks_are_encoded_and_added(self, tmp_path, max_workers):
+        from chunks.pool import ChunkerPool, stat_and_chunk_file
+        from indexer import EmbeddingPipeline
+
+        paths = set()
+        for name in ["numbers.30.txt", "numbers.50.txt", "car.lua.txt", "unchanged.lua.txt"]:
+            path = tmp_path / name.removesuffix(".txt")
+            path.write_text((my_dir / "chunks/test_cases" / name).read_text())
+            paths.add(path)
+
+        options = RAGChunkerOptions.OnlyLineRangeChunks()
+        cache = FakeVectorCache()
+        pool = ChunkerPool(max_workers=max_workers, min_files_for_pool=0)
+        pipeline = EmbeddingPipeline(pool, cache, options, encode_batch_size=3)  # type: ignore
+        index = faiss.IndexIDMap(faiss.IndexFlatIP(4))
+
+        try:
+            stat_by_path, chunks_by_file = await pipeline.run(index, paths)
+        finally:
+            pool.shutdown()
+
+        expected_chunks_by_file = {str(p): stat_and_chunk_file(p, options)[1] for p in paths}
+        assert chunks_by_file == expected_chunks_by_file
+        assert set(stat_by_path.keys()) == set(expected_chunks_by_file.keys())
+
+        all_chunks = [c for chunks in chunks_by_file.values() for c in chunks]
+        assert index.ntotal == len(all_chunks)
+        assert all(len(batch) <= 3 for batch in cache.batches)
+        assert sum(len(batch) for batch in cache.batches) == len(all_chunks)
+
+        # * inserted in path order, regardless of which worker finishes first
+        ids = faiss.vector_to_array(index.id_map)
+        assert ids.tolist() == [c.faiss_id for path in sorted(paths, key=str) for c in chunks_by_file[str(path)]]
+
+    @pytest.mark.asyncio
+    async def test_slow_encode_does_not_reorder_inserts(self, tmp_path):
+        from chunks.pool import ChunkerPool
+        from indexer import EmbeddingPipeline
+
+        paths = set()
+        for name in ["numbers.30.txt", "numbers.50.txt", "car.lua.txt", "unchanged.lua.txt"]:
+            path = tmp_path / name.removesuffix(".txt")
+            path.write_text((my_dir / "chunks/test_cases" / name).read_text())
+            paths.add(path)
+
+        options = RAGChunkerOptions.OnlyLineRangeChunks()
+        # every other batch is slow => its successor finishes first
+        cache = FakeVectorCache(delays_s=[0.05, 0])
+        pool = ChunkerPool(max_workers=1, min_files_for_pool=0)
+        pipeline = EmbeddingPipeline(pool, cache, options, encode_batch_size=2, max_encodes_in_flight=2)  # type: ignore
+        index = faiss.IndexIDMap(faiss.IndexFlatIP(4))
+
+        try:
+            _, chunks_by_file = await pipeline.run(index, paths)
+        finally:
+            pool.shutdown()
+
+        assert len(cache.batches) > 2
+        ids = faiss.vector_to_array(index.id_map)
+        assert ids.tolist() == [c.faiss_id for path in sorted(paths, key=str) for c in chunks_by_file[str(path)]]
+
+
+def test_rebuild_keeps_vector_cache(tmp_path, monkeypatch):
+    import indexer
+    from index.vector_cache import VECTOR_CACHE_FILE_NAME, VectorCache
+
+    rag_dir = tmp_path / ".rag"
+    cache = VectorCache.for_dot_rag_dir(rag_dir)
+    cache.put_many(["local foo = 1"], np.ones((1, 4), dtype=np.float32))
+    (rag_dir / "lua").mkdir()
+    trashed = []
+    monkeypatch.setattr(indexer, "trash_dir", trashed.append)
+
+    # open => sqlite -wal/-shm files exist too
+    assert len(list(rag_dir.glob(f"{VECTOR_CACHE_FILE_NAME}*"))) > 1
+    indexer.trash_index(rag_dir)
+    cache.close()
+
+    assert trashed == [rag_dir / "lua"]
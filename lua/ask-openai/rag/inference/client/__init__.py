@@ -1,60 +1,285 @@
-from asyncio import open_connection
+from asyncio import IncompleteReadError, open_connection
 from dataclasses import asdict, dataclass
+import asyncio
+import itertools
 import socket
+import weakref
+from typing import Any
+
+import numpy as np
 
 from logs import get_logger
 from inference.comms import *
 
 logger = get_logger(__name__)
 
+INFERENCE_HOST = "rag.lan"
+INFERENCE_PORT = 8015
+
+# binary encoding requested for vectors/scores in responses (see comms.WIRE_DTYPES)
+WIRE_DTYPE = "f32"
+
+# servers that don't advertise limits (request type 'limits') => batches of 8, what the client used to send
+DEFAULT_RERANK_TOKEN_BUDGET = 4096
+DEFAULT_RERANK_MAX_BATCH_SIZE = 8
+
+@dataclass
+class RerankLimits:
+    # max padded tokens ((prefix + longest doc) * count) per rerank request
+    token_budget: int = DEFAULT_RERANK_TOKEN_BUDGET
+    max_batch_size: int = DEFAULT_RERANK_MAX_BATCH_SIZE
+
+class InferenceServerError(Exception):
+    """ server responded w/ an error for a request (vs connection errors, which are ConnectionError) """
+
 @dataclass
 class RerankRequest:
     instruct: str
     query: str
     docs: list[str]
     type: str = "rerank"
+    wire_dtype: str = WIRE_DTYPE
+    priority: str = PRIORITY_HIGH
+
+class InferenceConnection:
+    """ one socket, many requests in flight => each request gets a Future, resolved by id as responses arrive (in any order) """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.num_requests = 0
+        # server advertised, asked once per connection (i.e. server restart => ask again), see AsyncInferenceClient.rerank_limits
+        self.rerank_limits: RerankLimits | None = None
+        self._next_id = itertools.count(1)
+        self._pending: dict[int, asyncio.Future] = {}
+        self._reader_task = asyncio.create_task(self._read_responses())
+
+    @staticmethod
+    async def open(host: str = INFERENCE_HOST, port: int = INFERENCE_PORT) -> "InferenceConnection":
+        reader, writer = await open_connection(
+            host=host,
+            port=port,
+            family=socket.AF_INET,
+        )
+        enable_keepalive(writer)
+        return InferenceConnection(reader, writer)
+
+    def is_usable(self) -> bool:
+        # reader task finishes when the server closes its end (i.e. restarted) or the socket errors
+        return not self.writer.is_closing() and not self._reader_task.done()
+
+    @property
+    def num_in_flight(self) -> int:
+        return len(self._pending)
+
+    async def submit(self, message: dict[str, Any]) -> asyncio.Future:
+        """ send request, returns Future for its response
+
+        FYI cancel the Future to drop just this request (i.e. LS cancelled the request that needed it)
+        """
+        request_id = next(self._next_id)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        future.add_done_callback(lambda f: self._on_done(request_id, f))
+
+        await send_len_then_msg_async(self.writer, {**message, 'id': request_id})
+        self.num_requests += 1
+        return future
+
+    async def request(self, message: dict[str, Any]) -> dict[str, Any]:
+        future = await self.submit(message)
+        return await future  # cancelling the await cancels the future too
+
+    async def send(self, message: dict[str, Any]):
+        """ fire and forget, no id, no response (i.e. hotpath_done) """
+        await send_len_then_msg_async(self.writer, message)
+        self.num_requests += 1
+
+    def _on_done(self, request_id: int, future: asyncio.Future):
+        self._pending.pop(request_id, None)
+        if not future.cancelled() or not self.is_usable():
+            return
+
+        # tell server to drop it (if not started yet)... response (if any) is ignored on arrival
+        async def send_cancel():
+            try:
+                await send_len_then_msg_async(self.writer, {'type': 'cancel', 'id': request_id})
+            except (ConnectionError, OSError) as e:
+                logger.debug(f"failed to send cancel for request {request_id}: {e!r}")
+
+        asyncio.create_task(send_cancel())
+
+    async def _read_responses(self):
+        error: BaseException = ConnectionError("inference server closed connection")
+        try:
+            while True:
+                response = await recv_len_then_msg_async(self.reader)
+                if response is None:
+                    logger.warning("empty response, closing connection")
+                    break
+
+                future = self._pending.pop(response.get('id'), None)
+                if future is None or future.done():
+                    # i.e. cancelled request, nobody is waiting on it
+                    logger.debug(f"dropping response for request {response.get('id')}")
+                    continue
+
+                if 'error' in response:
+                    future.set_exception(InferenceServerError(f"inference server error: {response['error']}"))
+                else:
+                    future.set_result(response)
+        except (ConnectionError, IncompleteReadError) as e:
+            error = ConnectionError(f"inference connection lost: {e!r}")
+        finally:
+            # fail everything still waiting, else callers hang forever
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self._pending.clear()
+            self.writer.close()
+
+    async def close(self):
+        self._reader_task.cancel()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass  # already gone, nothing to clean up
+
+class SharedInferenceConnection:
+    """ one long-lived (multiplexed) connection to the inference server, shared across requests
+
+    FYI many requests can be in flight on the shared connection, so no need for a connection per request (nor a pool)
+    reconnects (lazily) when the connection dies (i.e. server restart)
+    """
+
+    def __init__(self, host: str = INFERENCE_HOST, port: int = INFERENCE_PORT):
+        self.host = host
+        self.port = port
+        self._connection: InferenceConnection | None = None
+        self._opening = asyncio.Lock()
+        self.num_opened = 0
+
+    async def acquire(self) -> tuple[InferenceConnection, bool]:
+        """ returns (connection, reused) """
+        connection = self._connection
+        if connection is not None and connection.is_usable():
+            return connection, True
+
+        # lock => concurrent requests share one new connection instead of each opening their own
+        async with self._opening:
+            connection = self._connection
+            if connection is not None and connection.is_usable():
+                return connection, True
+            if connection is not None:
+                await connection.close()
+
+            self._connection = await InferenceConnection.open(self.host, self.port)
+            self.num_opened += 1
+            logger.debug(f"opened inference connection #{self.num_opened}")
+            return self._connection, False
+
+    async def discard(self, connection: InferenceConnection):
+        if self._connection is connection:
+            self._connection = None
+        await connection.close()
+
+    async def close(self):
+        if self._connection is not None:
+            await self.discard(self._connection)
+
+# one shared connection per event loop b/c streams are bound to the loop that created them (i.e. pytest-asyncio uses a loop per test)
+_shared_by_loop: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, SharedInferenceConnection] = weakref.WeakKeyDictionary()
+
+def get_shared_connection() -> SharedInferenceConnection:
+    loop = asyncio.get_running_loop()
+    shared = _shared_by_loop.get(loop)
+    if shared is None:
+        shared = SharedInferenceConnection()
+        _shared_by_loop[loop] = shared
+    return shared
 
 class AsyncInferenceClient:
+    """ uses the shared (multiplexed) connection for the life of the `async with` block
+
+    FYI concurrent requests are fine, i.e. asyncio.gather(*(client.rerank(r) for r in requests))
+    """
+
+    def __init__(self, shared: SharedInferenceConnection | None = None):
+        self._shared = shared
+        self.connection: InferenceConnection | None = None
+        self._reused = False
+
+    @property
+    def shared(self) -> SharedInferenceConnection:
+        if self._shared is None:
+            self._shared = get_shared_connection()
+        return self._shared
 
     async def disconnect(self):
-        self.writer.close()
-        await self.writer.wait_closed()
+        if self.connection is None:
+            return
+        await self.shared.discard(self.connection)
+        self.connection = None
+
+    async def submit(self, message: dict[str, Any]) -> asyncio.Future:
+        """ returns Future per request, cancel it to drop the request """
+        assert self.connection is not None
+        return await self.connection.submit(message)
+
+    async def _request(self, message: dict[str, Any]) -> dict[str, Any]:
+        assert self.connection is not None
+        connection = self.connection
+        try:
+            return await connection.request(message)
+        except ConnectionError as e:
+            if not self._reused:
+                raise
+            # shared connection went stale (server restart, network blip) => reconnect and retry ONCE
+            logger.info(f"reconnecting, shared connection failed: {e!r}")
+            if self.connection is connection:
+                await self.disconnect()
+                self.connection, _ = await self.shared.acquire()
+                self._reused = False  # fresh connection, no more retries
+            return await self.connection.request(message)
 
     async def signal_hotpath_done(self) -> None:
         logger.info("signaling hotpath done")
-        message = {'type': 'hotpath_done'}
-        await send_len_then_msg_async(self.writer, message)
+        assert self.connection is not None
+        await self.connection.send({'type': 'hotpath_done'})
         # no response
 
-    async def encode(self, inputs: dict[str, str]) -> list[list[float]] | None:
+    async def encode(self, inputs: dict[str, str], wire_dtype: str = WIRE_DTYPE, priority: str = PRIORITY_HIGH) -> np.ndarray:
         # PRN add dataclass like rerank below
-        inputs['type'] = 'embed'
-        await send_len_then_msg_async(self.writer, inputs)
-        response = await recv_len_then_msg_async(self.reader)
-        if response is None:
-            logger.warning("empty response, disconnecting")
-            return await self.disconnect()
-
-        # outer list is batch size
-        # inner list is hidden dimension (vector size) of float - i.e. 1024 with Qwen3-Embedding-0.6B
-        return response['embeddings']
-
-    async def rerank(self, request: RerankRequest) -> list[float] | None:
-        await send_len_then_msg_async(self.writer, asdict(request))
-        response = await recv_len_then_msg_async(self.reader)
-        if response is None:
-            logger.warning("empty response, disconnecting")
-            return await self.disconnect()
-
-        return response['scores']
+        response = await self._request({'wire_dtype': wire_dtype, 'priority': priority, **inputs, 'type': 'embed'})
+
+        # shape (batch size, hidden dimension) - i.e. 1024 with Qwen3-Embedding-0.6B
+        #   FYI f16 on the wire is widened here, f32 is a no copy view
+        return decode_ndarray(response['embeddings']).astype(np.float32, copy=False)
+
+    async def rerank_limits(self) -> RerankLimits:
+        assert self.connection is not None
+        if self.connection.rerank_limits is None:
+            try:
+                response = await self._request({'type': 'limits'})
+                limits = RerankLimits(token_budget=response['rerank_token_budget'], max_batch_size=response['rerank_max_batch_size'])
+            except InferenceServerError as e:
+                # i.e. server from before 'limits' => responds w/ an error for the unsupported type
+                logger.info(f"inference server has no rerank limits, using defaults: {e!r}")
+                limits = RerankLimits()
+            assert self.connection is not None
+            self.connection.rerank_limits = limits
+        return self.connection.rerank_limits
+
+    async def rerank(self, request: RerankRequest) -> np.ndarray:
+        response = await self._request(asdict(request))
+        return decode_ndarray(response['scores'])
 
     async def __aenter__(self):
-        self.reader, self.writer = await open_connection(
-            host="rag.lan",
-            port=8015,
-            family=socket.AF_INET,
-        )
+        self.connection, self._reused = await self.shared.acquire()
         return self
 
-    async def __aexit__(self, _exc_type, _exc, _tb):
-        await self.disconnect()
+    async def __aexit__(self, exc_type, _exc, _tb):
+        # FYI responses are matched by id, so a failed/cancelled request doesn't poison the shared connection
+        #   dead connections are detected by its reader task and replaced on next acquire
+        self.connection = None
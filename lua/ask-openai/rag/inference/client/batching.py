@@ -0,0 +1,67 @@
+from dataclasses import dataclass
+
+# FYI token estimates are in inference.comms (estimate_tokens), the server sizes its batches with them too
+
+
+@dataclass
+class TokenBatch:
+    # positions in the original (unsorted) inputs => used to scatter results back
+    indexes: list[int]
+    longest_tokens: int
+    actual_tokens: int
+
+    @property
+    def padded_tokens(self) -> int:
+        # every sequence is padded to the longest in its batch
+        return self.longest_tokens * len(self.indexes)
+
+
+def pack_by_token_budget(token_counts: list[int], token_budget: int, max_batch_size: int) -> list[TokenBatch]:
+    """ sort by length (longest first) then fill each batch until its padded size would exceed token_budget
+
+    - a sequence longer than the budget gets a batch of its own (never dropped)
+    - sorting means similar lengths share a batch => minimal padding
+    """
+    if token_budget < 1 or max_batch_size < 1:
+        raise ValueError(f"token_budget and max_batch_size must be >= 1, got {token_budget=} {max_batch_size=}")
+
+    # stable sort => ties keep original order
+    order = sorted(range(len(token_counts)), key=lambda i: token_counts[i], reverse=True)
+
+    batches: list[TokenBatch] = []
+    current: TokenBatch | None = None
+    for i in order:
+        tokens = token_counts[i]
+        if current is not None:
+            # longest first => current.longest_tokens stays the longest if we add this one
+            padded_if_added = current.longest_tokens * (len(current.indexes) + 1)
+            if padded_if_added > token_budget or len(current.indexes) >= max_batch_size:
+                batches.append(current)
+                current = None
+        if current is None:
+            current = TokenBatch(indexes=[], longest_tokens=tokens, actual_tokens=0)
+        current.indexes.append(i)
+        current.actual_tokens += tokens
+
+    if current is not None:
+        batches.append(current)
+    return batches
+
+
+def fixed_size_batches(token_counts: list[int], batch_size: int) -> list[TokenBatch]:
+    """ original order, fixed number per batch => baseline to compare padding against """
+    batches = []
+    for start in range(0, len(token_counts), batch_size):
+        indexes = list(range(start, min(start + batch_size, len(token_counts))))
+        counts = [token_counts[i] for i in indexes]
+        batches.append(TokenBatch(indexes=indexes, longest_tokens=max(counts), actual_tokens=sum(counts)))
+    return batches
+
+
+def padding_ratio(batches: list[TokenBatch]) -> float:
+    """ fraction of padded tokens that are padding (wasted compute) """
+    padded = sum(b.padded_tokens for b in batches)
+    if padded == 0:
+        return 0.0
+    actual = sum(b.actual_tokens for b in batches)
+    return (padded - actual) / padded
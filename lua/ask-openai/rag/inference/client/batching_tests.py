@@ -0,0 +1,54 @@
+import pytest
+
+from inference.client.batching import (
+    fixed_size_batches,
+    pack_by_token_budget,
+    padding_ratio,
+)
+
+
+def test_every_index_is_batched_exactly_once():
+    token_counts = [50, 3000, 50, 400, 50, 50, 400, 50, 50, 7]
+    batches = pack_by_token_budget(token_counts, token_budget=1000, max_batch_size=8)
+
+    all_indexes = sorted(i for b in batches for i in b.indexes)
+    assert all_indexes == list(range(len(token_counts)))
+
+
+def test_long_sequence_gets_its_own_batch():
+    batches = pack_by_token_budget([50, 3000, 50], token_budget=1000, max_batch_size=8)
+
+    assert batches[0].indexes == [1]
+    assert batches[0].padded_tokens == 3000
+    assert batches[1].indexes == [0, 2]
+
+
+def test_padded_tokens_stay_within_budget():
+    token_counts = [10, 200, 30, 200, 10, 90, 90, 10]
+    batches = pack_by_token_budget(token_counts, token_budget=400, max_batch_size=100)
+
+    for batch in batches:
+        assert batch.padded_tokens <= 400
+        assert batch.longest_tokens == max(token_counts[i] for i in batch.indexes)
+        assert batch.actual_tokens == sum(token_counts[i] for i in batch.indexes)
+
+
+def test_max_batch_size_caps_count():
+    batches = pack_by_token_budget([1] * 10, token_budget=1000, max_batch_size=4)
+
+    assert [len(b.indexes) for b in batches] == [4, 4, 2]
+
+
+def test_packing_beats_fixed_batches_on_mixed_lengths():
+    token_counts = [3000, 50, 50, 50, 50, 50, 50, 50] * 4
+
+    fixed = padding_ratio(fixed_size_batches(token_counts, 8))
+    packed = padding_ratio(pack_by_token_budget(token_counts, token_budget=8192, max_batch_size=64))
+
+    assert fixed > 0.8
+    assert packed == 0
+
+
+def test_invalid_budget_raises():
+    with pytest.raises(ValueError):
+        pack_by_token_budget([1], token_budget=0, max_batch_size=1)
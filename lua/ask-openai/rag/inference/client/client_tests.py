@@ -0,0 +1,171 @@
+import asyncio
+from dataclasses import asdict
+
+import pytest
+
+from inference.client import AsyncInferenceClient, SharedInferenceConnection, RerankLimits, RerankRequest
+from inference.comms import encode_ndarray, recv_len_then_msg_async, send_len_then_msg_async
+
+
+class FakeInferenceServer:
+    """ speaks the msgpack protocol, serves concurrent requests per connection like the real server
+
+    FYI each doc is a delay (seconds as str) => later requests can finish first
+    """
+
+    def __init__(self):
+        self.num_connections = 0
+        self.server: asyncio.Server | None = None
+        self.writers: list[asyncio.StreamWriter] = []
+        self.cancelled_ids: list[int] = []
+        # None => like a server w/o limits support
+        self.limits: dict | None = None
+
+    async def start(self, port: int = 0) -> int:
+        self.server = await asyncio.start_server(self.on_client_connected, "127.0.0.1", port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        assert self.server is not None
+        self.server.close()
+        for writer in self.writers:
+            writer.close()
+        await self.server.wait_closed()
+
+    async def respond(self, request: dict, writer: asyncio.StreamWriter):
+        if request['type'] == 'limits':
+            response = self.limits if self.limits is not None else {'error': "unsupported type=limits"}
+            await send_len_then_msg_async(writer, {'id': request['id'], **response})
+            return
+        await asyncio.sleep(sum(float(d) for d in request['docs']))
+        scores = encode_ndarray([float(d) for d in request['docs']], request['wire_dtype'])
+        await send_len_then_msg_async(writer, {'id': request['id'], 'scores': scores})
+
+    async def on_client_connected(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.num_connections += 1
+        self.writers.append(writer)
+        try:
+            while True:
+                request = await recv_len_then_msg_async(reader)
+                if request is None:
+                    break
+                if request['type'] == 'cancel':
+                    self.cancelled_ids.append(request['id'])
+                    continue
+                asyncio.create_task(self.respond(request, writer))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def rerank(shared: SharedInferenceConnection, docs: list[str]) -> list[float]:
+    async with AsyncInferenceClient(shared) as client:
+        return (await client.rerank(RerankRequest(instruct="i", query="q", docs=docs))).tolist()
+
+
+@pytest.mark.asyncio
+async def test_sequential_requests_reuse_one_connection():
+    server = FakeInferenceServer()
+    port = await server.start()
+    shared = SharedInferenceConnection(host="127.0.0.1", port=port)
+    try:
+        for docs in [["0"], ["0.001", "0"], ["0.002"]]:
+            assert await rerank(shared, docs) == pytest.approx([float(d) for d in docs])
+
+        assert server.num_connections == 1
+        assert shared.num_opened == 1
+    finally:
+        await shared.close()
+        await server.stop()
+
+
+@pytest.mark.asyncio
+async def test_reconnects_once_after_server_restart():
+    server = FakeInferenceServer()
+    port = await server.start()
+    shared = SharedInferenceConnection(host="127.0.0.1", port=port)
+    try:
+        assert await rerank(shared, ["1e-3"]) == pytest.approx([0.001])
+
+        # * restart => shared connection is stale
+        await server.stop()
+        server = FakeInferenceServer()
+        await server.start(port)
+
+        assert await rerank(shared, ["2e-3"]) == pytest.approx([0.002])
+        assert shared.num_opened == 2
+    finally:
+        await shared.close()
+        await server.stop()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_share_connection_and_resolve_out_of_order():
+    server = FakeInferenceServer()
+    port = await server.start()
+    shared = SharedInferenceConnection(host="127.0.0.1", port=port)
+    try:
+        finished: list[str] = []
+
+        async def rerank_and_track(delay: str):
+            scores = await rerank(shared, [delay])
+            finished.append(delay)
+            return scores
+
+        # * slowest first => responses arrive in reverse order
+        results = await asyncio.gather(*(rerank_and_track(d) for d in ["0.05", "0.02", "0"]))
+
+        assert results == [pytest.approx([0.05]), pytest.approx([0.02]), [0.0]]
+        assert finished == ["0", "0.02", "0.05"]
+        assert server.num_connections == 1
+    finally:
+        await shared.close()
+        await server.stop()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_future_drops_only_its_request():
+    server = FakeInferenceServer()
+    port = await server.start()
+    shared = SharedInferenceConnection(host="127.0.0.1", port=port)
+    try:
+        async with AsyncInferenceClient(shared) as client:
+            slow = await client.submit(asdict(RerankRequest(instruct="i", query="q", docs=["0.05"])))
+            fast = await client.submit(asdict(RerankRequest(instruct="i", query="q", docs=["0.01"])))
+
+            slow.cancel()
+            assert (await fast)['scores']['shape'] == [1]
+
+            # let the cancelled response arrive => dropped, not delivered anywhere
+            await asyncio.sleep(0.08)
+            assert client.connection is not None
+            assert client.connection.num_in_flight == 0
+            assert client.connection.is_usable()
+
+        assert server.cancelled_ids == [1]
+    finally:
+        await shared.close()
+        await server.stop()
+
+
+@pytest.mark.asyncio
+async def test_rerank_limits_are_asked_once_per_connection():
+    server = FakeInferenceServer()
+    port = await server.start()
+    shared = SharedInferenceConnection(host="127.0.0.1", port=port)
+    try:
+        async with AsyncInferenceClient(shared) as client:
+            # older server => defaults
+            assert await client.rerank_limits() == RerankLimits()
+
+        server.limits = {'rerank_token_budget': 1234, 'rerank_max_batch_size': 16}
+        async with AsyncInferenceClient(shared) as client:
+            assert await client.rerank_limits() == RerankLimits()  # cached on the connection
+
+        await shared.close()
+        async with AsyncInferenceClient(shared) as client:
+            assert await client.rerank_limits() == RerankLimits(token_budget=1234, max_batch_size=16)
+    finally:
+        await shared.close()
+        await server.stop()
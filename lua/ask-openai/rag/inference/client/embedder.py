@@ -2,10 +2,31 @@ from logs import get_logger
 from typing import Optional
 import numpy as np
 from inference.client import AsyncInferenceClient
+from inference.comms import PRIORITY_BULK, PRIORITY_HIGH, estimate_tokens
+from inference.client.batching import fixed_size_batches, pack_by_token_budget, padding_ratio
+from inference.client.query_cache import QUERY_CACHE_DB_PATH, QueryVectorCache
+from config import DEFAULT_QUERY_CACHE_SIZE
 import asyncio
 
 logger = get_logger(__name__)
 
+# FYI must match model the inference server loads (see inference/server/qwen3_embeddings.py)
+#   used to key client side caches, so cached vectors are never mixed across models
+EMBEDDING_MODEL_ID = "Qwen/Qwen3-Embedding-0.6B"
+
+# max padded tokens (longest * count) per embed request, tune to server VRAM
+EMBED_TOKEN_BUDGET = 8192
+# cap count too, many tiny texts (i.e. queries) don't need giant batches
+EMBED_MAX_BATCH_SIZE = 64
+
+# repeat queries skip the inference server, LS/MCP reconfigure this from .rag.yaml (see configure_query_cache)
+query_cache = QueryVectorCache(EMBEDDING_MODEL_ID, DEFAULT_QUERY_CACHE_SIZE)
+
+def configure_query_cache(max_entries: int, persist: bool) -> None:
+    global query_cache
+    query_cache.close()
+    query_cache = QueryVectorCache(EMBEDDING_MODEL_ID, max_entries, QUERY_CACHE_DB_PATH if persist else None)
+
 async def signal_hotpath_done_in_background() -> None:
     # FYI 0.01 ms if triggered in background
     # FYI 1 to 1.5ms if signal is sent while blocking response here (sans create_task)
@@ -15,33 +36,50 @@ async def signal_hotpath_done_in_background() -> None:
 
     asyncio.create_task(send_hotpath_in_background())
 
-async def _encode_batch(texts: list[str]) -> np.ndarray:
-    # PRN capture sequence length distribution data so I can see how variable it is
-    #   and if small batch size would help to avoid padding for longest sequence in a bigger batch?
-    async def batched_encode(texts: list[str], batch_size: int = 8) -> np.ndarray:
-        # PRN? allow multiple encodes per connection! right now server closes after one!
-        # can add longer-lived connection (beyond this batch)
-        #   BUT only if timing shows its worthwhile
-        #   btw ok to let client complete an entire batch, that won't require server to handle multiple connections
-        #     only need multi connection handling IF I allow longer-lived connections (like for entire life of LS/indexer)
-        all_vecs = []
-        total = len(texts)
-        for i in range(0, total, batch_size):
-            # FYI right now this is a new connection PER batch
-            async with AsyncInferenceClient() as client:
-                logger.info(f"    batch {i}-{i+batch_size} of {total}")
-                batch = texts[i:i + batch_size]
-                vecs = await client.encode({"texts": batch})
-                all_vecs.append(vecs)
-
-        return np.concatenate(all_vecs)
-
-    vecs_np = await batched_encode(texts)
-    return vecs_np
-
-async def encode_passages(passages: list[str]) -> np.ndarray:
+async def _encode_batch(
+    texts: list[str],
+    token_budget: int = EMBED_TOKEN_BUDGET,
+    max_batch_size: int = EMBED_MAX_BATCH_SIZE,
+    priority: str = PRIORITY_HIGH,
+) -> np.ndarray:
+    # FYI longest sequence in a batch dictates padding for the entire batch
+    #   i.e. fixed batches of 8 in original order => one 3000 token chunk pads seven 50 token chunks
+    #   so, sort by (estimated) length and pack batches up to a token budget, then scatter vectors back to original order
+    token_counts = [estimate_tokens(t) for t in texts]
+    batches = pack_by_token_budget(token_counts, token_budget, max_batch_size)
+
+    if logger.isEnabledForInfo() and len(texts) > 1:
+        fixed_padding = padding_ratio(fixed_size_batches(token_counts, 8))
+        packed_padding = padding_ratio(batches)
+        logger.info(f"    {len(texts)} texts => {len(batches)} batches, padding {fixed_padding:.1%} (fixed 8) => {packed_padding:.1%} (token budget), saved {fixed_padding - packed_padding:.1%}")
+
+    # FYI all batches in flight at once (multiplexed on one connection), then scatter vectors back to original order
+    async with AsyncInferenceClient() as client:
+
+        async def encode_one(batch_num: int, batch) -> np.ndarray:
+            logger.info(f"    batch {batch_num + 1} of {len(batches)}: {len(batch.indexes)} texts, ~{batch.padded_tokens} padded tokens")
+            return await client.encode({"texts": [texts[i] for i in batch.indexes]}, priority=priority)
+
+        batch_vecs = await asyncio.gather(*(encode_one(batch_num, batch) for batch_num, batch in enumerate(batches)))
+
+    all_vecs: np.ndarray | None = None
+    for batch, vecs in zip(batches, batch_vecs):
+        if all_vecs is None:
+            all_vecs = np.empty((len(texts), vecs.shape[1]), dtype=np.float32)
+        all_vecs[batch.indexes] = vecs
+
+    if all_vecs is None:
+        raise ValueError("no texts to encode")
+    return all_vecs
+
+async def encode_passages(
+    passages: list[str],
+    token_budget: int = EMBED_TOKEN_BUDGET,
+    max_batch_size: int = EMBED_MAX_BATCH_SIZE,
+) -> np.ndarray:
     # FYI Qwen3 has NO passage/document label, only query side has Query:/Instruct:
-    return await _encode_batch(passages)
+    # bulk lane => interactive queries/reranks go first (i.e. while re-indexing after a git checkout)
+    return await _encode_batch(passages, token_budget, max_batch_size, priority=PRIORITY_BULK)
 
 def qwen3_format_query(query: str, instruct: Optional[str]) -> str:
     if instruct:
@@ -49,9 +87,19 @@ def qwen3_format_query(query: str, instruct: Optional[str]) -> str:
     return f"Query: {query}"
 
 async def encode_query(query: str, instruct: Optional[str]) -> np.ndarray:
-    return await _encode_batch([
-        qwen3_format_query(query, instruct),
-    ])
+    return await encode_queries([(query, instruct)])
+
+async def encode_queries(queries: list[tuple[str, Optional[str]]]) -> np.ndarray:
+    """ (query, instruct) pairs => one row per pair, cache misses are encoded in one batch """
+    formatted_queries = [qwen3_format_query(query, instruct) for query, instruct in queries]
+    cached = [query_cache.get(q) for q in formatted_queries]
+    misses = list(dict.fromkeys(q for q, vec in zip(formatted_queries, cached) if vec is None))
+    vec_by_query: dict[str, np.ndarray] = {}
+    if misses:
+        vec_by_query = dict(zip(misses, await _encode_batch(misses)))
+        for q, vec in vec_by_query.items():
+            query_cache.put(q, vec)
+    return np.stack([vec if vec is not None else vec_by_query[q] for q, vec in zip(formatted_queries, cached)])
 
 async def get_shape() -> int:
     # create a dummy vector to get dimensions (1024 for Qwen3-Embedding-0.6B)...
@@ -0,0 +1,131 @@
+import sqlite3
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from logs import get_logger
+from logs.xdg import XDG_STATE_HOME
+
+logger = get_logger(__name__)
+
+# FYI shared across workspaces (queries aren't repo specific), LS + MCP both read/write it
+QUERY_CACHE_DB_PATH = XDG_STATE_HOME() / "ask-openai/query_vectors.sqlite"
+
+# persisted rows are pruned (least recently used first) past this many per model
+MAX_PERSISTED_QUERIES = 10_000
+
+
+class QueryVectorCache:
+    """ LRU of query vectors, keyed by (model, qwen3_format_query string) => repeat queries skip the inference server
+
+    i.e. telescope picker re-issues the same query as options are toggled, agents repeat queries across turns (MCP)
+    optionally persisted (sqlite in XDG state) so repeats survive LS/MCP restarts and are shared between them
+    """
+
+    def __init__(self, model_id: str, max_entries: int, db_path: Optional[Path] = None):
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._vectors: OrderedDict[str, np.ndarray] = OrderedDict()
+
+        self.db_path = db_path
+        self._conn: Optional[sqlite3.Connection] = None
+        if db_path is not None and self.enabled:
+            self._open_db(db_path)
+
+    @property
+    def enabled(self) -> bool:
+        """ max_entries 0 => disabled, persisted vectors included """
+        return self.max_entries > 0
+
+    def _open_db(self, db_path: Path):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=30)
+        # WAL => LS and MCP don't block each other, synchronous=NORMAL => no fsync per commit (cache, losing a row is fine)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS query_vectors (
+                model TEXT NOT NULL,
+                query TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, query)
+            )
+        """)
+        self._conn.commit()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def get(self, formatted_query: str) -> Optional[np.ndarray]:
+        """ formatted_query => see qwen3_format_query, None => miss """
+        if not self.enabled:
+            return None
+        vec = self._vectors.get(formatted_query)
+        if vec is not None:
+            self._vectors.move_to_end(formatted_query)
+        else:
+            vec = self._get_persisted(formatted_query)
+            if vec is not None:
+                self._remember(formatted_query, vec)
+
+        if vec is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        logger.info(f"query vector cache {'hit' if vec is not None else 'miss'} (lifetime: {self.hits} hits, {self.misses} misses)")
+        return vec
+
+    def put(self, formatted_query: str, vec: np.ndarray):
+        if not self.enabled:
+            return
+        vec = np.array(vec, dtype=np.float32).reshape(-1)
+        self._remember(formatted_query, vec)
+        self._put_persisted(formatted_query, vec)
+
+    def _remember(self, formatted_query: str, vec: np.ndarray):
+        vec.flags.writeable = False  # shared by every caller that hits
+        self._vectors[formatted_query] = vec
+        self._vectors.move_to_end(formatted_query)
+        while len(self._vectors) > self.max_entries:
+            self._vectors.popitem(last=False)
+
+    def _get_persisted(self, formatted_query: str) -> Optional[np.ndarray]:
+        if self._conn is None:
+            return None
+        row = self._conn.execute(
+            "SELECT vector FROM query_vectors WHERE model = ? AND query = ?",
+            [self.model_id, formatted_query],
+        ).fetchone()
+        if row is None:
+            return None
+        self._conn.execute(
+            "UPDATE query_vectors SET last_used = ? WHERE model = ? AND query = ?",
+            [time.time(), self.model_id, formatted_query],
+        )
+        self._conn.commit()
+        return np.frombuffer(row[0], dtype=np.float32).copy()
+
+    def _put_persisted(self, formatted_query: str, vec: np.ndarray):
+        if self._conn is None:
+            return
+        self._conn.execute(
+            "INSERT OR REPLACE INTO query_vectors (model, query, vector, last_used) VALUES (?, ?, ?, ?)",
+            [self.model_id, formatted_query, vec.tobytes(), time.time()],
+        )
+        self._conn.execute(
+            """
+            DELETE FROM query_vectors WHERE model = ? AND query NOT IN (
+                SELECT query FROM query_vectors WHERE model = ? ORDER BY last_used DESC LIMIT ?
+            )
+            """,
+            [self.model_id, self.model_id, MAX_PERSISTED_QUERIES],
+        )
+        self._conn.commit()
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from inference.client import embedder
+from inference.client.query_cache import QueryVectorCache
+
+
+def test_lru_evicts_least_recently_used():
+    cache = QueryVectorCache("model", max_entries=2)
+    cache.put("a", np.ones(4))
+    cache.put("b", np.ones(4) * 2)
+    assert cache.get("a") is not None  # a is now most recent
+
+    cache.put("c", np.ones(4) * 3)
+
+    assert cache.get("b") is None
+    np.testing.assert_array_equal(cache.get("a"), np.ones(4))
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_persisted_vectors_survive_restart_and_are_keyed_by_model(tmp_path):
+    db_path = tmp_path / "query_vectors.sqlite"
+    first = QueryVectorCache("model", max_entries=8, db_path=db_path)
+    first.put("Query: foo", np.arange(4, dtype=np.float32))
+    first.close()
+
+    restarted = QueryVectorCache("model", max_entries=8, db_path=db_path)
+    np.testing.assert_array_equal(restarted.get("Query: foo"), np.arange(4, dtype=np.float32))
+    assert QueryVectorCache("other model", max_entries=8, db_path=db_path).get("Query: foo") is None
+
+
+@pytest.mark.asyncio
+async def test_repeat_query_skips_inference(monkeypatch):
+    monkeypatch.setattr(embedder, "query_cache", QueryVectorCache(embedder.EMBEDDING_MODEL_ID, max_entries=8))
+    encoded: list[list[str]] = []
+
+    async def fake_encode_batch(texts, *args, **kwargs):
+        encoded.append(texts)
+        return np.ones((len(texts), 4), dtype=np.float32)
+
+    monkeypatch.setattr(embedder, "_encode_batch", fake_encode_batch)
+
+    first = await embedder.encode_query("foo", "find foo")
+    again = await embedder.encode_query("foo", "find foo")
+    await embedder.encode_query("foo", "different instruct")
+
+    assert encoded == [[embedder.qwen3_format_query("foo", "find foo")], [embedder.qwen3_format_query("foo", "different instruct")]]
+    np.testing.assert_array_equal(first, again)
+    assert again.shape == (1, 4) and again.flags.writeable
+
+
+def test_zero_entries_disables_persisted_vectors_too(tmp_path):
+    db_path = tmp_path / "query_vectors.sqlite"
+    persisted = QueryVectorCache("model", max_entries=8, db_path=db_path)
+    persisted.put("Query: foo", np.arange(4, dtype=np.float32))
+    persisted.close()
+
+    disabled = QueryVectorCache("model", max_entries=0, db_path=db_path)
+    assert disabled.get("Query: foo") is None
+    disabled.put("Query: bar", np.arange(4, dtype=np.float32))
+    disabled.close()
+
+    assert QueryVectorCache("model", max_entries=8, db_path=db_path).get("Query: bar") is None
+    assert (disabled.hits, disabled.misses) == (0, 0)
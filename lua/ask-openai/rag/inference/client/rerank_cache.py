@@ -0,0 +1,67 @@
+import sys
+from collections import OrderedDict
+
+from config import EVICT_LRU, EVICTION_POLICIES
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+# dict slot + chunk id str (16 hex chars) + float, ~130 bytes w/ tracemalloc (100k entries), round up for small dicts
+BYTES_PER_SCORE = 160
+
+
+class RerankScoreCache:
+    """ rerank scores keyed by (instruct, query, chunk id) => re-running a query (bigger topK, toggle skipSameFile) only reranks new candidates
+
+    chunk ids hash the file path, line range and file hash => a chunk id always means the same rerank document, safe across index updates
+    evicts whole queries (a query's scores are useful together), bounded by estimated bytes
+    """
+
+    def __init__(self, max_bytes: int, eviction: str = EVICT_LRU):
+        if eviction not in EVICTION_POLICIES:
+            raise ValueError(f"eviction must be one of {EVICTION_POLICIES}, got {eviction}")
+        self.max_bytes = max_bytes
+        self.eviction = eviction
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._scores_by_query: OrderedDict[tuple[str, str], dict[str, float]] = OrderedDict()
+
+    def get_many(self, instruct: str, query: str, chunk_ids: list[str]) -> list[float | None]:
+        """ one entry per chunk id, None => miss """
+        key = (instruct, query)
+        scores = self._scores_by_query.get(key)
+        if scores is not None and self.eviction == EVICT_LRU:
+            self._scores_by_query.move_to_end(key)
+        found = [scores.get(id) if scores is not None else None for id in chunk_ids]
+
+        num_hits = sum(score is not None for score in found)
+        self.hits += num_hits
+        self.misses += len(chunk_ids) - num_hits
+        logger.info(f"rerank cache: {num_hits} hits, {len(chunk_ids) - num_hits} misses (lifetime: {self.hits} hits, {self.misses} misses, {len(self._scores_by_query)} queries, {self.nbytes / 2**20:.1f} MiB)")
+        return found
+
+    def put_many(self, instruct: str, query: str, chunk_ids: list[str], scores: list[float]):
+        if self.max_bytes <= 0:
+            return
+        key = (instruct, query)
+        cached = self._scores_by_query.get(key)
+        if cached is None:
+            cached = self._scores_by_query[key] = {}
+            self.nbytes += _query_nbytes(key)
+        elif self.eviction == EVICT_LRU:
+            self._scores_by_query.move_to_end(key)
+        for id, score in zip(chunk_ids, scores):
+            if id not in cached:
+                self.nbytes += BYTES_PER_SCORE
+            cached[id] = score
+
+        # FYI never evict the query just reranked, even if it alone is over budget
+        while self.nbytes > self.max_bytes and len(self._scores_by_query) > 1:
+            evicted_key, evicted = self._scores_by_query.popitem(last=False)
+            self.nbytes -= _query_nbytes(evicted_key) + len(evicted) * BYTES_PER_SCORE
+
+
+def _query_nbytes(key: tuple[str, str]) -> int:
+    instruct, query = key
+    return sys.getsizeof(instruct) + sys.getsizeof(query) + sys.getsizeof(key) + sys.getsizeof({})
@@ -0,0 +1,44 @@
+from config import EVICT_FIFO, EVICT_LRU
+from inference.client.rerank_cache import BYTES_PER_SCORE, RerankScoreCache, _query_nbytes
+
+
+def test_hits_are_per_instruct_and_query():
+    cache = RerankScoreCache(2**20)
+    cache.put_many("instruct", "query", ["a", "b"], [0.9, 0.1])
+
+    assert cache.get_many("instruct", "query", ["b", "c", "a"]) == [0.1, None, 0.9]
+    assert cache.get_many("other instruct", "query", ["a"]) == [None]
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+# room for 3 queries and 5 scores
+MAX_BYTES = 3 * _query_nbytes(("instruct", "second")) + 5 * BYTES_PER_SCORE
+
+
+def fill(cache: RerankScoreCache):
+    cache.put_many("instruct", "first", ["a"], [0.1])
+    cache.put_many("instruct", "second", ["a"], [0.2])
+    cache.get_many("instruct", "first", ["a"])
+    # 3 queries + 6 scores => evicts one query
+    cache.put_many("instruct", "third", [str(i) for i in range(4)], [0.3] * 4)
+
+
+def test_lru_evicts_least_recently_used_query():
+    cache = RerankScoreCache(MAX_BYTES, EVICT_LRU)
+    fill(cache)
+    assert cache.get_many("instruct", "first", ["a"]) == [0.1]
+    assert cache.get_many("instruct", "second", ["a"]) == [None]
+
+
+def test_fifo_evicts_first_query():
+    cache = RerankScoreCache(MAX_BYTES, EVICT_FIFO)
+    fill(cache)
+    assert cache.get_many("instruct", "first", ["a"]) == [None]
+    assert cache.get_many("instruct", "second", ["a"]) == [0.2]
+
+
+def test_zero_bytes_disables_cache():
+    cache = RerankScoreCache(0)
+    cache.put_many("instruct", "query", ["a"], [0.9])
+    assert cache.get_many("instruct", "query", ["a"]) == [None]
+    assert cache.nbytes == 0
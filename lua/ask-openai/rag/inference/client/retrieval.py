@@ -1,10 +1,19 @@
-from dataclasses import dataclass
+import asyncio
+import heapq
+import time
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import Optional
 
 import attrs
-from inference.client.embedder import encode_query, signal_hotpath_done_in_background
+from config import DEFAULT_RERANK_CACHE_MB
+from config.adaptive_rerank import AdaptiveRerankConfig
+from inference.client.batching import TokenBatch, fixed_size_batches, pack_by_token_budget, padding_ratio
+from inference.client.embedder import encode_queries, signal_hotpath_done_in_background
+from inference.client.rerank_cache import RerankScoreCache
+from inference.comms import estimate_tokens
 from language_server.stoppers import Stopper
-from index.storage import ChunkType, Datasets
+from index.storage import ChunkType, Datasets, RAGDataset
 from inference.client import *
 from index import workspace
 
@@ -36,6 +45,14 @@ class LSPRankedMatch:
 
 FAKE_STOPPER = Stopper("fake")
 
+# LS/MCP reconfigure this from .rag.yaml (see configure_rerank_cache)
+rerank_cache = RerankScoreCache(DEFAULT_RERANK_CACHE_MB * 2**20)
+
+
+def configure_rerank_cache(max_mb: float, eviction: str) -> None:
+    global rerank_cache
+    rerank_cache = RerankScoreCache(int(max_mb * 2**20), eviction)
+
 
 @attrs.define
 class LSPSemanticGrepRequest:
@@ -48,95 +65,211 @@ class LSPSemanticGrepRequest:
     skipSameFile: bool = False
     topK: int = 50
     embedTopK: int | None = None
+    # None => .rag.yaml adaptive_rerank.enabled
+    adaptiveRerank: bool | None = None
     # MAKE SURE TO GIVE DEFAULT VALUES IF NOT REQUIRED
 
 
+
+
+@attrs.define
+class LSPSemanticGrepManyRequest:
+    """ several queries in one round trip (i.e. agent/FIM context for multiple questions), results are per query """
+    queries: list[LSPSemanticGrepRequest] = attrs.field(factory=list)
+    msgId: str = ""
+
+
+@dataclass
+class SemanticGrepResult:
+    matches: list[LSPRankedMatch] = field(default_factory=list)
+    # candidates adaptive rerank didn't rerank (embed order, after reranked matches, rerank_score -1)
+    rerank_skipped: int = 0
+
+
+@dataclass
+class _SearchPlan:
+    """ what one query searches """
+    searched_datasets: dict[str, RAGDataset]
+    # per domain top k (or top k overall w/ global index)
+    top_k: int
+    use_global_index: bool = False
+
+
 async def semantic_grep(
     args: LSPSemanticGrepRequest,
     datasets: Datasets,
     stopper: Stopper = FAKE_STOPPER,
 ) -> list[LSPRankedMatch]:
-    logger.info(f"semantic_grep query: {args}")
-    global_search = args.domains == "GLOBAL"
-    everything_search = args.domains == "EVERYTHING"
+    results = await semantic_grep_many([args], datasets, stopper)
+    return results[0].matches
 
-    rerank_top_k = args.topK
-    embed_top_k = args.embedTopK or args.topK
-    query_embed_top_k = embed_top_k * 3 if args.skipSameFile else embed_top_k
 
-    instruct = args.instruct
-    if instruct is None:
-        # FYI I have noticed instruct can become part of query (not just instructions) so be careful
-        #  => i.e. b/c I had "semantic_grep telescope picker references, I was getting hits for semantic_grep tool (when in ask-openai.nvim repo) when query had nothing to do with finding semantic_grep codes
-        raise ValueError("instruct must be passed, and specific to a given query type")
-    logger.info(f"using instruct: {instruct}")
+async def semantic_grep_many(
+    requests: list[LSPSemanticGrepRequest],
+    datasets: Datasets,
+    stopper: Stopper = FAKE_STOPPER,
+) -> list[SemanticGrepResult]:
+    """ one embed request, one multi-row search per domain, one rerank round (shared connection) for all queries """
+    for args in requests:
+        logger.info(f"semantic_grep query: {args}")
+        if args.instruct is None:
+            # FYI I have noticed instruct can become part of query (not just instructions) so be careful
+            #  => i.e. b/c I had "semantic_grep telescope picker references, I was getting hits for semantic_grep tool (when in ask-openai.nvim repo) when query had nothing to do with finding semantic_grep codes
+            raise ValueError("instruct must be passed, and specific to a given query type")
+        logger.info(f"using instruct: {args.instruct}")
 
     stopper.throw_if_stopped()
-    # * encode query vector
-    with logger.timer("encoding query"):
-        query_vector = await encode_query(args.query, instruct)
+    # * encode query vectors (one batch)
+    with logger.timer(f"encoding {len(requests)} queries"):
+        query_vectors = await encode_queries([(args.query, args.instruct) for args in requests])
         stopper.throw_if_stopped()  # PRN add in cancel/stop logic... won't matter though if the real task isn't cancellable (and just keeps running to completion)
 
     # * search embeddings
-    if global_search or everything_search:
-        scores = []
-        ids = []
-
-        # * top_k_per_domain
-        # crude calculations for splitting top_k... these can and will be changed long-term
-        #   consider just configuring how much per domain in the global_domains config list (make each a configurable object)
-        config = workspace.get_config()
-        filter_global_domains = global_search and config.global_query_domains and len(config.global_query_domains) > 0
-        if filter_global_domains:
-            num_domains = 0
-            for domain in config.global_query_domains:
-                if domain in datasets.all_datasets:
-                    num_domains += 1
-        else:
-            num_domains = len(datasets.all_datasets)
-        if num_domains == 0:
-            message = f"No domains for multi-domain Semantic Grep using: {args.domains=}"
-            logger.error(message)
-            raise Exception(message)
-        top_k_per_domain = max(1, round(1.5 * query_embed_top_k / num_domains))  # over sample each domain by 50%
-        # logger.info(f"{top_k_per_domain=}")
-
-        for domain, ds in datasets.all_datasets.items():
-            if filter_global_domains and domain not in config.global_query_domains:
-                logger.warning(f"skipping dataset for {domain=}")
-                continue
+    # FYI concurrent => lazy domain loads of different queries overlap
+    plans = await asyncio.gather(*(_plan_search(args, datasets) for args in requests))
+    stopper.throw_if_stopped()
+    ranked_by_query = await _search(query_vectors, plans, datasets)
+    stopper.throw_if_stopped()
 
-            logger.info(f"searching dataset for {domain=}")
-            _scores, _ids = ds.index.search(query_vector, top_k_per_domain)
-            scores.extend(_scores[0])
-            ids.extend(_ids[0])
-    else:
+    # * lookup matching chunks (filter any exclusions on metadata)
+    # all ids for all queries in one lookup (vectorized)
+    all_ids = list(dict.fromkeys(id for id_score_pairs in ranked_by_query for id, _ in id_score_pairs))
+    chunk_by_id = dict(zip(all_ids, datasets.get_chunks_by_faiss_ids(all_ids)))
+    matches_by_query = [_matches_for(args, id_score_pairs, chunk_by_id) for args, id_score_pairs in zip(requests, ranked_by_query)]
+
+    # * rerank
+    stopper.throw_if_stopped()
+    skipped_by_query = await _rerank(requests, matches_by_query)
+    stopper.throw_if_stopped()
+
+    results: list[SemanticGrepResult] = []
+    for args, matches, skipped in zip(requests, matches_by_query, skipped_by_query):
+        # * sort score => then mark ranks
+        # FYI stable sort => skipped (rerank_score -1) stay in embed order after reranked matches
+        matches.sort(key=lambda c: c.rerank_score, reverse=True)
+        for idx, c in enumerate(matches):
+            c.rerank_rank = idx
+
+        rerank_top_k = args.topK
+        embed_top_k = args.embedTopK or args.topK
+        if embed_top_k > rerank_top_k:
+            logger.warning(f"{embed_top_k=} > {rerank_top_k=} truncating")
+            matches = matches[:rerank_top_k]
+        results.append(SemanticGrepResult(matches, rerank_skipped=skipped))
+
+    await signal_hotpath_done_in_background()
+
+    return results
+
+
+def _query_embed_top_k(args: LSPSemanticGrepRequest) -> int:
+    embed_top_k = args.embedTopK or args.topK
+    return embed_top_k * 3 if args.skipSameFile else embed_top_k
+
+
+async def _plan_search(args: LSPSemanticGrepRequest, datasets: Datasets) -> _SearchPlan:
+    query_embed_top_k = _query_embed_top_k(args)
+    global_search = args.domains == "GLOBAL"
+    everything_search = args.domains == "EVERYTHING"
+    if not (global_search or everything_search):
         # ? rework to use domains for one domain?
-        dataset = datasets.for_file(args.currentFileAbsolutePath, vim_filetype=args.vimFiletype)
+        dataset = await datasets.load_for_file(args.currentFileAbsolutePath, vim_filetype=args.vimFiletype)
         if dataset is None:
             logger.error(f"No dataset for currentFileAbsolutePath='{args.currentFileAbsolutePath}' and vim_filetype='{args.vimFiletype}'")
 
             # return {"failed": True, "error": f"No dataset for {current_file_abs}"} # TODO return failure?
             raise Exception(f"No dataset for {args.currentFileAbsolutePath}")
+        return _SearchPlan({dataset.domain: dataset}, query_embed_top_k)
+
+    # * top_k_per_domain
+    # crude calculations for splitting top_k... these can and will be changed long-term
+    #   consider just configuring how much per domain in the global_domains config list (make each a configurable object)
+    config = workspace.get_config()
+    filter_global_domains = global_search and config.global_query_domains and len(config.global_query_domains) > 0
+    if filter_global_domains:
+        search_domains = [domain for domain in datasets.domains() if domain in config.global_query_domains]
+    else:
+        search_domains = datasets.domains()
+    num_domains = len(search_domains)
+    if num_domains == 0:
+        message = f"No domains for multi-domain Semantic Grep using: {args.domains=}"
+        logger.error(message)
+        raise Exception(message)
+
+    # * lazy => load any unloaded domains concurrently
+    searched_datasets = await datasets.load_many(search_domains)
+
+    if config.global_index:
+        # one search, exactly the top k across searched domains (no per domain over sampling)
+        return _SearchPlan(searched_datasets, query_embed_top_k, use_global_index=True)
+    return _SearchPlan(searched_datasets, _top_k_per_domain(query_embed_top_k, num_domains))
+
+
+def _top_k_per_domain(query_embed_top_k: int, num_domains: int) -> int:
+    return max(1, round(1.5 * query_embed_top_k / num_domains))  # over sample each domain by 50%
+
+
+async def _search(query_vectors: np.ndarray, plans: list[_SearchPlan], datasets: Datasets) -> list[list[tuple[int, float]]]:
+    """ one multi-row search per domain (rows => queries that search it), returns (id, score) pairs per query sorted by score """
+    # FYI faiss releases the GIL while searching => threads search domains in parallel and the event loop stays free (cancel, didSave)
+    config = workspace.get_config()
+    ranked_by_domain_by_query: list[list[list[tuple[int, float]]]] = [[] for _ in plans]
+
+    async def search_rows(search, label: str, rows: list[int], top_ks: list[int], *search_args):
+        # FYI results are sorted => each query's top k is a prefix of the max top k
+        logger.info(f"searching {label} for {len(rows)} queries")
+        _scores, _ids = await asyncio.to_thread(search, query_vectors[rows], max(top_ks), *search_args)
+        for row_num, (query_num, top_k) in enumerate(zip(rows, top_ks)):
+            ranked_by_domain_by_query[query_num].append(list(zip(_ids[row_num][:top_k], _scores[row_num][:top_k])))
+
+    searches = []
+    rows_by_domains: dict[frozenset[str], list[int]] = {}
+    per_domain_plans = list(plans)
+    global_index = None
+    for query_num, plan in enumerate(plans):
+        if not plan.use_global_index:
+            continue
+        current = datasets.get_global_index(plan.searched_datasets)
+        if current is None:
+            # i.e. still building (in the background) => per domain search, over sampled
+            logger.info("global index not ready, searching per domain")
+            per_domain_plans[query_num] = _SearchPlan(plan.searched_datasets, _top_k_per_domain(plan.top_k, len(plan.searched_datasets)))
+            continue
+        global_index = current
+        rows_by_domains.setdefault(frozenset(plan.searched_datasets), []).append(query_num)
+    for domains, rows in rows_by_domains.items():
+        assert global_index is not None
+        searches.append(search_rows(global_index.search, "global index", rows, [plans[r].top_k for r in rows], domains))
+
+    rows_by_domain: dict[str, list[int]] = {}
+    for query_num, plan in enumerate(per_domain_plans):
+        if plan.use_global_index:
+            continue
+        for domain, ds in plan.searched_datasets.items():
+            if ds.index is None:
+                logger.warning(f"skipping dataset w/o index for {domain=}")
+                continue
+            rows_by_domain.setdefault(domain, []).append(query_num)
+    for domain, rows in rows_by_domain.items():
+        ds = per_domain_plans[rows[0]].searched_datasets[domain]
+        rescore_factor = config.vector_index_for(domain).rescore_factor
+        searches.append(search_rows(ds.search, f"dataset for {domain=}", rows, [per_domain_plans[r].top_k for r in rows], rescore_factor))
 
-        scores, ids = dataset.index.search(query_vector, query_embed_top_k)
-        ids = ids[0]
-        scores = scores[0]
+    await asyncio.gather(*searches)
 
-    logger.info(f"ids len {len(ids)}")
+    # * k-way merge, each domain's results are already sorted by score
+    return [list(heapq.merge(*ranked_by_domain, key=lambda x: x[1], reverse=True)) for ranked_by_domain in ranked_by_domain_by_query]
 
-    # * lookup matching chunks (filter any exclusions on metadata)
-    id_score_pairs = zip(ids, scores)
-    if global_search or everything_search:
-        # IIRC within each domain, the results are sorted by score
-        #   thus need to sort across domains when there are multiple
-        id_score_pairs = sorted(id_score_pairs, key=lambda x: x[1], reverse=True)
+
+def _matches_for(args: LSPSemanticGrepRequest, id_score_pairs: list[tuple[int, float]], chunk_by_id: dict) -> list[LSPRankedMatch]:
+    logger.info(f"ids len {len(id_score_pairs)}")
+    embed_top_k = args.embedTopK or args.topK
 
     matches: list[LSPRankedMatch] = []
     num_embeds = 0
     for idx, (id, embed_score) in enumerate(id_score_pairs):
+        chunk = chunk_by_id[id]
 
-        chunk = datasets.get_chunk_by_faiss_id(id)
         if chunk is None:
             logger.warning("skipping missing chunk for id: %s", id)
             continue
@@ -177,46 +310,130 @@ async def semantic_grep(
 
     if len(matches) == 0:
         logger.warning(f"No matches found for {args.currentFileAbsolutePath=}")
+    return matches
 
-    # * sort len(chunk.text)
-    # so similar lengths are batched together given longest text (in tokens) dictates sequence length
-    matches.sort(key=lambda c: len(c.text))
-
-    def rerank_document(chunk: LSPRankedMatch):
-        file = workspace.get_relative_path_to(chunk.file)
-        start_line_base1 = chunk.start_line_base0 + 1
-        end_line_base1 = chunk.end_line_base0 + 1
-        # example:   [file: utils.py | lines 120–145]\n...
-        return f"[ file: {file} | lines {start_line_base1}-{end_line_base1} ]\n" + chunk.text
-
-    # * rerank batches
-    BATCH_SIZE = 8
-    for batch_num in range(0, len(matches), BATCH_SIZE):
-        stopper.throw_if_stopped()
-        batch = matches[batch_num:batch_num + BATCH_SIZE]
-        docs = [rerank_document(c) for c in batch]
-        logger.info(f"{args.msgId} re-rank batch {batch_num} len={len(batch)}")
-
-        async with AsyncInferenceClient() as client:
-            request = RerankRequest(instruct=instruct, query=args.query, docs=docs)
+
+def rerank_document(chunk: LSPRankedMatch):
+    file = workspace.get_relative_path_to(chunk.file)
+    start_line_base1 = chunk.start_line_base0 + 1
+    end_line_base1 = chunk.end_line_base0 + 1
+    # example:   [file: utils.py | lines 120–145]\n...
+    return f"[ file: {file} | lines {start_line_base1}-{end_line_base1} ]\n" + chunk.text
+
+
+def _adaptive_rerank_for(args: LSPSemanticGrepRequest) -> Optional[AdaptiveRerankConfig]:
+    config = workspace.get_config().adaptive_rerank
+    enabled = config.enabled if args.adaptiveRerank is None else args.adaptiveRerank
+    return config if enabled else None
+
+
+def _stop_reranking(config: AdaptiveRerankConfig, top_k: int, reranked: list[LSPRankedMatch], best_remaining: LSPRankedMatch, elapsed_ms: float) -> bool:
+    """ True => rest of the candidates (embed order) are unlikely to make the rerank top k """
+    if config.budget_ms is not None and elapsed_ms >= config.budget_ms:
+        logger.info(f"adaptive rerank: {elapsed_ms:.0f} ms >= budget {config.budget_ms} ms")
+        return True
+    rerank_top = sorted(reranked, key=lambda c: c.rerank_score, reverse=True)[:top_k]
+    weakest_embed_score = min(c.embed_score for c in rerank_top)
+    if config.embed_gap is not None and best_remaining.embed_score < weakest_embed_score - config.embed_gap:
+        logger.info(f"adaptive rerank: next embed score {best_remaining.embed_score:.3f} < {weakest_embed_score:.3f} - gap {config.embed_gap}")
+        return True
+    if config.embed_ratio is not None and best_remaining.embed_score < weakest_embed_score * config.embed_ratio:
+        logger.info(f"adaptive rerank: next embed score {best_remaining.embed_score:.3f} < {weakest_embed_score:.3f} * ratio {config.embed_ratio}")
+        return True
+    return False
+
+
+async def _rerank(requests: list[LSPSemanticGrepRequest], matches_by_query: list[list[LSPRankedMatch]]) -> list[int]:
+    """ returns number of candidates skipped per query (adaptive rerank), skipped matches keep rerank_score -1
+
+    adaptive queries are reranked in waves (embed order), others all at once in the first wave
+      each wave reranks every query's next candidates together (shared batching)
+    """
+    adaptive_configs = [_adaptive_rerank_for(args) for args in requests]
+    # FYI matches are in embed order (best first)
+    pending = [list(matches) for matches in matches_by_query]
+    reranked: list[list[LSPRankedMatch]] = [[] for _ in requests]
+    skipped = [0] * len(requests)
+
+    start = time.perf_counter()
+    while True:
+        query_nums = [num for num in range(len(requests)) if pending[num]]
+        if not query_nums:
+            break
+
+        waves: list[list[LSPRankedMatch]] = []
+        for num in query_nums:
+            config = adaptive_configs[num]
+            wave_size = config.wave_size if config is not None else len(pending[num])
+            waves.append(pending[num][:wave_size])
+            pending[num] = pending[num][wave_size:]
+        await _rerank_matches([requests[num] for num in query_nums], waves)
+
+        for num, wave in zip(query_nums, waves):
+            reranked[num].extend(wave)
+            config = adaptive_configs[num]
+            if config is None or not pending[num]:
+                continue
+            if _stop_reranking(config, requests[num].topK, reranked[num], pending[num][0], (time.perf_counter() - start) * 1000):
+                skipped[num] = len(pending[num])
+                logger.info(f"{requests[num].msgId} adaptive rerank: skipped {skipped[num]} of {len(matches_by_query[num])} candidates")
+                pending[num] = []
+    return skipped
+
+
+async def _rerank_matches(requests: list[LSPSemanticGrepRequest], matches_by_query: list[list[LSPRankedMatch]]):
+    """ sets rerank_score on every match, each (instruct, query, chunk) is scored at most once across all requests """
+    # * cached rerank scores (same query re-run w/ bigger topK, toggled skipSameFile...)
+    #   then dedupe: the same chunk matched by the same (instruct, query) twice (i.e. different domains/options) => reranked once
+    uncached_by_query: dict[tuple[str, str], dict[str, list[LSPRankedMatch]]] = {}
+    for args, matches in zip(requests, matches_by_query):
+        cached_scores = rerank_cache.get_many(args.instruct, args.query, [c.id for c in matches])
+        uncached = uncached_by_query.setdefault((args.instruct, args.query), {})
+        for c, cached_score in zip(matches, cached_scores):
+            if cached_score is not None:
+                c.rerank_score = cached_score
+            else:
+                uncached.setdefault(c.id, []).append(c)
+
+    if not any(uncached_by_query.values()):
+        return
+
+    async with AsyncInferenceClient() as client:
+        limits = await client.rerank_limits()
+
+        # * rerank batches, packed by (estimated) tokens up to the server's budget
+        # longest text in a batch dictates sequence length => pack_by_token_budget sorts by length so similar lengths share a batch
+        #   i.e. eight 400 line chunks no longer risk OOM, dozens of 3 line chunks go in one request
+        batches: list[tuple[str, str, list[list[LSPRankedMatch]], TokenBatch]] = []
+        doc_by_id: dict[str, str] = {}
+        for (instruct, query), uncached in uncached_by_query.items():
+            same_chunks = list(uncached.values())
+            docs = [doc_by_id.setdefault(same_chunk[0].id, rerank_document(same_chunk[0])) for same_chunk in same_chunks]
+            # w/o the server's prefix cache, every doc in the batch is prefixed w/ instruct + query
+            prefix_tokens = estimate_tokens(instruct + query)
+            token_counts = [prefix_tokens + estimate_tokens(doc) for doc in docs]
+            token_batches = pack_by_token_budget(token_counts, limits.token_budget, limits.max_batch_size)
+            batches.extend((instruct, query, [same_chunks[i] for i in token_batch.indexes], token_batch) for token_batch in token_batches)
+
+            if logger.isEnabledForInfo() and len(token_counts) > 1:
+                # vs fixed batches of 8 (sorted by length), what this used to send
+                fixed_padding = padding_ratio(fixed_size_batches(sorted(token_counts), DEFAULT_RERANK_MAX_BATCH_SIZE))
+                packed_padding = padding_ratio(token_batches)
+                logger.info(f"{requests[0].msgId} re-rank {len(docs)} docs => {len(token_batches)} batches (budget {limits.token_budget} tokens, max {limits.max_batch_size} docs), padding {fixed_padding:.1%} (fixed {DEFAULT_RERANK_MAX_BATCH_SIZE}) => {packed_padding:.1%} (token budget)")
+
+        async def rerank_batch(batch_num: int, instruct: str, query: str, batch: list[list[LSPRankedMatch]], token_batch: TokenBatch):
+            docs = [doc_by_id[same_chunk[0].id] for same_chunk in batch]
+            logger.info(f"{requests[0].msgId} re-rank batch {batch_num} len={len(batch)} ~{token_batch.actual_tokens} tokens, ~{token_batch.padded_tokens} padded ({padding_ratio([token_batch]):.1%} padding)")
+            request = RerankRequest(instruct=instruct, query=query, docs=docs)
             scores = await client.rerank(request)
-            if not scores:
+            if len(scores) == 0:
                 raise Exception("rerank returned no scores")
             # assign new scores back to objects
-            for c, rerank_score in zip(batch, scores):
-                c.rerank_score = rerank_score
-
-    stopper.throw_if_stopped()
-
-    # * sort score => then mark ranks
-    matches.sort(key=lambda c: c.rerank_score, reverse=True)
-    for idx, c in enumerate(matches):
-        c.rerank_rank = idx
-
-    if embed_top_k > rerank_top_k:
-        logger.warning(f"{embed_top_k=} > {rerank_top_k=} truncating")
-        matches = matches[:rerank_top_k]
-
-    await signal_hotpath_done_in_background()
-
-    return matches
+            for same_chunk, rerank_score in zip(batch, scores):
+                for c in same_chunk:
+                    c.rerank_score = rerank_score.item()  # numpy.float32 not serializable, use .item()
+            rerank_cache.put_many(instruct, query, [same_chunk[0].id for same_chunk in batch], [same_chunk[0].rerank_score for same_chunk in batch])
+
+        # all batches (all queries) in flight at once (multiplexed on one connection), server queues them => no round trip gap between batches
+        # FYI if this task is cancelled (LS cancel), gather cancels each request => server drops any still queued
+        await asyncio.gather(*(rerank_batch(batch_num, *batch) for batch_num, batch in enumerate(batches)))
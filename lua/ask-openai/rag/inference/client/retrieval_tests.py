@@ -0,0 +1,235 @@
+import asyncio
+
+import faiss
+import numpy as np
+import pytest
+
+from config import RagConfig
+from config.adaptive_rerank import AdaptiveRerankConfig, parse_adaptive_rerank_config
+from config.vector_index import VectorIndexConfig
+from index import workspace
+from index.storage import Datasets, RAGDataset
+from index.testing import chunk_for
+from index.vector_index import build_index
+from inference.client import RerankLimits, retrieval
+from inference.client.rerank_cache import RerankScoreCache
+from inference.client.retrieval import LSPSemanticGrepRequest, semantic_grep, semantic_grep_many
+
+DIMENSIONS = 8
+
+
+class FakeRerankClient:
+    """ scores each doc by its text length (deterministic), records every doc it was sent """
+
+    def __init__(self, limits: RerankLimits = RerankLimits()):
+        self.reranked: list[str] = []
+        self.batch_sizes: list[int] = []
+        self.limits = limits
+
+    async def rerank_limits(self) -> RerankLimits:
+        return self.limits
+
+    async def rerank(self, request) -> np.ndarray:
+        self.reranked.extend(request.docs)
+        self.batch_sizes.append(len(request.docs))
+        return np.array([len(doc) for doc in request.docs], dtype=np.float32)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        pass
+
+
+@pytest.fixture
+def rerank_client(monkeypatch, tmp_path):
+    monkeypatch.setattr(workspace.project, "folder", tmp_path)
+    client = FakeRerankClient()
+    monkeypatch.setattr(retrieval, "AsyncInferenceClient", lambda: client)
+    monkeypatch.setattr(retrieval, "rerank_cache", RerankScoreCache(2**20))
+
+    async def fake_encode_queries(queries):
+        return np.concatenate([np.random.default_rng(len(query)).standard_normal((1, DIMENSIONS)) for query, _ in queries]).astype(np.float32)
+
+    async def noop():
+        pass
+
+    monkeypatch.setattr(retrieval, "encode_queries", fake_encode_queries)
+    monkeypatch.setattr(retrieval, "signal_hotpath_done_in_background", noop)
+    return client
+
+
+def dataset_for(domain: str, num_chunks: int) -> RAGDataset:
+    file = f"/repo/{domain}.txt"
+    chunks = [chunk_for(f"{domain} chunk {i}" + "." * i, file) for i in range(num_chunks)]
+    vecs = np.random.default_rng(len(domain)).standard_normal((num_chunks, DIMENSIONS)).astype(np.float32)
+    faiss.normalize_L2(vecs)
+    ids = np.array([c.faiss_id for c in chunks], dtype=np.int64)
+    return RAGDataset(domain, {file: chunks}, {}, build_index(vecs, ids, VectorIndexConfig()))
+
+
+@pytest.fixture
+def datasets() -> Datasets:
+    return Datasets({"lua": dataset_for("lua", 20), "python": dataset_for("python", 20)})
+
+
+def request_for(top_k: int, query: str = "where is foo", **kwargs) -> LSPSemanticGrepRequest:
+    return LSPSemanticGrepRequest(query=query, instruct="find foo", domains="EVERYTHING", topK=top_k, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_matches_are_sorted_by_rerank_score(rerank_client, datasets):
+    matches = await semantic_grep(request_for(top_k=10), datasets)
+
+    assert len(matches) == 10
+    assert [m.rerank_rank for m in matches] == list(range(10))
+    assert all(a.rerank_score >= b.rerank_score for a, b in zip(matches, matches[1:]))
+
+
+@pytest.mark.asyncio
+async def test_rerun_only_reranks_new_candidates(rerank_client, datasets):
+    first = await semantic_grep(request_for(top_k=5), datasets)
+    num_reranked = len(rerank_client.reranked)
+    assert num_reranked == 5
+
+    bigger = await semantic_grep(request_for(top_k=15), datasets)
+
+    assert len(rerank_client.reranked) - num_reranked == 10
+    scores = {m.id: m.rerank_score for m in bigger}
+    assert all(scores[m.id] == m.rerank_score for m in first)
+
+
+@pytest.mark.asyncio
+async def test_many_queries_search_each_domain_once_and_match_single_queries(rerank_client, datasets, monkeypatch):
+    requests = [
+        request_for(top_k=5),
+        request_for(top_k=8, query="bar"),
+        request_for(top_k=3, query="baz", currentFileAbsolutePath="/repo/lua.txt", skipSameFile=True),
+    ]
+    singles = [await semantic_grep(request_for(args.topK, args.query, currentFileAbsolutePath=args.currentFileAbsolutePath, skipSameFile=args.skipSameFile), datasets) for args in requests]
+    search_calls = []
+    for ds in datasets.all_datasets.values():
+        monkeypatch.setattr(ds, "search", lambda q, *args, _search=ds.search: search_calls.append(len(q)) or _search(q, *args))
+
+    results = [result.matches for result in await semantic_grep_many(requests, datasets)]
+
+    assert search_calls == [3, 3]  # one search per domain, one row per query
+    assert [[m.id for m in matches] for matches in results] == [[m.id for m in matches] for matches in singles]
+    assert all(m.file != "/repo/lua.txt" for m in results[2])
+
+
+@pytest.mark.asyncio
+async def test_many_queries_plan_searches_concurrently(rerank_client, datasets, monkeypatch):
+    # i.e. each query lazy loads a different domain => loads overlap
+    in_flight, max_in_flight = 0, 0
+    plan_search = retrieval._plan_search
+
+    async def slow_plan_search(args, datasets):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return await plan_search(args, datasets)
+
+    monkeypatch.setattr(retrieval, "_plan_search", slow_plan_search)
+
+    results = await semantic_grep_many([request_for(top_k=5), request_for(top_k=8, query="bar")], datasets)
+
+    assert max_in_flight == 2
+    assert [len(result.matches) for result in results] == [5, 8]
+
+
+@pytest.mark.asyncio
+async def test_many_queries_rerank_each_chunk_once_per_query(rerank_client, datasets):
+    # same query twice (i.e. w/ different options) => shared candidates reranked once
+    results = [result.matches for result in await semantic_grep_many([request_for(top_k=5), request_for(top_k=10)], datasets)]
+
+    assert len(rerank_client.reranked) == len(set(rerank_client.reranked)) == 10
+    assert {m.id for m in results[0]} <= {m.id for m in results[1]}
+
+
+@pytest.mark.asyncio
+async def test_many_queries_share_one_global_index_search(rerank_client, datasets, monkeypatch):
+    monkeypatch.setattr(workspace.project, "config", RagConfig(global_index=True))
+    requests = [request_for(top_k=5), request_for(top_k=8, query="bar")]
+    global_index = await datasets.sync_global_index()
+    searches = []
+    monkeypatch.setattr(global_index, "search", lambda q, *args, _search=global_index.search: searches.append(len(q)) or _search(q, *args))
+
+    results = [result.matches for result in await semantic_grep_many(requests, datasets)]
+
+    assert searches == [2]
+    assert [len(matches) for matches in results] == [5, 8]
+    _, exact = global_index.search(np.concatenate([np.random.default_rng(len(r.query)).standard_normal((1, DIMENSIONS)) for r in requests]).astype(np.float32), 8, datasets.all_datasets)
+    assert {m.id_int for m in results[0]} == {str(id) for id in exact[0][:5]}
+
+
+@pytest.mark.asyncio
+async def test_rerank_batches_are_packed_by_token_budget(rerank_client, datasets):
+    rerank_client.limits = RerankLimits(token_budget=50, max_batch_size=8)
+
+    matches = await semantic_grep(request_for(top_k=10), datasets)
+
+    assert len(matches) == 10
+    assert sum(rerank_client.batch_sizes) == 10
+    # ~20 tokens per doc (w/ instruct + query prefix) => 2 per batch, max_batch_size doesn't bind
+    assert rerank_client.batch_sizes == [2] * 5
+
+
+@pytest.mark.asyncio
+async def test_adaptive_rerank_skips_low_similarity_tail(rerank_client, datasets, monkeypatch):
+    # gap 0 => stop as soon as the next candidate's embed score is below the weakest in the rerank top k
+    monkeypatch.setattr(workspace.project, "config", RagConfig(adaptive_rerank=AdaptiveRerankConfig(enabled=True, embed_gap=0.0, wave_size=4)))
+
+    result = (await semantic_grep_many([request_for(top_k=4, embedTopK=20)], datasets))[0]
+
+    assert result.rerank_skipped == 16
+    assert len(rerank_client.reranked) == 4
+    assert len(result.matches) == 4
+    assert all(m.rerank_score >= 0 for m in result.matches)
+
+
+@pytest.mark.asyncio
+async def test_adaptive_rerank_keeps_skipped_candidates_in_embed_order(rerank_client, datasets, monkeypatch):
+    monkeypatch.setattr(workspace.project, "config", RagConfig(adaptive_rerank=AdaptiveRerankConfig(enabled=True, embed_gap=0.0, wave_size=4)))
+
+    result = (await semantic_grep_many([request_for(top_k=10, embedTopK=20)], datasets))[0]
+
+    assert len(result.matches) == 10
+    reranked, skipped = result.matches[:4], result.matches[4:]
+    assert all(m.rerank_score >= 0 for m in reranked)
+    assert all(m.rerank_score == -1 for m in skipped)
+    assert all(a.embed_score >= b.embed_score for a, b in zip(skipped, skipped[1:]))
+
+
+@pytest.mark.asyncio
+async def test_request_overrides_adaptive_rerank_config(rerank_client, datasets, monkeypatch):
+    monkeypatch.setattr(workspace.project, "config", RagConfig(adaptive_rerank=AdaptiveRerankConfig(enabled=True, embed_gap=0.0, wave_size=4)))
+
+    result = (await semantic_grep_many([request_for(top_k=4, embedTopK=20, adaptiveRerank=False)], datasets))[0]
+
+    assert result.rerank_skipped == 0
+    assert len(rerank_client.reranked) == 20
+
+
+def test_parse_adaptive_rerank_config_validates():
+    assert parse_adaptive_rerank_config({"enabled": True, "budget_ms": 150}) == AdaptiveRerankConfig(enabled=True, budget_ms=150)
+    with pytest.raises(ValueError):
+        parse_adaptive_rerank_config({"embed_ratio": 1.5})
+    with pytest.raises(ValueError):
+        parse_adaptive_rerank_config({"wave": 4})
+
+
+@pytest.mark.asyncio
+async def test_searches_per_domain_until_global_index_is_built(rerank_client, datasets, monkeypatch):
+    monkeypatch.setattr(workspace.project, "config", RagConfig(global_index=True))
+    search_calls = []
+    for ds in datasets.all_datasets.values():
+        monkeypatch.setattr(ds, "search", lambda q, top_k, *args, _search=ds.search: search_calls.append(top_k) or _search(q, top_k, *args))
+
+    matches = await semantic_grep(request_for(top_k=10), datasets)
+
+    assert len(matches) == 10
+    assert search_calls == [8, 8]  # over sampled per domain, same as w/o global index
+    assert await datasets.sync_global_index() is not None
@@ -1,7 +1,9 @@
 from asyncio import StreamReader, StreamWriter
+import math
 import socket
 from typing import Any
 import msgpack
+import numpy as np
 import struct
 
 from logs import get_logger
@@ -38,8 +40,66 @@ def send_len_then_msg(conn: socket.socket, msg: dict[str, Any]):
     msg_len_packed = struct.pack('!I', msg_len)  # 4-byte network byte order
     conn.sendall(msg_len_packed + msg_packed)
 
+# * priority lanes
+# 'priority' in the request => server drains high lane before every bulk batch
+#   i.e. semantic_grep from nvim doesn't wait behind re-embedding thousands of chunks after a git checkout
+PRIORITY_HIGH = "high"  # interactive: query embeds, reranks
+PRIORITY_BULK = "bulk"  # indexing: passage embeds
+PRIORITIES = (PRIORITY_HIGH, PRIORITY_BULK)  # drain order
+
+# * token estimates
+# shared by client (batch packing) and server (scheduler batch budget) => same units on both ends
+#   no tokenizer client side (it lives w/ the model on the inference server)
+#   ~4 chars per token is a decent estimate for code w/ Qwen3's BPE vocab
+#   only used to group similar lengths and to size batches, so close enough is fine
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    return max(1, math.ceil(len(text) / CHARS_PER_TOKEN))
+
+# * binary ndarray payloads
+# vs nested lists: no per float python object on either end + 4 bytes per float (f32) instead of 9 (msgpack float64)
+#   client requests it w/ 'wire_dtype' => server w/o support ignores it and sends lists, decode_ndarray handles both
+#   f16 halves it again (fine for normalized vectors, ~3 significant digits)
+WIRE_DTYPES = {
+    'f32': '<f4',
+    'f16': '<f2',
+}
+
+def encode_ndarray(array, wire_dtype: str) -> dict[str, Any]:
+    dtype = np.dtype(WIRE_DTYPES[wire_dtype])  # explicit little-endian, regardless of host
+    array = np.ascontiguousarray(array, dtype=dtype)
+    return {'dtype': dtype.str, 'shape': list(array.shape), 'data': array.tobytes()}
+
+def decode_ndarray(payload: dict[str, Any] | list) -> np.ndarray:
+    """ zero-copy view over the received bytes (read-only) """
+    if isinstance(payload, dict):
+        return np.frombuffer(payload['data'], dtype=np.dtype(payload['dtype'])).reshape(payload['shape'])
+    # nested lists, i.e. server w/o binary support
+    return np.asarray(payload, dtype=np.float32)
+
 # *** ASYNC:
 
+def enable_keepalive(writer: StreamWriter):
+    # FYI used by both ends now that connections are long-lived (pooled client side)
+    #   => detect dead peers (i.e. server restarted, laptop slept) instead of hanging on a zombie connection
+    # for py3.12 and older, keep alive must be set on socket level
+    sock = writer.get_extra_info("socket")
+    if sock is None:
+        raise Exception("Failed to get socket to set keep alive, aborting")
+
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # FYI socket options: https://www.man7.org/linux/man-pages/man7/socket.7.html
+
+    try:
+        # TODO research what values I should use here... mostly suggested to me and not yet vetted
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 30)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 10)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+    except AttributeError as e:
+        # i.e. TCP_KEEPIDLE is not defined on macOS (TCP_KEEPALIVE is the equivalent there)
+        logger.warning(f"Failed to set KEEP ALIVE socket options, will try to set on transport level {e}")
+
 async def _recv_exact_async(reader: StreamReader, content_size) -> bytes | None:
     # does readexactly result in CancelledError bubbling up due to internal awaits?
     # PRN? timeout?
@@ -61,10 +121,17 @@ async def recv_len_then_msg_async(reader: StreamReader) -> dict[str, Any] | None
         return None
     return msgpack.unpackb(msg_packed, raw=False)
 
+# * multiplexing
+# requests carry an 'id' (int, unique per connection), responses echo it back
+#   => many requests in flight on one connection, responses can arrive out of order
+#   requests w/o an 'id' are handled one at a time (in order) like before
+# {'type': 'cancel', 'id': N} => server drops request N if it hasn't started yet (no response)
+
 async def send_len_then_msg_async(writer: StreamWriter, msg: dict[str, Any]):
     msg_packed = msgpack.packb(msg, use_bin_type=True)
     msg_len = len(msg_packed)
     msg_len_packed = struct.pack('!I', msg_len)  # 4-byte network byte order
     # conn.sendall(msg_len_packed + msg_packed)
+    # FYI single write() per frame => concurrent senders on one writer never interleave frames
     writer.write(msg_len_packed + msg_packed)
     await writer.drain()  # TODO right way to wait?
@@ -0,0 +1,59 @@
+import msgpack
+import numpy as np
+import pytest
+
+from inference.comms import decode_ndarray, encode_ndarray, estimate_tokens
+
+
+def round_trip(payload):
+    # same options as send/recv_len_then_msg
+    return msgpack.unpackb(msgpack.packb(payload, use_bin_type=True), raw=False)
+
+
+def test_f32_round_trips_exactly():
+    vecs = np.random.default_rng(0).standard_normal((3, 1024)).astype(np.float32)
+
+    decoded = decode_ndarray(round_trip(encode_ndarray(vecs, "f32")))
+
+    assert decoded.dtype == np.float32
+    assert decoded.shape == (3, 1024)
+    np.testing.assert_array_equal(decoded, vecs)
+
+
+def test_f32_payload_is_4_bytes_per_float_vs_lists():
+    vecs = np.random.default_rng(0).standard_normal((8, 1024)).astype(np.float32)
+
+    binary = msgpack.packb(encode_ndarray(vecs, "f32"), use_bin_type=True)
+    lists = msgpack.packb(vecs.tolist(), use_bin_type=True)
+
+    assert len(binary) < 8 * 1024 * 4 + 100
+    assert len(binary) * 2 < len(lists)
+
+
+def test_f16_halves_payload_within_precision():
+    vecs = np.random.default_rng(0).uniform(-1, 1, (2, 16)).astype(np.float32)
+
+    payload = encode_ndarray(vecs, "f16")
+    decoded = decode_ndarray(round_trip(payload))
+
+    assert len(payload['data']) == 2 * 16 * 2
+    assert decoded.dtype == np.float16
+    np.testing.assert_allclose(decoded, vecs, atol=1e-3)
+
+
+def test_decode_accepts_nested_lists_from_older_servers():
+    decoded = decode_ndarray([[1.0, 2.0], [3.0, 4.0]])
+
+    assert decoded.dtype == np.float32
+    np.testing.assert_array_equal(decoded, [[1.0, 2.0], [3.0, 4.0]])
+
+
+def test_unknown_wire_dtype_raises():
+    with pytest.raises(KeyError):
+        encode_ndarray([1.0], "f64")
+
+
+def test_estimate_tokens_never_zero():
+    assert estimate_tokens("") == 1
+    assert estimate_tokens("abcd") == 1
+    assert estimate_tokens("abcde") == 2
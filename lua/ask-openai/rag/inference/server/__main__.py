@@ -6,6 +6,7 @@ print('imports starting...')
 
 import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
 import rich
 import signal
 import socket
@@ -20,7 +21,8 @@ from inference.server import qwen3_rerank
 qwen3_embeddings.dump_device_memory_stats("after rerank")
 
 from logs import Timer, get_logger, logging_fwk_to_console, print_code
-from inference.comms import recv_len_then_msg_async, send_len_then_msg_async
+from inference.server.scheduler import RERANK_MAX_BATCH_SIZE, RERANK_TOKEN_BUDGET, InferenceScheduler
+from inference.comms import PRIORITY_BULK, PRIORITY_HIGH, enable_keepalive, encode_ndarray, recv_len_then_msg_async, send_len_then_msg_async
 
 print('imports done')
 
@@ -90,28 +92,22 @@ def dump_token_details(input_ids, input_texts):
     # if logger.isEnabledFor(logging.DEBUG):
     #     logger.debug(f"  input_ids={input_ids}")
 
-def enable_keepalive(writer: asyncio.StreamWriter):
-    # for py3.12 and older, keep alive must be set on socket level
-    sock = writer.get_extra_info("socket")
-    if sock is None:
-        raise Exception("Failed to get socket to set keep alive, aborting")
-
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-    # FYI socket options: https://www.man7.org/linux/man-pages/man7/socket.7.html
-
-    try:
-        # TODO research what values I should use here... mostly suggested to me and not yet vetted
-        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 30)
-        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 10)
-        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
-    except AttributeError as e:
-        logger.warning(f"Failed to set KEEP ALIVE socket options, will try to set on transport level {e}")
-
 async def disconnect(writer):
     writer.close()
     await writer.wait_closed()
 
-async def hotpath_done():
+# * inference queue
+# ONE thread runs the models => requests are queued and run one at a time (no contention for GPU)
+#   meanwhile the event loop keeps reading requests (and cancels) off of every connection
+#   cancelling a request that is still queued means it never runs
+inference_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+
+# ALL model work goes through the scheduler:
+# - concurrent embed requests (LS, MCP server, indexer) are micro-batched into one model call
+# - priority lanes => high (queries, reranks) drains before each bulk (indexing) batch
+scheduler = InferenceScheduler(qwen3_embeddings.encode, inference_executor)
+
+def _hotpath_done():
     # FYI put notes in todos.md
 
     # await asyncio.sleep(3) # test if client blocked
@@ -122,24 +118,96 @@ async def hotpath_done():
     rich.print("[yellow bold]hotpath done - clearing caches...")
     qwen3_embeddings.dump_device_memory_stats("before hotpath_done")
 
+    # prefix KV is only reused within a semantic_grep call, which signals hotpath_done when it finishes
+    qwen3_rerank.clear_prefix_cache()
     torch.cuda.empty_cache()
     gc.collect()
     torch.cuda.reset_peak_memory_stats()
 
     qwen3_embeddings.dump_device_memory_stats("after hotpath_done")
 
+def hotpath_done():
+    # on inference thread => queued behind in-flight requests instead of racing them
+    #   bulk => after any interactive work
+    # FYI submit, don't await => the read loop would stall (incl. high lane requests) until the bulk lane drains
+    scheduler.submit(_hotpath_done, priority=PRIORITY_BULK)
+
+# open connections, so shutdown can close them (long-lived now, clients pool them)
+open_writers: set[asyncio.StreamWriter] = set()
+
 async def on_client_connected(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
     logger.info("client connected")
-    # PRN consider longer lived (i.e. all request batches for one round of semantic_grep)
+    # FYI connections are long-lived => serve requests until the client hangs up
+    #   requests w/ an id run concurrently (task per request) and respond whenever done (out of order)
 
     enable_keepalive(writer)
+    open_writers.add(writer)
+    tasks_by_id: dict[int, asyncio.Task] = {}
 
-    # TODO pass timeout values to read/drain?
-    request = await recv_len_then_msg_async(reader)
-    if request is None:
-        logger.warning("empty request, disconnecting")
-        return await disconnect(writer)
-
+    try:
+        while True:
+            try:
+                # TODO pass timeout values to read/drain?
+                request = await recv_len_then_msg_async(reader)
+            except asyncio.IncompleteReadError:
+                logger.info("client disconnected")
+                break
+            if request is None:
+                logger.warning("empty request, disconnecting")
+                break
+
+            request_id = request.get('id')
+            if request['type'] == 'cancel':
+                task = tasks_by_id.get(request_id)
+                if task is not None:
+                    logger.info(f"cancelling request {request_id}")
+                    task.cancel()
+                continue
+
+            if request_id is None:
+                # no id => in order, one at a time
+                keep_open = await handle_request(request, writer)
+                if not keep_open:
+                    break
+                continue
+
+            task = asyncio.create_task(handle_request_with_id(request, writer))
+            tasks_by_id[request_id] = task
+            task.add_done_callback(lambda _, request_id=request_id: tasks_by_id.pop(request_id, None))
+    except ConnectionError as e:
+        logger.info(f"client connection error: {e!r}")
+    finally:
+        # nobody left to respond to
+        for task in tasks_by_id.values():
+            task.cancel()
+        open_writers.discard(writer)
+        await disconnect(writer)
+
+def encode_array(array, request: dict):
+    wire_dtype = request.get('wire_dtype')
+    if wire_dtype is None:
+        # client w/o binary support
+        return array.tolist()
+    return encode_ndarray(array, wire_dtype)
+
+async def handle_request_with_id(request: dict, writer: asyncio.StreamWriter):
+    # FYI client awaits a Future per id => ALWAYS respond, even on failure, else it waits forever
+    request_id = request['id']
+    try:
+        handled = await handle_request(request, writer)
+        if not handled:
+            await send_len_then_msg_async(writer, {'id': request_id, 'error': f"unsupported type={request['type']}"})
+    except asyncio.CancelledError:
+        logger.info(f"request {request_id} cancelled")
+        raise
+    except ConnectionError:
+        raise  # client is gone
+    except Exception as e:
+        logger.exception(f"request {request_id} failed")
+        await send_len_then_msg_async(writer, {'id': request_id, 'error': repr(e)})
+
+async def handle_request(request: dict, writer: asyncio.StreamWriter) -> bool:
+    """ returns False to close the connection """
     request_type = request['type']
 
     def after_send():
@@ -152,10 +220,9 @@ async def on_client_connected(reader: asyncio.StreamReader, writer: asyncio.Stre
         #   add error message to response
         if request_type == 'embed':
             texts = request['texts']
-            # PRN async encode?... really all I want async for is in the LSP to cancel pending buf_requests... this server side was just practice for asyncifying socket
-            embeddings, input_ids = qwen3_embeddings.encode(texts)
+            embeddings, input_ids = await scheduler.embed(texts, request.get('priority', PRIORITY_HIGH))
             token_count_since_restart += sum(len(seq) for seq in input_ids)
-            response = {'embeddings': embeddings.tolist()}
+            response = {'embeddings': encode_array(embeddings, request)}
 
             def after_send():
                 num_sequences = len(input_ids)
@@ -168,10 +235,9 @@ async def on_client_connected(reader: asyncio.StreamReader, writer: asyncio.Stre
             instruct: str = request['instruct']
             query: str = request['query']
             docs: list[str] = request['docs']
-            # PRN async rerank?
-            scores, input_ids = qwen3_rerank.rerank(instruct, query, docs)
+            scores, input_ids = await scheduler.call(qwen3_rerank.rerank, instruct, query, docs, priority=request.get('priority', PRIORITY_HIGH))
             token_count_since_restart += sum(len(seq) for seq in input_ids)
-            response = {'scores': scores}
+            response = {'scores': encode_array(scores, request)}
 
             def after_send():
                 num_docs = len(docs)
@@ -179,24 +245,29 @@ async def on_client_connected(reader: asyncio.StreamReader, writer: asyncio.Stre
                 rich.print(f"[blue]re-ranked {num_docs} docs of {num_tokens=} tokens in {colorful_ms(operation_elapsed_ms)} ms")
                 qwen3_embeddings.dump_device_memory_stats()  # FYI shows for devices (not model specific), so assuming I am hitting the same current_device then I should be fine to cover everything
 
+        elif request_type == 'limits':
+            # clients size requests w/ these (i.e. rerank batches)
+            response = {'rerank_token_budget': RERANK_TOKEN_BUDGET, 'rerank_max_batch_size': RERANK_MAX_BATCH_SIZE}
+
         elif request_type == "hotpath_done":
             # no response
-            await disconnect(writer)
-            await hotpath_done()  # TODO is this blocking client still?
-            return
+            hotpath_done()
+            return True
 
         else:
             logger.error(f'unsupported {request_type=}')
-            return await disconnect(writer)
+            return False
 
         # PRN combine encode and rerank! do batches of both! and can abort between too
 
     operation_elapsed_ms = encode_timer.elapsed_ms()
 
+    if 'id' in request:
+        response['id'] = request['id']
     await send_len_then_msg_async(writer, response)
-    await disconnect(writer)
 
     after_send()
+    return True
 
 async def main():
 
@@ -216,7 +287,7 @@ async def main():
 
         # py 3.13 has new arg but how about just set it socket level so you don't have to change if you change py version?
         # keep_alive=True  # since connections are long-lived from LSP, this can help with zombie client connections (close them down when heartbeat fails)
-        #   will help when I move to long-lived connections across requests where it's not just one request/response per connection
+        #   FYI set per connection in on_client_connected
     )
 
     if not qwen3_embeddings.enable_memory_logs:
@@ -240,10 +311,14 @@ async def main():
     async with server:
         await stop.wait()
 
-        # PRN cancel/close open connections to shutdown.. with short lived, connection per request, this is not as important
         # PRN does async context manager call close when leaving the "async with" block?
         server.close()
+        # close long-lived (pooled) client connections, else wait_closed waits on them (py3.12+)
+        for writer in list(open_writers):
+            writer.close()
         await server.wait_closed()
+        await scheduler.close()
+        inference_executor.shutdown(wait=False, cancel_futures=True)
 
 if __name__ == "__main__":
     try:
@@ -1,6 +1,8 @@
+from collections import OrderedDict
+
 import torch
 import numpy as np
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import AutoTokenizer, AutoModelForCausalLM, DynamicCache
 from inference.server.helpers import auto_device
 
 # FYI links:
@@ -35,17 +37,7 @@ else:
 model = AutoModelForCausalLM.from_pretrained(model_path, **model_kwargs).to(device).eval()  # type: ignore
 
 # TODO! do some testing of re-ranker memory usage
-#  would it benefit from caching at all?
-#    i.e. when I re-rank the same query across multiple docs, is there a material boost from caching the query?
-#      IIRC query comes first in "prompt" so it would be cacheable
-#      FIM queries are long enough to matter for this
-#    PERHAPS decide request by request if you want to cache?
-#    - i.e. my Semantic Grep telescope picker the query is tiny so not much of a point there
-#    - FIM query is up to 1500 chars
-#    - MAYBE use len(query) to decide on caching?
-#  not sure it would but I suppose my search tool might benefit from it?
-#  but, before optimizing this here, let's test it first
-#  using realistic loads
+#  FYI query caching => see prefix KV cache below (decided per request, by prefix length)
 # model.config.use_cache = False
 # TODO! model.eval() too?
 
@@ -66,22 +58,28 @@ def move_to_gpu(tensors, device):
         tensors[key] = tensors[key].to(device)
     return tensors
 
-def tokenize_docs(instruct: str, query: str, documents: list[str]):
+def tokenize_instruct_query(instruct: str, query: str) -> list[int]:
     if instruct is None or instruct.strip() == "":
         raise ValueError("instruct must be provided")
 
-    # tokenize common prefix once:
     instruct_query = f"<Instruct>: {instruct}\n<Query>: {query}\n<Document>: "
-    instruct_query_tokens = tokenizer.encode(instruct_query, add_special_tokens=False)
+    return tokenizer.encode(instruct_query, add_special_tokens=False)
 
-    # NOTE layout is optimized for cache reuse! instruction/query are constant across a batch of documents
-    documents_tokens = tokenizer(
+def _tokenize_documents(documents: list[str]):
+    return tokenizer(
         documents,
         padding=False,
         truncation='longest_first',
         return_attention_mask=False,
         max_length=max_user_tokens,
     )
+
+def tokenize_docs(instruct: str, query: str, documents: list[str]):
+    # tokenize common prefix once:
+    instruct_query_tokens = tokenize_instruct_query(instruct, query)
+
+    # NOTE layout is optimized for cache reuse! instruction/query are constant across a batch of documents
+    documents_tokens = _tokenize_documents(documents)
     for i, doc_tokens in enumerate(documents_tokens['input_ids']):
         # insert user message contents into the agent trace template (this way I don't have to tokenize the constant parts repeatedly
         documents_tokens['input_ids'][i] = thread_prefix_tokens + instruct_query_tokens + doc_tokens + thread_suffix_tokens
@@ -96,18 +94,108 @@ def compute_relevance_scores(tokenized_inputs):
         logits_no_and_yes = torch.stack([no_logits, yes_logits], dim=1)
         # calculation to turn yes/no token logits into relevance score overall (per document)
         log_softmax = torch.nn.functional.log_softmax(logits_no_and_yes, dim=1)
-        relevance_scores = log_softmax[:, 1].exp().tolist()
+        relevance_scores: np.ndarray = log_softmax[:, 1].exp().float().cpu().numpy()
         return relevance_scores
 
-def rerank(instruct: str, query: str, documents: list[str]) -> tuple[list[float], list[list[np.int64]]]:
+# * prefix KV cache
+# every doc in every batch starts with the same: thread_prefix + instruct/query
+#   => compute its KV once per (instruct, query), reuse across all docs and batches (i.e. of one semantic_grep call)
+#   FIM queries are up to 1500 chars => prefix is most of the FLOPs for typical chunk sized docs
+# short prefix (i.e. telescope picker queries) => not worth the extra forward pass + cache copies, use full forward
+PREFIX_CACHE_MIN_TOKENS = 256
+# ~112KB VRAM per prefix token (28 layers * K/V * 8 kv heads * 128 dims * fp16)
+PREFIX_CACHE_MAX_ENTRIES = 4
+_prefix_kv_by_instruct_query: OrderedDict[tuple[str, str], list[tuple[torch.Tensor, torch.Tensor]]] = OrderedDict()
+
+def clear_prefix_cache():
+    _prefix_kv_by_instruct_query.clear()
+
+def _kv_tensors(cache) -> list[tuple[torch.Tensor, torch.Tensor]]:
+    # FYI DynamicCache internals differ across transformers versions
+    if hasattr(cache, "to_legacy_cache"):
+        return list(cache.to_legacy_cache())
+    return [(layer.keys, layer.values) for layer in cache.layers]
+
+def _get_prefix_kv(instruct: str, query: str, prefix_tokens: list[int]) -> list[tuple[torch.Tensor, torch.Tensor]]:
+    key = (instruct, query)
+    prefix_kv = _prefix_kv_by_instruct_query.get(key)
+    if prefix_kv is not None:
+        _prefix_kv_by_instruct_query.move_to_end(key)
+        return prefix_kv
+
+    with torch.inference_mode():
+        input_ids = torch.tensor([prefix_tokens], device=model.device)
+        outputs = model.model(input_ids=input_ids, use_cache=True)
+        prefix_kv = _kv_tensors(outputs.past_key_values)
+
+    _prefix_kv_by_instruct_query[key] = prefix_kv
+    while len(_prefix_kv_by_instruct_query) > PREFIX_CACHE_MAX_ENTRIES:
+        _prefix_kv_by_instruct_query.popitem(last=False)
+    return prefix_kv
+
+def _expand_prefix_kv(prefix_kv: list[tuple[torch.Tensor, torch.Tensor]], batch_size: int) -> DynamicCache:
+    # expand => view (no copy) of batch 1 prefix, forward pass cats new tokens onto it (new tensors) so prefix_kv is never mutated
+    cache = DynamicCache()
+    for layer_idx, (keys, values) in enumerate(prefix_kv):
+        cache.update(keys.expand(batch_size, -1, -1, -1), values.expand(batch_size, -1, -1, -1), layer_idx)
+    return cache
+
+def tokenize_docs_after_prefix(documents: list[str]) -> tuple[torch.Tensor, torch.Tensor]:
+    """ doc + thread_suffix only, RIGHT padded (prefix is in the KV cache, so padding must come after the doc) """
+    rows = [doc_tokens + thread_suffix_tokens for doc_tokens in _tokenize_documents(documents)['input_ids']]
+    longest = max(len(row) for row in rows)
+    input_ids = torch.full((len(rows), longest), tokenizer.pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(rows), longest), dtype=torch.long)
+    for i, row in enumerate(rows):
+        input_ids[i, :len(row)] = torch.tensor(row, dtype=torch.long)
+        attention_mask[i, :len(row)] = 1
+    return input_ids.to(model.device), attention_mask.to(model.device)
+
+def compute_relevance_scores_after_prefix(prefix_kv, prefix_len: int, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> np.ndarray:
+    batch_size, num_tokens = input_ids.shape
+    device = input_ids.device
+    with torch.inference_mode():
+        past_key_values = _expand_prefix_kv(prefix_kv, batch_size)
+        prefix_mask = torch.ones((batch_size, prefix_len), dtype=attention_mask.dtype, device=device)
+        position_ids = torch.arange(prefix_len, prefix_len + num_tokens, device=device).unsqueeze(0).expand(batch_size, -1)
+        hidden = model.model(
+            input_ids=input_ids,
+            attention_mask=torch.cat([prefix_mask, attention_mask], dim=1),
+            position_ids=position_ids,
+            past_key_values=past_key_values,
+            use_cache=True,
+        ).last_hidden_state
+
+        # right padded => last real token differs per doc
+        last_token_index = attention_mask.sum(dim=1) - 1
+        last_hidden = hidden[torch.arange(batch_size, device=device), last_token_index]
+        # only need yes/no rows of lm_head (not full vocab logits)
+        no_and_yes_weights = model.lm_head.weight[[TOKEN_ID_NO, TOKEN_ID_YES]]
+        logits_no_and_yes = last_hidden @ no_and_yes_weights.T
+        log_softmax = torch.nn.functional.log_softmax(logits_no_and_yes, dim=1)
+        relevance_scores: np.ndarray = log_softmax[:, 1].exp().float().cpu().numpy()
+        return relevance_scores
+
+def rerank(instruct: str, query: str, documents: list[str], use_prefix_cache: bool | None = None) -> tuple[np.ndarray, list[list[np.int64]]]:
+    """ use_prefix_cache=None => decide by prefix length """
 
     # for now assume instruct and query are constant for all documents, if I need mixed batching then I can address that later...
     # and actually I should encourage batching for same instruct/query else cache will be invalidated when instruct/query change
 
-    # TODO check for cancelation
-    tokenized_threads = tokenize_docs(instruct, query, documents)
-    # TODO check for cancellation before rerank
-    return compute_relevance_scores(tokenized_threads), tokenized_threads.input_ids.tolist()
+    prefix_tokens = thread_prefix_tokens + tokenize_instruct_query(instruct, query)
+    if use_prefix_cache is None:
+        use_prefix_cache = len(prefix_tokens) >= PREFIX_CACHE_MIN_TOKENS
+
+    if not use_prefix_cache:
+        # TODO check for cancelation
+        tokenized_threads = tokenize_docs(instruct, query, documents)
+        # TODO check for cancellation before rerank
+        return compute_relevance_scores(tokenized_threads), tokenized_threads.input_ids.tolist()
+
+    prefix_kv = _get_prefix_kv(instruct, query, prefix_tokens)
+    input_ids, attention_mask = tokenize_docs_after_prefix(documents)
+    scores = compute_relevance_scores_after_prefix(prefix_kv, len(prefix_tokens), input_ids, attention_mask)
+    return scores, [prefix_tokens + row for row in input_ids.tolist()]
 
 def main():
     from numpy.testing import assert_array_almost_equal
@@ -132,6 +220,16 @@ def main():
     print("scores2: ", actual_scores2)
     expected_scores2 = [4.947185516357422e-05, 0.99951171875]
     assert_array_almost_equal(actual_scores2, expected_scores2, decimal=3)
+
+    # * prefix cache matches full forward (long query, mixed doc lengths => padding)
+    long_query = query2 + " " + " ".join(["Include how mass and distance affect the force between objects."] * 30)
+    full_scores, _ = rerank(instruct, long_query, documents, use_prefix_cache=False)
+    cached_scores, _ = rerank(instruct, long_query, documents, use_prefix_cache=True)
+    print("full: ", full_scores, "prefix cached: ", cached_scores)
+    assert_array_almost_equal(cached_scores, full_scores, decimal=2)
+    # 2nd batch reuses the prefix KV
+    cached_again, _ = rerank(instruct, long_query, list(reversed(documents)), use_prefix_cache=True)
+    assert_array_almost_equal(cached_again, list(reversed(cached_scores)), decimal=2)
     print("All tests passed")
 
 if __name__ == "__main__":
@@ -0,0 +1,224 @@
+import asyncio
+from collections import deque
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+import numpy as np
+
+from inference.comms import PRIORITIES, PRIORITY_HIGH, estimate_tokens
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+# FYI torch free (model is injected) => testable on CPU w/ a stub model
+
+# (texts) => (embeddings (N, D), input_ids per text)
+EncodeFn = Callable[[list[str]], tuple[np.ndarray, list[list[Any]]]]
+
+# max padded tokens (longest * count) per model call, across all requests in the batch
+EMBED_TOKEN_BUDGET = 16384
+EMBED_MAX_BATCH_SIZE = 128
+# max padded tokens ((prefix + longest doc) * count) per rerank request, advertised to clients (request type 'limits')
+#   clients pack rerank batches up to this => no OOM on long chunks, few round trips for short ones
+RERANK_TOKEN_BUDGET = 16384
+RERANK_MAX_BATCH_SIZE = 64
+# how long the first request waits for others to join its batch
+#   only applies when the model is idle, otherwise requests pile up while it runs (no added wait)
+EMBED_MAX_WAIT_MS = 3
+
+
+@dataclass
+class EmbedJob:
+    texts: list[str]
+    future: asyncio.Future
+    # estimated, i.e. no tokenizer until the model runs
+    longest_tokens: int = field(init=False)
+
+    def __post_init__(self):
+        self.longest_tokens = max((estimate_tokens(t) for t in self.texts), default=0)
+
+
+@dataclass
+class CallJob:
+    # i.e. rerank, hotpath_done => not batched, runs alone
+    func: Callable[..., Any]
+    args: tuple
+    future: asyncio.Future
+
+
+Job = EmbedJob | CallJob
+
+
+class InferenceScheduler:
+    """ single entry point to the models, across clients (LS, MCP server, indexer)
+
+    - micro-batch embed requests: collect pending until token budget is full or max wait passes
+    - run model on the (single) inference worker thread, fan results back out to each request
+    - priority lanes: high (interactive queries/reranks) ALWAYS drains before the next bulk (indexing) batch
+    """
+
+    def __init__(
+        self,
+        encode: EncodeFn,
+        executor: Executor,
+        token_budget: int = EMBED_TOKEN_BUDGET,
+        max_batch_size: int = EMBED_MAX_BATCH_SIZE,
+        max_wait_ms: float = EMBED_MAX_WAIT_MS,
+    ):
+        self.encode = encode
+        self.executor = executor
+        self.token_budget = token_budget
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        # FYI PRIORITIES order is drain order
+        self._lanes: dict[str, deque[Job]] = {priority: deque() for priority in PRIORITIES}
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self.num_model_calls = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        for lane in self._lanes.values():
+            for job in lane:
+                job.future.cancel()
+            lane.clear()
+
+    def queue_depths(self) -> dict[str, int]:
+        return {priority: len(lane) for priority, lane in self._lanes.items()}
+
+    def _enqueue(self, job: Job, priority: str):
+        if priority not in self._lanes:
+            raise ValueError(f"unsupported {priority=}, expected one of {PRIORITIES}")
+        self.start()
+        self._lanes[priority].append(job)
+        self._wakeup.set()
+
+    async def embed(self, texts: list[str], priority: str = PRIORITY_HIGH) -> tuple[np.ndarray, list[list[Any]]]:
+        """ FYI cancelling this before its batch runs => texts are never encoded """
+        job = EmbedJob(texts, asyncio.get_running_loop().create_future())
+        self._enqueue(job, priority)
+        return await job.future
+
+    async def call(self, func: Callable[..., Any], *args, priority: str = PRIORITY_HIGH) -> Any:
+        job = CallJob(func, args, asyncio.get_running_loop().create_future())
+        self._enqueue(job, priority)
+        return await job.future
+
+    def submit(self, func: Callable[..., Any], *args, priority: str = PRIORITY_HIGH) -> asyncio.Future:
+        """ queue a call w/o waiting on it (i.e. fire and forget from a connection's read loop), errors are logged """
+        job = CallJob(func, args, asyncio.get_running_loop().create_future())
+        self._enqueue(job, priority)
+        job.future.add_done_callback(_log_call_error)
+        return job.future
+
+    def _fits(self, batch: list[EmbedJob], job: EmbedJob) -> bool:
+        num_texts = sum(len(j.texts) for j in batch) + len(job.texts)
+        longest = max(max(j.longest_tokens for j in batch), job.longest_tokens)
+        return num_texts <= self.max_batch_size and longest * num_texts <= self.token_budget
+
+    def _take_batch(self, lane: deque[Job], batch: list[Job]) -> bool:
+        """ move jobs from lane into batch while they fit, returns True when batch is full """
+        while lane:
+            job = lane[0]
+            if job.future.done():
+                # cancelled while waiting
+                lane.popleft()
+                continue
+            if isinstance(job, CallJob) or (batch and isinstance(batch[0], CallJob)):
+                # calls run alone
+                if not batch:
+                    batch.append(lane.popleft())
+                return True
+            if batch and not self._fits(batch, job):
+                return True
+            # first job always goes in, even if over budget alone (client already packs batches by budget)
+            batch.append(lane.popleft())
+        return False
+
+    def _next_lane(self) -> str | None:
+        for priority, lane in self._lanes.items():
+            if lane:
+                return priority
+        return None
+
+    async def _next_batch(self) -> tuple[str, list[Job]]:
+        while (priority := self._next_lane()) is None:
+            self._wakeup.clear()
+            await self._wakeup.wait()
+
+        lane = self._lanes[priority]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait_ms / 1000
+        batch: list[Job] = []
+        while not self._take_batch(lane, batch):
+            if priority != PRIORITY_HIGH and self._lanes[PRIORITY_HIGH]:
+                # don't hold up high lane to fill a bulk batch
+                break
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), remaining)
+            except TimeoutError:
+                break
+        return priority, batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            priority, batch = await self._next_batch()
+            batch = [j for j in batch if not j.future.done()]
+            if not batch:
+                continue
+
+            depths = " ".join(f"{p}={n}" for p, n in self.queue_depths().items())
+            self.num_model_calls += 1
+
+            if isinstance(batch[0], CallJob):
+                job = batch[0]
+                logger.info(f"{priority} lane: {job.func.__name__}, queued {depths}")
+                try:
+                    result = await loop.run_in_executor(self.executor, job.func, *job.args)
+                except Exception as e:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                    continue
+                if not job.future.done():
+                    job.future.set_result(result)
+                continue
+
+            texts = [t for job in batch for t in job.texts]
+            logger.info(f"{priority} lane: embed {len(batch)} requests, {len(texts)} texts, queued {depths}")
+            try:
+                embeddings, input_ids = await loop.run_in_executor(self.executor, self.encode, texts)
+            except Exception as e:
+                for job in batch:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                continue
+
+            # * fan out
+            start = 0
+            for job in batch:
+                end = start + len(job.texts)
+                if not job.future.done():
+                    job.future.set_result((embeddings[start:end], input_ids[start:end]))
+                start = end
+
+
+def _log_call_error(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("submitted call failed", exc_info=future.exception())
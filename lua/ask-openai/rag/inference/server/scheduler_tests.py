@@ -0,0 +1,223 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from inference.comms import PRIORITY_BULK, PRIORITY_HIGH
+from inference.server.scheduler import InferenceScheduler
+
+
+class StubModel:
+    """ embedding = [len(text), call number], records each call (batch) it runs """
+
+    def __init__(self):
+        self.calls: list[list[str]] = []
+        self.threads: set[str] = set()
+        # clear to hold the model (i.e. busy w/ a big batch)
+        self.running = threading.Event()
+        self.running.set()
+
+    def encode(self, texts: list[str]):
+        self.running.wait(timeout=5)
+        self.calls.append(texts)
+        self.threads.add(threading.current_thread().name)
+        embeddings = np.array([[len(t), len(self.calls)] for t in texts], dtype=np.float32)
+        input_ids = [[0] * len(t) for t in texts]
+        return embeddings, input_ids
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+    yield executor
+    executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_share_one_model_call(executor):
+    model = StubModel()
+    scheduler = InferenceScheduler(model.encode, executor, max_wait_ms=20)
+    try:
+        results = await asyncio.gather(
+            scheduler.embed(["a", "bb"]),
+            scheduler.embed(["ccc"]),
+            scheduler.embed(["dddd", "eeeee"]),
+        )
+    finally:
+        await scheduler.close()
+
+    assert model.calls == [["a", "bb", "ccc", "dddd", "eeeee"]]
+    assert model.threads == {"inference_0"}
+
+    # * each request gets just its own rows back
+    (first, first_ids), (second, _), (third, _) = results
+    np.testing.assert_array_equal(first, [[1, 1], [2, 1]])
+    np.testing.assert_array_equal(second, [[3, 1]])
+    np.testing.assert_array_equal(third, [[4, 1], [5, 1]])
+    assert first_ids == [[0], [0, 0]]
+
+
+@pytest.mark.asyncio
+async def test_token_budget_splits_batches(executor):
+    model = StubModel()
+    # 40 chars => ~10 tokens each, budget fits 2 per call
+    scheduler = InferenceScheduler(model.encode, executor, token_budget=20, max_wait_ms=20)
+    try:
+        texts = ["x" * 40, "y" * 40, "z" * 40]
+        results = await asyncio.gather(*(scheduler.embed([t]) for t in texts))
+    finally:
+        await scheduler.close()
+
+    assert model.calls == [["x" * 40, "y" * 40], ["z" * 40]]
+    assert [r[0][0, 1] for r in results] == [1, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_oversize_request_still_runs(executor):
+    model = StubModel()
+    scheduler = InferenceScheduler(model.encode, executor, token_budget=1)
+    try:
+        embeddings, _ = await scheduler.embed(["long text over budget"])
+    finally:
+        await scheduler.close()
+
+    assert len(model.calls) == 1
+    assert embeddings.shape == (1, 2)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_request_is_never_encoded(executor):
+    model = StubModel()
+    scheduler = InferenceScheduler(model.encode, executor, max_wait_ms=50)
+    try:
+        cancelled = asyncio.create_task(scheduler.embed(["cancel me"]))
+        kept = asyncio.create_task(scheduler.embed(["keep"]))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+
+        embeddings, _ = await kept
+    finally:
+        await scheduler.close()
+
+    assert model.calls == [["keep"]]
+    np.testing.assert_array_equal(embeddings, [[4, 1]])
+
+
+@pytest.mark.asyncio
+async def test_model_error_fails_its_requests(executor):
+
+    def broken(texts):
+        raise RuntimeError("CUDA out of memory")
+
+    scheduler = InferenceScheduler(broken, executor)
+    try:
+        with pytest.raises(RuntimeError, match="out of memory"):
+            await scheduler.embed(["a"])
+    finally:
+        await scheduler.close()
+
+
+async def wait_for_calls(model: StubModel, num_calls: int):
+    while len(model.calls) < num_calls:
+        await asyncio.sleep(0.001)
+
+
+@pytest.mark.asyncio
+async def test_high_lane_drains_before_next_bulk_batch(executor):
+    model = StubModel()
+    scheduler = InferenceScheduler(model.encode, executor, token_budget=20, max_wait_ms=0)
+    try:
+        model.running.clear()
+        first_bulk = asyncio.create_task(scheduler.embed(["bulk 1"], PRIORITY_BULK))
+        await asyncio.sleep(0.01)  # first bulk batch is now on the model thread
+
+        more_bulk = [asyncio.create_task(scheduler.embed(["x" * 40], PRIORITY_BULK)) for _ in range(3)]
+        query = asyncio.create_task(scheduler.embed(["query"], PRIORITY_HIGH))
+        await asyncio.sleep(0.01)
+        assert scheduler.queue_depths() == {PRIORITY_HIGH: 1, PRIORITY_BULK: 3}
+
+        model.running.set()
+        await asyncio.gather(first_bulk, query, *more_bulk)
+    finally:
+        await scheduler.close()
+
+    assert model.calls == [["bulk 1"], ["query"], ["x" * 40, "x" * 40], ["x" * 40]]
+
+
+@pytest.mark.asyncio
+async def test_calls_run_alone_on_model_thread(executor):
+    model = StubModel()
+    scheduler = InferenceScheduler(model.encode, executor, max_wait_ms=20)
+
+    def rerank(query: str, docs: list[str]):
+        return [float(len(query + d)) for d in docs], threading.current_thread().name
+
+    try:
+        embedded, (scores, thread) = await asyncio.gather(
+            scheduler.embed(["a"]),
+            scheduler.call(rerank, "q", ["d", "dd"]),
+        )
+    finally:
+        await scheduler.close()
+
+    assert model.calls == [["a"]]
+    assert scores == [2.0, 3.0]
+    assert thread == "inference_0"
+    assert scheduler.num_model_calls == 2
+
+
+@pytest.mark.asyncio
+async def test_unknown_priority_is_rejected(executor):
+    scheduler = InferenceScheduler(StubModel().encode, executor)
+    try:
+        with pytest.raises(ValueError, match="priority"):
+            await scheduler.embed(["a"], "urgent")
+    finally:
+        await scheduler.close()
+
+
+@pytest.mark.asyncio
+async def test_submitted_bulk_call_doesnt_hold_up_high_requests(executor):
+    # i.e. hotpath_done is submitted from a connection's read loop, the next request on that connection is a query
+    model = StubModel()
+    scheduler = InferenceScheduler(model.encode, executor, token_budget=20, max_wait_ms=0)
+    ran: list[str] = []
+    try:
+        model.running.clear()
+        first_bulk = asyncio.create_task(scheduler.embed(["bulk 1"], PRIORITY_BULK))
+        await asyncio.sleep(0.01)  # first bulk batch is now on the model thread
+        more_bulk = [asyncio.create_task(scheduler.embed(["x" * 40], PRIORITY_BULK)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+
+        hotpath_done = scheduler.submit(lambda: ran.append("hotpath_done"), priority=PRIORITY_BULK)
+        assert not hotpath_done.done()  # returned w/o waiting on the bulk lane
+        query = asyncio.create_task(scheduler.embed(["query"], PRIORITY_HIGH))
+        await asyncio.sleep(0.01)
+        assert scheduler.queue_depths() == {PRIORITY_HIGH: 1, PRIORITY_BULK: 4}
+
+        model.running.set()
+        await asyncio.gather(first_bulk, query, *more_bulk, hotpath_done)
+    finally:
+        await scheduler.close()
+
+    assert model.calls == [["bulk 1"], ["query"], ["x" * 40, "x" * 40], ["x" * 40]]
+    assert ran == ["hotpath_done"]
+
+
+@pytest.mark.asyncio
+async def test_submitted_call_errors_are_logged(executor, caplog):
+    scheduler = InferenceScheduler(StubModel().encode, executor)
+
+    def fail():
+        raise RuntimeError("boom")
+
+    try:
+        future = scheduler.submit(fail)
+        with pytest.raises(RuntimeError):
+            await future
+    finally:
+        await scheduler.close()
+
+    assert "submitted call failed" in caplog.text
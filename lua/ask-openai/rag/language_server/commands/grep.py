@@ -4,7 +4,7 @@ from pygls.lsp.server import LanguageServer
 
 from logs import get_logger
 from language_server.stoppers import Stopper, create_stopper, remove_stopper
-from inference.client.retrieval import semantic_grep, LSPSemanticGrepRequest
+from inference.client.retrieval import semantic_grep_many, LSPSemanticGrepManyRequest, LSPSemanticGrepRequest
 from index import workspace
 
 logger = get_logger(__name__)
@@ -14,6 +14,14 @@ class LSPSemanticGrepResult:
     """ Either return matches OR an error string, nothing else matters."""
     matches: list = []
     error: str | None = None
+    # candidates adaptive rerank skipped (still in matches, after reranked ones)
+    rerank_skipped: int = 0
+
+@attrs.define
+class LSPSemanticGrepManyResult:
+    """ SemanticGrepResult per query (same order as the request's queries) OR an error string """
+    results: list = []
+    error: str | None = None
 
 class LSPResponseErrors:
     NO_RAG_DIR = "No .rag dir"
@@ -32,6 +40,17 @@ def setup(server: LanguageServer):
             logger.debug(f"Client cancelled semantic_grep query {args.msgId=}")  #, exc_info=e)  # uncomment to see where error is raised
             return LSPSemanticGrepResult(error=LSPResponseErrors.CANCELLED)
 
+    @server.command("semantic_grep_many")
+    async def semantic_grep_many_command(_: LanguageServer, args: LSPSemanticGrepManyRequest) -> LSPSemanticGrepManyResult:
+        args.msgId = server.protocol.msg_id
+        for query in args.queries:
+            query.msgId = args.msgId
+        try:
+            return await grep_many_command(args)
+        except asyncio.CancelledError:
+            logger.debug(f"Client cancelled semantic_grep_many query {args.msgId=}")
+            return LSPSemanticGrepManyResult(error=LSPResponseErrors.CANCELLED)
+
 async def grep_command(args: LSPSemanticGrepRequest) -> LSPSemanticGrepResult:
 
     stopper = create_stopper(args.msgId)
@@ -46,12 +65,35 @@ async def grep_command(args: LSPSemanticGrepRequest) -> LSPSemanticGrepResult:
         stopper.throw_if_stopped()
 
         # TODO REVIEW ASYNC (i.e. for file ops? or other async capable ops)
-        matches = await semantic_grep(
-            args=args,
+        results = await semantic_grep_many(
+            requests=[args],
+            datasets=workspace.datasets,
+            stopper=stopper,
+        )
+
+        return LSPSemanticGrepResult(matches=results[0].matches, rerank_skipped=results[0].rerank_skipped)
+    finally:
+        remove_stopper(args.msgId)
+
+async def grep_many_command(args: LSPSemanticGrepManyRequest) -> LSPSemanticGrepManyResult:
+
+    stopper = create_stopper(args.msgId)
+    try:
+        if workspace.is_no_rag_dir():
+            return LSPSemanticGrepManyResult(error=LSPResponseErrors.NO_RAG_DIR)
+
+        if len(args.queries) == 0 or any(query.query is None or len(query.query) == 0 for query in args.queries):
+            logger.info("No queries provided (or an empty query)")
+            return LSPSemanticGrepManyResult(error="No query provided")
+
+        stopper.throw_if_stopped()
+
+        results = await semantic_grep_many(
+            requests=args.queries,
             datasets=workspace.datasets,
             stopper=stopper,
         )
 
-        return LSPSemanticGrepResult(matches=matches)
+        return LSPSemanticGrepManyResult(results=results)
     finally:
         remove_stopper(args.msgId)
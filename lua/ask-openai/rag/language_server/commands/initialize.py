@@ -5,6 +5,8 @@ from pygls.lsp.server import LanguageServer
 from logs import get_logger
 from index import workspace
 from language_server.commands import update_file
+from inference.client.embedder import configure_query_cache
+from inference.client.retrieval import configure_rerank_cache
 
 logger = get_logger(__name__)
 
@@ -37,7 +39,12 @@ def setup(server: LanguageServer):
             return types.InitializeResult(capabilities=types.ServerCapabilities())
 
         workspace.load_datasets()
+        # LS is the only process that updates datasets
+        workspace.datasets.journal_updates = True
         workspace.validate_datasets()
+        workspace.datasets.start_watching_generations(workspace.get_config().reload_interval_sec)
+        configure_query_cache(workspace.get_config().query_cache_size, workspace.get_config().persist_query_cache)
+        configure_rerank_cache(workspace.get_config().rerank_cache_mb, workspace.get_config().rerank_cache_eviction)
 
     def tell_client_to_shut_that_shit_down_now():
         server.protocol.notify("fuu/no_dot_rag__do_the_right_thing_wink")
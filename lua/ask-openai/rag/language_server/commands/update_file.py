@@ -11,7 +11,7 @@ from chunks.chunker import RAGChunkerOptions, build_chunks_from_lines, get_file_
 from config import RagConfig
 from config.domains import resolve_semantic_domain
 from index import ignores, workspace
-from index.storage import Datasets
+from index.storage import Datasets, FileStat
 from logs import get_logger
 
 logger = get_logger(__name__)
@@ -109,7 +109,15 @@ async def update_file_from_pygls_doc(lsp_doc: TextDocument, options: RAGChunkerO
         #   so really there's no point to ask if changed, b/c only going to be saving materially if altering it
         #   in which case it's always gonna look altered at least LS side
         new_chunks = build_chunks_from_lines(file_path, hash, lsp_doc.lines, options)  # PRN await
-        await _passed_datasets.update_file(file_path, new_chunks)
+        await _passed_datasets.update_file(file_path, new_chunks, file_stat_for(file_path, hash))
+
+def file_stat_for(file_path: Path, hash: str) -> FileStat | None:
+    # FYI journaled w/ the update => indexer sees the file as unchanged (until it's modified again) and doesn't re-embed it
+    try:
+        stat = file_path.stat()
+    except OSError:
+        return None
+    return FileStat(mtime=stat.st_mtime, size=stat.st_size, hash=hash, path=str(file_path))
 
 update_queue: FileUpdateEmbeddingsQueue
 
@@ -132,8 +140,23 @@ async def schedule_update(uri: str):
 
     await update_queue.fire_and_forget(uri)
 
+def prefetch_domain(uri: str):
+    # FYI don't wait on the (debounced) update to load the domain
+    if workspace.datasets is None or not workspace.get_config().prefetch_open_domains:
+        return
+    doc_path = uris.to_fs_path(uri)
+    if doc_path is None:
+        return
+    workspace.datasets.prefetch_for_file(doc_path)
+
 def setup(server: LanguageServer):
 
+    @server.feature(types.SHUTDOWN)
+    def on_shutdown(_params: None):
+        # write-behind journal => don't lose updates still waiting on a flush
+        if workspace.datasets is not None:
+            workspace.datasets.flush_journals()
+
     @server.feature(types.TEXT_DOCUMENT_DID_SAVE)
     async def doc_saved(params: types.DidSaveTextDocumentParams):
         # logger.info(f"doc_saved {params=}")
@@ -142,6 +165,7 @@ def setup(server: LanguageServer):
     @server.feature(types.TEXT_DOCUMENT_DID_OPEN)
     async def doc_opened(params: types.DidOpenTextDocumentParams):
         # logger.info(f"doc_opened {params=}")
+        prefetch_domain(params.text_document.uri)
         await schedule_update(params.text_document.uri)
 
     # @server.feature(types.WORKSPACE_DID_CHANGE_WATCHED_FILES)
@@ -26,10 +26,13 @@ if str(_RAG_ROOT) not in sys.path:
     sys.path.insert(0, str(_RAG_ROOT))
 
 from index.storage import Datasets
+from inference.client.embedder import configure_query_cache
 from inference.client.retrieval import (
     LSPRankedMatch,
     LSPSemanticGrepRequest,
-    semantic_grep as _semantic_grep,
+    SemanticGrepResult,
+    configure_rerank_cache,
+    semantic_grep_many as _semantic_grep_many,
 )
 from index import workspace
 from logs import get_logger, logging_fwk_to_mcp_server_log_file
@@ -44,65 +47,96 @@ logging.getLogger("mcp").setLevel(logging.DEBUG)  # MCP SDK logs
 # BTW! something is broken horribly with CODEX and the fucking MCP server won't show WTF is going on ... it just sends an error notification and codex flips the fuck out about no id so codex clearly does not support JSONRPC notification messages which fuckk.. I dont care anymore for NOW
 #  FIX THIS LATER OR NEVER
 
+SEMANTIC_GREP_QUERY_PROPERTIES: dict[str, Any] = {
+    "query": {
+        "type": "string",
+        "description": "The natural-language or keyword query to search for.",
+    },
+    "current_file_absolute_path": {
+        "type": "string",
+        "description": (
+            "Absolute path of the current file (used to determine which domain "
+            "dataset to search). Pass empty string or omit for global search."
+        ),
+    },
+    "vim_filetype": {
+        "type": "string",
+        "description": (
+            "Vim filetype fallback when current_file_absolute_path is not provided "
+            "(e.g. 'lua', 'py', 'ts')."
+        ),
+    },
+    "domains": {
+        "type": "string",
+        "enum": ["GLOBAL", "EVERYTHING"],
+        "description": (
+            "Search scope. 'GLOBAL' searches _configured_ global_domains from "
+            "rag.yaml. 'EVERYTHING' searches all indexed domains. Leave empty otherwise."
+        ),
+    },
+    "skip_same_file": {
+        "type": "boolean",
+        "description": "When true, exclude matches from the same file as current_file_absolute_path.",
+    },
+    "top_k": {
+        "type": "integer",
+        "description": "Number of final results to return after reranking. Default: 5.",
+    },
+    "embed_top_k": {
+        "type": "integer",
+        "description": (
+            "Number of candidate chunks to retrieve before reranking. "
+            "Defaults to top_k if not specified."
+        ),
+    },
+    "instruct": {
+        "type": "string",
+        "description": (
+            "Instructions for the embedding/reranker model. Must be specific to the "
+            "query type — this is required."
+        ),
+    },
+    "adaptive_rerank": {
+        "type": "boolean",
+        "description": (
+            "When true, stop reranking once the remaining candidates' embedding scores fall well below the current top matches "
+            "(faster, remaining candidates keep embedding order). Defaults to adaptive_rerank.enabled in rag.yaml."
+        ),
+    },
+}
+
 SEMANTIC_GREP_TOOL = Tool(
     name="semantic_grep",
     description=(
         "Search codebase embeddings for semantically relevant code chunks. "
         "Returns ranked matches with file paths, line numbers, and content."
     ),
+    inputSchema={
+        "type": "object",
+        "properties": SEMANTIC_GREP_QUERY_PROPERTIES,
+        "required": ["query", "instruct"],
+    },
+)
+
+SEMANTIC_GREP_MANY_TOOL = Tool(
+    name="semantic_grep_many",
+    description=(
+        "Run several semantic_grep queries at once (each with its own instruct/top_k/domains). "
+        "Much cheaper than one semantic_grep call per query. Returns ranked matches per query."
+    ),
     inputSchema={
         "type": "object",
         "properties": {
-            "query": {
-                "type": "string",
-                "description": "The natural-language or keyword query to search for.",
-            },
-            "current_file_absolute_path": {
-                "type": "string",
-                "description": (
-                    "Absolute path of the current file (used to determine which domain "
-                    "dataset to search). Pass empty string or omit for global search."
-                ),
-            },
-            "vim_filetype": {
-                "type": "string",
-                "description": (
-                    "Vim filetype fallback when current_file_absolute_path is not provided "
-                    "(e.g. 'lua', 'py', 'ts')."
-                ),
-            },
-            "domains": {
-                "type": "string",
-                "enum": ["GLOBAL", "EVERYTHING"],
-                "description": (
-                    "Search scope. 'GLOBAL' searches _configured_ global_domains from "
-                    "rag.yaml. 'EVERYTHING' searches all indexed domains. Leave empty otherwise."
-                ),
-            },
-            "skip_same_file": {
-                "type": "boolean",
-                "description": "When true, exclude matches from the same file as current_file_absolute_path.",
-            },
-            "top_k": {
-                "type": "integer",
-                "description": "Number of final results to return after reranking. Default: 5.",
-            },
-            "embed_top_k": {
-                "type": "integer",
-                "description": (
-                    "Number of candidate chunks to retrieve before reranking. "
-                    "Defaults to top_k if not specified."
-                ),
-            },
-            "instruct": {
-                "type": "string",
-                "description": (
-                    "Instructions for the embedding/reranker model. Must be specific to the "
-                    "query type — this is required."
-                ),
+            "queries": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": SEMANTIC_GREP_QUERY_PROPERTIES,
+                    "required": ["query", "instruct"],
+                },
             },
         },
-        "required": ["query", "instruct"],
+        "required": ["queries"],
     },
 )
 
@@ -128,7 +162,7 @@ def _match_to_text_content(match: LSPRankedMatch) -> dict[str, Any]:
     }
 
 
-async def handle_semantic_grep(
+def _build_request(
     query: str,
     current_file_absolute_path: str | None = None,
     vim_filetype: str | None = None,
@@ -137,9 +171,9 @@ async def handle_semantic_grep(
     top_k: int = 5,
     embed_top_k: int | None = None,
     instruct: str | None = None,
-) -> list[TextContent]:
-    """Execute a semantic_grep query and return formatted results."""
-    # Validate inputs
+    adaptive_rerank: bool | None = None,
+) -> LSPSemanticGrepRequest:
+    """Validate inputs and build the request object using existing types."""
     if not query or len(query) == 0:
         raise ValueError("query is required and cannot be empty")
 
@@ -152,8 +186,7 @@ async def handle_semantic_grep(
     if top_k < 1:
         raise ValueError("top_k must be >= 1")
 
-    # Build the request object using existing types
-    request = LSPSemanticGrepRequest(
+    return LSPSemanticGrepRequest(
         query=query,
         currentFileAbsolutePath=current_file_absolute_path,
         vimFiletype=vim_filetype,
@@ -162,27 +195,34 @@ async def handle_semantic_grep(
         topK=top_k,
         embedTopK=embed_top_k,
         domains=domains,
+        adaptiveRerank=adaptive_rerank,
     )
 
-    # Execute the semantic_grep query (reuse existing function)
-    matches: list[LSPRankedMatch] = await _semantic_grep(
-        args=request,
-        datasets=workspace.datasets,
+
+def _build_request_from_arguments(arguments: dict[str, Any]) -> LSPSemanticGrepRequest:
+    return _build_request(
+        query=arguments.get("query", ""),
+        current_file_absolute_path=arguments.get("current_file_absolute_path") or None,
+        vim_filetype=arguments.get("vim_filetype") or None,
+        domains=arguments.get("domains", "") or "",
+        skip_same_file=arguments.get("skip_same_file", False),
+        top_k=int(arguments.get("top_k", 5)),
+        embed_top_k=arguments.get("embed_top_k"),
+        instruct=arguments.get("instruct"),
+        adaptive_rerank=arguments.get("adaptive_rerank"),
     )
 
+
+def _format_matches(matches: list[LSPRankedMatch], rerank_skipped: int = 0) -> str:
     if not matches:
-        return [
-            TextContent(
-                type="text",
-                text="No matches found for the given query.",
-            )
-        ]
+        return "No matches found for the given query."
 
     # Serialize matches
     result_dicts = [_match_to_text_content(m) for m in matches]
 
     # Format as a single readable response
-    output_lines: list[str] = [f"Found {len(matches)} match(es):\n"]
+    skipped_note = f" ({rerank_skipped} candidate(s) not reranked, kept in embed order)" if rerank_skipped else ""
+    output_lines: list[str] = [f"Found {len(matches)} match(es){skipped_note}:\n"]
     for match_data in result_dicts:
         output_lines.append(
             f"  [{match_data['rerank_rank']}]"
@@ -193,8 +233,60 @@ async def handle_semantic_grep(
             f"\n    {match_data['text'][:200]}"
         )
         output_lines.append("")
+    return "\n".join(output_lines)
 
-    return [TextContent(type="text", text="\n".join(output_lines))]
+
+async def handle_semantic_grep(
+    query: str,
+    current_file_absolute_path: str | None = None,
+    vim_filetype: str | None = None,
+    domains: str = "",
+    skip_same_file: bool = False,
+    top_k: int = 5,
+    embed_top_k: int | None = None,
+    instruct: str | None = None,
+    adaptive_rerank: bool | None = None,
+) -> list[TextContent]:
+    """Execute a semantic_grep query and return formatted results."""
+    request = _build_request(
+        query=query,
+        current_file_absolute_path=current_file_absolute_path,
+        vim_filetype=vim_filetype,
+        domains=domains,
+        skip_same_file=skip_same_file,
+        top_k=top_k,
+        embed_top_k=embed_top_k,
+        instruct=instruct,
+        adaptive_rerank=adaptive_rerank,
+    )
+    return await handle_semantic_grep_request(request)
+
+
+async def handle_semantic_grep_request(request: LSPSemanticGrepRequest) -> list[TextContent]:
+    # Execute the semantic_grep query (reuse existing function)
+    results: list[SemanticGrepResult] = await _semantic_grep_many(
+        requests=[request],
+        datasets=workspace.datasets,
+    )
+
+    return [TextContent(type="text", text=_format_matches(results[0].matches, results[0].rerank_skipped))]
+
+
+async def handle_semantic_grep_many(queries: list[dict[str, Any]]) -> list[TextContent]:
+    """Execute several semantic_grep queries in one batch, one TextContent per query."""
+    if not queries:
+        raise ValueError("queries is required and cannot be empty")
+    requests = [_build_request_from_arguments(arguments) for arguments in queries]
+
+    results: list[SemanticGrepResult] = await _semantic_grep_many(
+        requests=requests,
+        datasets=workspace.datasets,
+    )
+
+    return [
+        TextContent(type="text", text=f"Query {num + 1}: {request.query}\n{_format_matches(result.matches, result.rerank_skipped)}")
+        for num, (request, result) in enumerate(zip(requests, results))
+    ]
 
 
 async def serve(root_dir: str | Path | None = None) -> None:
@@ -226,38 +318,27 @@ async def serve(root_dir: str | Path | None = None) -> None:
 
     workspace.load_datasets()
     workspace.validate_datasets()
+    workspace.datasets.start_watching_generations(workspace.get_config().reload_interval_sec)
+    configure_query_cache(workspace.get_config().query_cache_size, workspace.get_config().persist_query_cache)
+    configure_rerank_cache(workspace.get_config().rerank_cache_mb, workspace.get_config().rerank_cache_eviction)
 
     @server.list_tools()
     async def list_tools() -> list[Tool]:
-        return [SEMANTIC_GREP_TOOL]
+        return [SEMANTIC_GREP_TOOL, SEMANTIC_GREP_MANY_TOOL]
 
     @server.call_tool()
     async def call_tool(requested_tool: str, arguments: dict[str, Any]) -> list[TextContent]:
         try:
+            if requested_tool == SEMANTIC_GREP_MANY_TOOL.name:
+                return await handle_semantic_grep_many(arguments.get("queries") or [])
+
             if requested_tool != SEMANTIC_GREP_TOOL.name:
                 raise ValueError(
-                    f"Unknown tool '{requested_tool}'. Available: {SEMANTIC_GREP_TOOL.name}"
+                    f"Unknown tool '{requested_tool}'. Available: {SEMANTIC_GREP_TOOL.name}, {SEMANTIC_GREP_MANY_TOOL.name}"
                 )
 
-            query: str = arguments.get("query", "")
-            current_file_path: str | None = arguments.get("current_file_absolute_path") or None
-            vim_filetype: str | None = arguments.get("vim_filetype") or None
-            domains: str = arguments.get("domains", "") or ""
-            skip_same_file: bool = arguments.get("skip_same_file", False)
-            top_k: int = int(arguments.get("top_k", 5))
-            embed_top_k: int | None = arguments.get("embed_top_k")
-            instruct: str | None = arguments.get("instruct")
-
-            return await handle_semantic_grep(
-                query=query,
-                current_file_absolute_path=current_file_path,
-                vim_filetype=vim_filetype,
-                domains=domains,
-                skip_same_file=skip_same_file,
-                top_k=top_k,
-                embed_top_k=embed_top_k,
-                instruct=instruct,
-            )
+            # FYI same argument parsing as each query of semantic_grep_many
+            return await handle_semantic_grep_request(_build_request_from_arguments(arguments))
 
         except asyncio.CancelledError:
             logger.info("semantic_grep request was cancelled")